@@ -0,0 +1,228 @@
+import asyncio
+import calendar
+import concurrent.futures
+import datetime
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import urllib.parse
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from google.cloud import bigquery
+
+from daily_counts import DailyCountStore
+import stats
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Size of the chunks that response bodies are streamed in
+CHUNK_SIZE = 64 * 1024
+
+MAX_CACHED_RESPONSES = 1024
+
+
+def _json_default(value):
+    # Format dates the same way as Flask so that both versions of the API return the same responses
+    if isinstance(value, datetime.date):
+        return email.utils.formatdate(calendar.timegm(value.timetuple()), usegmt=True)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class CachedResponse(NamedTuple):
+    chunks: List[bytes]
+    etag: str
+    created: float
+
+
+class StatsApp:
+    """
+    An ASGI version of the statistics API in `main.py`. The BigQuery client does not have an async API, so queries run on a dedicated thread pool,
+    which lets many requests and queries be in flight at the same time without blocking the event loop. All endpoints are refreshed concurrently
+    in the background, and responses are cached already serialized and streamed to the client in chunks.
+    """
+
+    def __init__(self, client: bigquery.Client, daily_counts: DailyCountStore, ttl: float = 60 * 5, refresh_interval: Optional[float] = 60 * 4,
+                 max_concurrent_queries: int = 32):
+        """
+        :param client: The BigQuery client to use for every query.
+        :param daily_counts: Where to store finalized daily definition request counts.
+        :param ttl: Number of seconds a cached response is fresh.
+        :param refresh_interval: Number of seconds between refreshing all endpoints in the background, or None to disable refreshing.
+        :param max_concurrent_queries: Maximum number of BigQuery queries that can run at the same time.
+        """
+        self._client = client
+        self._daily_counts = daily_counts
+        self._ttl = ttl
+        self._refresh_interval = refresh_interval
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent_queries, thread_name_prefix='bigquery')
+        self._routes: Dict[str, Callable[[], Awaitable[Any]]] = {
+            '/definition_requests': self._definition_requests_per_day,
+            '/total_definition_requests': self._total_definition_requests,
+            '/commands_per_day': self._commands_per_day,
+            '/command_usage': self._command_usage,
+            '/dictionary_api_usage': self._dictionary_api_usage
+        }
+        # Cached responses keyed by path and query arguments
+        self._cache: Dict[str, CachedResponse] = {}
+
+        # Responses that are currently being computed, so that concurrent requests for the same response share the same computation
+        self._pending: Dict[str, asyncio.Task] = {}
+
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._handle_request(scope, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self._refresh_interval is not None:
+                    self._refresh_task = asyncio.create_task(self._refresh_periodically())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._refresh_task is not None:
+                    self._refresh_task.cancel()
+                self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle_request(self, scope, send):
+        path = scope['path']
+        if path not in self._routes or scope['method'] not in ('GET', 'HEAD'):
+            await send({'type': 'http.response.start', 'status': 404, 'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Not Found'})
+            return
+
+        key = path + '?' + '&'.join(f'{k}={v}' for k, v in sorted(urllib.parse.parse_qsl(scope['query_string'].decode(), keep_blank_values=True)))
+        try:
+            response = await self._get_response(key, path)
+        except Exception as e:
+            logger.exception(f'Failed to compute "{path}"', exc_info=e)
+            await send({'type': 'http.response.start', 'status': 500, 'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Internal Server Error'})
+            return
+
+        headers = [(b'etag', f'"{response.etag}"'.encode()), (b'access-control-allow-origin', b'*')]
+
+        # Let the client know that the response it has is still up to date
+        request_headers = dict(scope['headers'])
+        if request_headers.get(b'if-none-match') == f'"{response.etag}"'.encode():
+            await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        content_length = sum(len(chunk) for chunk in response.chunks)
+        headers += [(b'content-type', b'application/json'), (b'content-length', str(content_length).encode())]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        if scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        for i, chunk in enumerate(response.chunks):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': i + 1 < len(response.chunks)})
+        if len(response.chunks) == 0:
+            await send({'type': 'http.response.body', 'body': b''})
+
+    async def _get_response(self, key: str, path: str) -> CachedResponse:
+        response = self._cache.get(key)
+        if response is not None and time.time() - response.created <= self._ttl:
+            return response
+        return await self._compute(key, path)
+
+    def _compute(self, key: str, path: str) -> asyncio.Task:
+        if key not in self._pending:
+            task = asyncio.create_task(self._compute_response(key, path))
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+            self._pending[key] = task
+        return self._pending[key]
+
+    async def _compute_response(self, key: str, path: str) -> CachedResponse:
+        data = await self._routes[path]()
+
+        # Serialize in chunks so that large responses can be streamed
+        chunks = []
+        buffer = []
+        buffer_size = 0
+        for piece in json.JSONEncoder(default=_json_default, sort_keys=True).iterencode(data):
+            buffer.append(piece)
+            buffer_size += len(piece)
+            if buffer_size >= CHUNK_SIZE:
+                chunks.append(''.join(buffer).encode())
+                buffer.clear()
+                buffer_size = 0
+        if buffer:
+            chunks.append(''.join(buffer).encode())
+
+        etag = hashlib.sha1()
+        for chunk in chunks:
+            etag.update(chunk)
+        response = CachedResponse(chunks, etag.hexdigest(), time.time())
+        self._cache[key] = response
+
+        # Forget the oldest responses so that requests with many different query arguments can't use up all our memory
+        while len(self._cache) > MAX_CACHED_RESPONSES:
+            del self._cache[next(iter(self._cache))]
+
+        return response
+
+    async def refresh(self):
+        """
+        Compute all responses concurrently.
+        :return:
+        """
+        start_time = time.perf_counter()
+        results = await asyncio.gather(*[self._compute(path + '?', path) for path in self._routes], return_exceptions=True)
+        for path, result in zip(self._routes, results):
+            if isinstance(result, Exception):
+                logger.error(f'Failed to refresh "{path}": {result}')
+        logger.info(f'Refreshed all responses in {time.perf_counter() - start_time:.2f} seconds')
+
+    async def _refresh_periodically(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self._refresh_interval)
+
+    async def _query(self, query: str, job_config: Optional[bigquery.QueryJobConfig] = None) -> list:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: list(self._client.query(query, job_config=job_config).result()))
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def _definition_requests_per_day(self):
+        return stats.build_definition_requests_per_day(await self._query(stats.DEFINITION_REQUESTS_QUERY))
+
+    async def _total_definition_requests(self):
+        today = datetime.datetime.utcnow().date()
+        watermark = await self._run(self._daily_counts.get_watermark)
+        rows = await self._query(stats.TOTAL_DEFINITION_REQUESTS_QUERY, stats.get_total_definition_requests_job_config(watermark))
+        return await self._run(stats.build_total_definition_requests, self._daily_counts, today, watermark, rows)
+
+    async def _commands_per_day(self):
+        return stats.build_commands_per_day(await self._query(stats.COMMANDS_PER_DAY_QUERY, stats.get_commands_per_day_job_config()))
+
+    async def _command_usage(self):
+        return stats.build_command_usage(await self._query(stats.COMMAND_USAGE_QUERY))
+
+    async def _dictionary_api_usage(self):
+        return stats.build_dictionary_api_usage(await self._query(stats.DICTIONARY_API_USAGE_QUERY))
+
+
+def create_app(client: Optional[bigquery.Client] = None, **kwargs) -> StatsApp:
+    return StatsApp(
+        client if client is not None else bigquery.Client(),
+        DailyCountStore(os.environ.get('DAILY_COUNTS_PATH', os.path.join(tempfile.gettempdir(), 'daily_definition_counts.db'))),
+        **kwargs
+    )
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(create_app(), host='localhost', port=8000)
@@ -0,0 +1,281 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import wraps
+from typing import NamedTuple, Optional, Dict, Callable, Iterable, Tuple
+
+from flask import Flask, Response, current_app, request
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    etag: str
+    created: float
+
+
+class CacheStore(ABC):
+    """
+    Storage for cached responses. Stores also provide leases, which are used to make sure that only one worker computes a missing response at a
+    time.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, entry: CacheEntry):
+        raise NotImplementedError
+
+    @abstractmethod
+    def try_acquire_lease(self, key: str, duration: float) -> bool:
+        """
+        Try to acquire the lease for a key. A lease expires after `duration` seconds in case its owner never releases it.
+        :param key:
+        :param duration:
+        :return: True if the lease was acquired, False if somebody else is holding it.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def release_lease(self, key: str):
+        raise NotImplementedError
+
+
+class MemoryStore(CacheStore):
+    """
+    Stores responses in memory. Only shared between the threads of a single process. Once there are more than `max_entries` responses, the
+    oldest ones are removed.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[str, CacheEntry] = {}
+        self._leases: Dict[str, float] = {}
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        return self._entries.get(key)
+
+    def set(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self._max_entries:
+                del self._entries[next(iter(self._entries))]
+
+    def try_acquire_lease(self, key: str, duration: float) -> bool:
+        with self._lock:
+            now = time.time()
+            if self._leases.get(key, 0) > now:
+                return False
+            self._leases[key] = now + duration
+            return True
+
+    def release_lease(self, key: str):
+        with self._lock:
+            self._leases.pop(key, None)
+
+
+class SQLiteStore(CacheStore):
+    """
+    Stores responses in an SQLite database so that they are shared between all worker processes on the same machine.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, body BLOB, etag TEXT, created REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections can't be shared between threads, so each thread gets its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=10)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        row = self._connect().execute('SELECT body, etag, created FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(*row)
+
+    def set(self, key: str, entry: CacheEntry):
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)', (key, entry.body, entry.etag, entry.created))
+
+    def try_acquire_lease(self, key: str, duration: float) -> bool:
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('DELETE FROM leases WHERE key = ? AND expires <= ?', (key, now))
+            cursor = connection.execute('INSERT OR IGNORE INTO leases VALUES (?, ?)', (key, now + duration))
+            return cursor.rowcount == 1
+
+    def release_lease(self, key: str):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM leases WHERE key = ?', (key,))
+
+
+class ResponseCache:
+    """
+    Caches the JSON responses of Flask views. Responses are keyed by route and query arguments and are stored already serialized, along with an
+    ETag so that clients can revalidate them with `If-None-Match`.
+
+    A response is fresh for `ttl` seconds. After that, and for up to `stale_ttl` more seconds, the stale response is still served while a new one
+    is computed in the background. Only one worker computes a response at a time, the others wait for it to finish.
+    """
+
+    def __init__(self, store: CacheStore, ttl: float, stale_ttl: float, compute_timeout: float = 120):
+        """
+        :param store: Where to store the cached responses.
+        :param ttl: Number of seconds a response is fresh.
+        :param stale_ttl: Number of seconds after a response becomes stale that it can still be served.
+        :param compute_timeout: Maximum number of seconds to wait for another worker to compute a response.
+        """
+        self._store = store
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._compute_timeout = compute_timeout
+
+        # Cached views by endpoint name
+        self._views: Dict[str, Callable] = {}
+
+    @staticmethod
+    def _make_key(path: str, args: Iterable[Tuple[str, str]]) -> str:
+        return path + '?' + '&'.join(f'{k}={v}' for k, v in sorted(args))
+
+    def _compute(self, app: Flask, key: str, function: Callable, *args, **kwargs) -> CacheEntry:
+        with app.app_context():
+            body = app.json.dumps(function(*args, **kwargs)).encode()
+        entry = CacheEntry(body, hashlib.sha1(body).hexdigest(), time.time())
+
+        # Replacing the entry is atomic, so requests see either the old or the new response
+        self._store.set(key, entry)
+
+        return entry
+
+    def refresh(self, app: Flask, max_age: float = 0):
+        """
+        Compute and store the responses of all cached views that don't take any arguments. Views that are currently being computed by somebody
+        else are skipped.
+        :param app:
+        :param max_age: Responses that were computed less than this many seconds ago are skipped, for example because another worker just
+        refreshed them.
+        :return:
+        """
+        for rule in app.url_map.iter_rules():
+            function = self._views.get(rule.endpoint)
+            if function is None or rule.arguments:
+                continue
+            key = self._make_key(rule.rule, [])
+            entry = self._store.get(key)
+            if entry is not None and entry.created > time.time() - max_age:
+                continue
+            if not self._store.try_acquire_lease(key, self._compute_timeout):
+                continue
+            try:
+                start_time = time.perf_counter()
+                self._compute(app, key, function)
+                logger.info(f'Refreshed "{key}" in {time.perf_counter() - start_time:.2f} seconds')
+            except Exception as e:
+                logger.exception(f'Failed to refresh "{key}"', exc_info=e)
+            finally:
+                self._store.release_lease(key)
+
+    def start_refresher(self, app: Flask, interval: float):
+        """
+        Start a background thread that refreshes all cached views every `interval` seconds. If the interval is shorter than the TTL, requests are
+        always served from the cache. Responses that are younger than the interval are not refreshed, so workers that share a store don't all
+        compute the same responses.
+        :param app:
+        :param interval:
+        :return:
+        """
+        def run():
+            while True:
+                self.refresh(app, max_age=interval)
+                time.sleep(interval)
+
+        threading.Thread(target=run, name='response-cache-refresher', daemon=True).start()
+
+    def cached(self, function):
+        """
+        Decorator for Flask views that return JSON serializable data.
+        :param function:
+        :return:
+        """
+
+        self._views[function.__name__] = function
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            key = self._make_key(request.path, request.args.items(multi=True))
+            app = current_app._get_current_object()
+
+            def compute() -> CacheEntry:
+                return self._compute(app, key, function, *args, **kwargs)
+
+            entry = self._store.get(key)
+            age = time.time() - entry.created if entry is not None else None
+
+            if entry is None or age > self._ttl + self._stale_ttl:
+                entry = self._compute_once(key, compute)
+            elif age > self._ttl:
+                self._refresh_in_background(key, compute)
+
+            response = Response(entry.body, mimetype='application/json')
+            response.set_etag(entry.etag)
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            return response.make_conditional(request)
+
+        return wrapper
+
+    def _compute_once(self, key: str, compute) -> CacheEntry:
+        deadline = time.time() + self._compute_timeout
+        while True:
+            if self._store.try_acquire_lease(key, self._compute_timeout):
+                try:
+                    # Somebody else may have finished computing the response just before we acquired the lease
+                    entry = self._get_fresh(key)
+                    return entry if entry is not None else compute()
+                finally:
+                    self._store.release_lease(key)
+
+            # Somebody else is computing this response, wait for them to finish
+            time.sleep(0.1)
+            entry = self._get_fresh(key)
+            if entry is not None:
+                return entry
+            if time.time() > deadline:
+                logger.warning(f'Timed out waiting for "{key}" to be computed')
+                return compute()
+
+    def _get_fresh(self, key: str) -> Optional[CacheEntry]:
+        entry = self._store.get(key)
+        if entry is not None and time.time() - entry.created <= self._ttl:
+            return entry
+        return None
+
+    def _refresh_in_background(self, key: str, compute):
+        if not self._store.try_acquire_lease(key, self._compute_timeout):
+            return
+
+        def refresh():
+            try:
+                compute()
+            except Exception as e:
+                logger.exception(f'Failed to refresh "{key}"', exc_info=e)
+            finally:
+                self._store.release_lease(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
@@ -0,0 +1,61 @@
+import datetime
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class DailyCountStore:
+    """
+    Stores daily counts that will not change anymore in an SQLite database, along with a watermark of the last day that was stored. This way only
+    the days after the watermark need to be queried again.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS daily_counts (day TEXT PRIMARY KEY, cnt INTEGER)')
+            connection.execute('CREATE TABLE IF NOT EXISTS watermark (id INTEGER PRIMARY KEY CHECK (id = 0), day TEXT)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # Using a connection in a with statement only commits or rolls back, so each thread keeps one open connection instead of opening one
+        # for every query
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=10)
+            self._local.connection = connection
+        return connection
+
+    def get_watermark(self) -> Optional[datetime.date]:
+        """
+        :return: The last day whose count has been stored, or None if nothing has been stored yet.
+        """
+        with self._connect() as connection:
+            row = connection.execute('SELECT day FROM watermark WHERE id = 0').fetchone()
+        return datetime.date.fromisoformat(row[0]) if row is not None else None
+
+    def add(self, counts: Iterable[Tuple[datetime.date, int]], watermark: datetime.date):
+        """
+        Store the counts of finalized days and move the watermark forward.
+        :param counts: The count for each day. Days without a count are assumed to be 0.
+        :param watermark: The last day that is included in `counts`.
+        :return:
+        """
+        with self._connect() as connection:
+            connection.executemany('INSERT OR REPLACE INTO daily_counts VALUES (?, ?)', [(day.isoformat(), cnt) for day, cnt in counts])
+            connection.execute('INSERT OR REPLACE INTO watermark VALUES (0, ?)', (watermark.isoformat(),))
+
+    def get_total_until(self, day: datetime.date) -> int:
+        """
+        :return: The sum of the stored counts up to and including `day`.
+        """
+        with self._connect() as connection:
+            return connection.execute('SELECT IFNULL(SUM(cnt), 0) FROM daily_counts WHERE day <= ?', (day.isoformat(),)).fetchone()[0]
+
+    def get_counts_after(self, day: datetime.date) -> Dict[datetime.date, int]:
+        """
+        :return: The stored count for each day after `day`.
+        """
+        with self._connect() as connection:
+            rows = connection.execute('SELECT day, cnt FROM daily_counts WHERE day > ?', (day.isoformat(),)).fetchall()
+        return {datetime.date.fromisoformat(day): cnt for day, cnt in rows}
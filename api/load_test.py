@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import os
+import statistics
+import tempfile
+import threading
+import time
+from typing import List
+from unittest import mock
+
+from google.cloud import bigquery
+
+PATHS = ['/definition_requests', '/total_definition_requests', '/commands_per_day', '/command_usage', '/dictionary_api_usage']
+
+
+class FakeQueryJob:
+
+    def __init__(self, rows: list, latency: float):
+        self._rows = rows
+        self._latency = latency
+
+    def result(self):
+        time.sleep(self._latency)
+        return self._rows
+
+
+class FakeBigQueryClient:
+    """
+    Returns canned rows for every statistics query after waiting for `latency` seconds, so that the servers can be compared without BigQuery.
+    """
+
+    def __init__(self, latency: float):
+        self._latency = latency
+        today = datetime.datetime.utcnow().date()
+        days = [today - datetime.timedelta(days=i) for i in range(180)]
+        self._rows = {
+            'definition_requests': [{'period': day, 'cnt': 100} for day in days],
+            'GROUP BY period': [{'period': day, 'cnt': 100} for day in days],
+            'command_names': [{'command_name': name, 'd': day, 'text_count': 10, 'slash_count': 20} for name in ['define', 'translate', 'say'] for day in days],
+            'GROUP BY command_name': [{'command_name': name, 'cnt': 1000} for name in ['define', 'translate', 'say', 'stop', 'settings']],
+            'GROUP BY api_name': [{'api_name': name, 'cnt': 1000} for name in ['owlbot', 'unofficial_google', 'merriam_webster']]
+        }
+
+    def query(self, query: str, job_config=None) -> FakeQueryJob:
+        # Match the most specific fragment first
+        for fragment in ['command_names', 'GROUP BY command_name', 'GROUP BY api_name', 'GROUP BY period', 'definition_requests']:
+            if fragment in query:
+                return FakeQueryJob(self._rows[fragment], self._latency)
+        raise ValueError(f'Unexpected query: {query}')
+
+
+def print_results(name: str, latencies: List[float], duration: float):
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f'{name}: {len(latencies) / duration:.1f} requests/second, p50 = {quantiles[49] * 1000:.1f} ms, p99 = {quantiles[98] * 1000:.1f} ms')
+
+
+def run_flask(client: FakeBigQueryClient, requests: int, workers: int, cached: bool):
+    with mock.patch.object(bigquery, 'Client', return_value=client):
+        import main
+    app = main.create_app(refresh_interval=None)
+
+    local = threading.local()
+
+    def get(i: int) -> float:
+        # Each worker thread models a synchronous worker, like the ones gunicorn uses
+        test_client = getattr(local, 'client', None)
+        if test_client is None:
+            test_client = local.client = app.test_client()
+        path = PATHS[i % len(PATHS)] + ('' if cached else f'?n={i}')
+        start_time = time.perf_counter()
+        response = test_client.get(path)
+        assert response.status_code == 200
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        latencies = list(executor.map(get, range(requests)))
+    print_results(f'Flask ({workers} workers)', latencies, time.perf_counter() - start_time)
+
+
+async def run_asgi(client: FakeBigQueryClient, requests: int, concurrency: int, cached: bool):
+    import asgi
+    app = asgi.create_app(client, refresh_interval=None)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get(i: int) -> float:
+        path = PATHS[i % len(PATHS)]
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'' if cached else f'n={i}'.encode(), 'headers': []}
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        async with semaphore:
+            start_time = time.perf_counter()
+            await app(scope, None, send)
+            assert messages[0]['status'] == 200
+            return time.perf_counter() - start_time
+
+    if cached:
+        await app.refresh()
+
+    start_time = time.perf_counter()
+    latencies = await asyncio.gather(*[get(i) for i in range(requests)])
+    print_results(f'ASGI ({concurrency} concurrent requests)', latencies, time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the throughput of the Flask and ASGI versions of the statistics API using a fake BigQuery client.')
+    parser.add_argument('--requests', type=int, default=500, help='Number of requests to send to each server.')
+    parser.add_argument('--latency', type=float, default=0.2, help='Number of seconds each fake BigQuery query takes.')
+    parser.add_argument('--flask-workers', type=int, default=8, help='Number of synchronous Flask workers.')
+    parser.add_argument('--concurrency', type=int, default=64, help='Maximum number of concurrent requests to the ASGI server.')
+    parser.add_argument('--cached', action='store_true', help='Request the same responses repeatedly instead of bypassing the caches.')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DAILY_COUNTS_PATH', os.path.join(tempfile.mkdtemp(), 'daily_definition_counts.db'))
+    client = FakeBigQueryClient(args.latency)
+
+    run_flask(client, args.requests, args.flask_workers, args.cached)
+    asyncio.run(run_asgi(client, args.requests, args.concurrency, args.cached))
+
+
+if __name__ == '__main__':
+    main()
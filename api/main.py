@@ -1,9 +1,15 @@
 import datetime
-from functools import wraps
+import os
+import tempfile
+from typing import Optional
 
-from flask import Flask, jsonify
+from flask import Flask
 from google.cloud import bigquery
 
+from cache import ResponseCache, MemoryStore, SQLiteStore
+from daily_counts import DailyCountStore
+import stats
+
 
 app = Flask(__name__)
 
@@ -12,145 +18,64 @@ bigquery_client = bigquery.Client()
 
 DEFAULT_CACHE_MINUTES = 5
 
+# Daily definition request counts for days that are over
+daily_definition_counts = DailyCountStore(os.environ.get('DAILY_COUNTS_PATH', os.path.join(tempfile.gettempdir(), 'daily_definition_counts.db')))
 
-def cache(time):
-
-    def decorator(function):
-
-        cache = {}
-
-        @wraps(function)
-        def wrapper(*args, **kwargs):
-
-            if function in cache and datetime.datetime.now() - cache[function]['last_call_time'] < time:
-                return cache[function]['result']
-
-            result = function(*args, **kwargs)
-
-            cache[function] = {
-                'result': result,
-                'last_call_time': datetime.datetime.now()
-            }
-
-            return result
-
-        return wrapper
-    return decorator
+# Refresh all responses in the background a bit more often than they expire, so requests never have to wait for BigQuery
+REFRESH_INTERVAL_MINUTES = 4
 
-
-def row_to_dict(row):
-    return {k: v for k, v in row.items()}
-
-
-def get_days_in_range(start: datetime.datetime, end: datetime.datetime) -> [datetime.date]:
-    days = []
-
-    # Align start and end to start of day
-    start = datetime.date(start.year, start.month, start.day)
-    end = datetime.date(end.year, end.month, end.day)
-
-    while start <= end:
-        days.append(start)
-        start += datetime.timedelta(days=1)
-
-    return days
+# Responses are shared between worker processes if a cache database path is provided
+response_cache = ResponseCache(
+    SQLiteStore(os.environ['STATS_CACHE_PATH']) if 'STATS_CACHE_PATH' in os.environ else MemoryStore(),
+    ttl=datetime.timedelta(minutes=DEFAULT_CACHE_MINUTES).total_seconds(),
+    stale_ttl=datetime.timedelta(hours=1).total_seconds()
+)
 
 
 @app.route('/definition_requests')
-@cache(time=datetime.timedelta(minutes=DEFAULT_CACHE_MINUTES))
+@response_cache.cached
 def definition_requests_per_day():
-    query = 'SELECT period, SUM(cnt) AS cnt FROM (' \
-            'SELECT DATE(time) as period, COUNT(time) AS cnt FROM analytics.definition_requests GROUP BY period ' \
-            'UNION ALL ' \
-            'SELECT period, 0 FROM UNNEST(GENERATE_DATE_ARRAY(DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH), current_date())) period' \
-            ') WHERE DATE(period) > DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH) GROUP BY period ORDER BY period'
-    rows = []
-    for row in bigquery_client.query(query):
-        rows.append(row_to_dict(row))
-    response = jsonify(rows)
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    return response
+    return stats.build_definition_requests_per_day(bigquery_client.query(stats.DEFINITION_REQUESTS_QUERY).result())
 
 
 @app.route('/total_definition_requests')
-@cache(time=datetime.timedelta(minutes=DEFAULT_CACHE_MINUTES))
+@response_cache.cached
 def total_definition_requests():
-    result = bigquery_client.query('SELECT COUNT(*) FROM analytics.definition_requests WHERE DATE(time) <= DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH)')
-    for x in result:
-        total = x[0]
-        break
-    query = 'SELECT period, SUM(cnt) AS cnt FROM (' \
-            'SELECT DATE(time) as period, COUNT(time) AS cnt FROM analytics.definition_requests GROUP BY period ' \
-            'UNION ALL ' \
-            'SELECT period, 0 FROM UNNEST(GENERATE_DATE_ARRAY(DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH), current_date())) period' \
-            ') WHERE DATE(period) > DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH) GROUP BY period ORDER BY period'
-    results = bigquery_client.query(query).result()
-    rows = []
-    for row in results:
-        d = row_to_dict(row)
-        total += d['cnt']
-        d['cnt'] = total
-        rows.append(d)
-    response = jsonify(rows)
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    return response
+    today = datetime.datetime.utcnow().date()
+    watermark = daily_definition_counts.get_watermark()
+    rows = bigquery_client.query(stats.TOTAL_DEFINITION_REQUESTS_QUERY, job_config=stats.get_total_definition_requests_job_config(watermark)).result()
+    return stats.build_total_definition_requests(daily_definition_counts, today, watermark, rows)
 
 
 @app.route('/commands_per_day')
-@cache(time=datetime.timedelta(minutes=DEFAULT_CACHE_MINUTES))
+@response_cache.cached
 def commands_per_day():
-
-    # Get unique commands
-    command_names = [row.get('command_name') for row in bigquery_client.query('SELECT DISTINCT command_name FROM analytics.commands').result()]
-    print(command_names)
-    command_names = filter(lambda item: item not in ['list', 'set', 'voices', 'languages', 'property'], command_names)
-
-    # Find commands per day for each command
-    result = {}
-    for command_name in command_names:
-        # Get all days since beginning
-        usage = {date: {'text_count': 0, 'slash_count': 0} for date in get_days_in_range(datetime.datetime(2021, 1, 1), datetime.datetime.today())}
-        query = 'SELECT DATE(time) as d, COUNTIF(NOT is_slash) as cnt, COUNTIF(is_slash) as slash_cnt FROM analytics.commands WHERE command_name = @command_name GROUP BY d ORDER BY d'
-        job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ScalarQueryParameter('command_name', "STRING", command_name)])
-        for row in bigquery_client.query(query, job_config=job_config).result():
-            d = row_to_dict(row)
-            usage[d['d']]['text_count'] = d['cnt']
-            usage[d['d']]['slash_count'] = d['slash_cnt']
-        result[command_name] = [{'date': date, **usage[date]} for date in usage.keys()]
-
-    response = jsonify(result)
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    return response
+    return stats.build_commands_per_day(bigquery_client.query(stats.COMMANDS_PER_DAY_QUERY, job_config=stats.get_commands_per_day_job_config()).result())
 
 
 @app.route('/command_usage')
-@cache(time=datetime.timedelta(minutes=DEFAULT_CACHE_MINUTES))
+@response_cache.cached
 def command_usage():
-    results = bigquery_client.query('SELECT command_name, COUNT(*) AS cnt FROM analytics.commands GROUP BY command_name')
-    rows = []
-    for row in results:
-        d = row_to_dict(row)
-        if d['command_name'] not in ['define', 'translate', 'say', 'stop', 'settings']:
-            continue
-        rows.append(d)
-
-    response = jsonify(rows)
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    return response
+    return stats.build_command_usage(bigquery_client.query(stats.COMMAND_USAGE_QUERY).result())
 
 
 @app.route('/dictionary_api_usage')
-@cache(time=datetime.timedelta(minutes=DEFAULT_CACHE_MINUTES))
+@response_cache.cached
 def dictionary_api_usage():
-    result = {}
-    for row in bigquery_client.query('SELECT api_name, COUNT(api_name) as cnt FROM `analytics.dictionary_api_requests` WHERE DATE(time) > DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH) GROUP BY api_name').result():
-        d = row_to_dict(row)
-        result[d['api_name']] = d['cnt']
+    return stats.build_dictionary_api_usage(bigquery_client.query(stats.DICTIONARY_API_USAGE_QUERY).result())
+
 
-    response = jsonify(result)
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    return response
+def create_app(refresh_interval: Optional[float] = datetime.timedelta(minutes=REFRESH_INTERVAL_MINUTES).total_seconds()) -> Flask:
+    """
+    Start refreshing the cached responses in the background and return the app. This is the entry point of the server, so that importing this
+    module doesn't start any threads.
+    :param refresh_interval: Number of seconds between refreshing all responses, or None to disable refreshing.
+    :return:
+    """
+    if refresh_interval is not None:
+        response_cache.start_refresher(app, interval=refresh_interval)
+    return app
 
 
 if __name__ == '__main__':
-    app.run('localhost')
+    create_app().run('localhost')
@@ -0,0 +1,120 @@
+import calendar
+import datetime
+from typing import Iterable, List, Dict, Any, Optional
+
+from google.cloud import bigquery
+
+from daily_counts import DailyCountStore
+
+# Days are only considered to be over a little while after they end, since analytics are uploaded in batches
+FINALIZATION_DELAY_DAYS = 2
+
+DEFINITION_REQUESTS_QUERY = 'SELECT period, SUM(cnt) AS cnt FROM (' \
+                            'SELECT DATE(time) as period, COUNT(time) AS cnt FROM analytics.definition_requests GROUP BY period ' \
+                            'UNION ALL ' \
+                            'SELECT period, 0 FROM UNNEST(GENERATE_DATE_ARRAY(DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH), current_date())) period' \
+                            ') WHERE DATE(period) > DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH) GROUP BY period ORDER BY period'
+
+TOTAL_DEFINITION_REQUESTS_QUERY = 'SELECT DATE(time) AS period, COUNT(*) AS cnt FROM analytics.definition_requests WHERE DATE(time) > @watermark GROUP BY period'
+
+# Count the usage of every command on every day since the beginning. Days without any usage are filled in with zeros by cross joining all
+# command names with all days, so the whole result is computed by a single query.
+COMMANDS_PER_DAY_QUERY = 'WITH command_names AS (' \
+                         'SELECT DISTINCT command_name FROM analytics.commands WHERE command_name NOT IN UNNEST(@excluded_commands)' \
+                         '), days AS (' \
+                         'SELECT d FROM UNNEST(GENERATE_DATE_ARRAY(@start_date, CURRENT_DATE())) AS d' \
+                         '), counts AS (' \
+                         'SELECT command_name, DATE(time) AS d, COUNTIF(NOT is_slash) AS text_count, COUNTIF(is_slash) AS slash_count ' \
+                         'FROM analytics.commands WHERE DATE(time) >= @start_date GROUP BY command_name, d' \
+                         ') ' \
+                         'SELECT command_name, d, IFNULL(text_count, 0) AS text_count, IFNULL(slash_count, 0) AS slash_count ' \
+                         'FROM command_names CROSS JOIN days LEFT JOIN counts USING (command_name, d) ' \
+                         'ORDER BY command_name, d'
+
+COMMAND_USAGE_QUERY = 'SELECT command_name, COUNT(*) AS cnt FROM analytics.commands GROUP BY command_name'
+
+DICTIONARY_API_USAGE_QUERY = 'SELECT api_name, COUNT(api_name) as cnt FROM `analytics.dictionary_api_requests` WHERE DATE(time) > DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH) GROUP BY api_name'
+
+
+def row_to_dict(row):
+    return {k: v for k, v in row.items()}
+
+
+def subtract_months(date: datetime.date, months: int) -> datetime.date:
+    """
+    Subtract months from a date the same way BigQuery's DATE_SUB does, clamping the day to the end of the month if necessary.
+    """
+    month_index = date.year * 12 + date.month - 1 - months
+    year, month = divmod(month_index, 12)
+    return datetime.date(year, month + 1, min(date.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def build_definition_requests_per_day(rows: Iterable) -> List[Dict[str, Any]]:
+    return [row_to_dict(row) for row in rows]
+
+
+def get_total_definition_requests_job_config(watermark: Optional[datetime.date]) -> bigquery.QueryJobConfig:
+    # Only query the days that have not been finalized yet. On the very first call this counts every day.
+    return bigquery.QueryJobConfig(query_parameters=[bigquery.ScalarQueryParameter('watermark', 'DATE', watermark or datetime.date.min)])
+
+
+def build_total_definition_requests(store: DailyCountStore, today: datetime.date, watermark: Optional[datetime.date], rows: Iterable) -> List[Dict[str, Any]]:
+    """
+    Store the days that are over and compute the running total of definition requests for each day in the last 6 months.
+    :param store:
+    :param today:
+    :param watermark: The watermark of the store when `rows` were queried.
+    :param rows: The result of `TOTAL_DEFINITION_REQUESTS_QUERY`.
+    :return:
+    """
+    start = subtract_months(today, 6)
+    recent_counts = {row['period']: row['cnt'] for row in rows}
+
+    # Store the days that will not change anymore
+    finalized_until = today - datetime.timedelta(days=FINALIZATION_DELAY_DAYS)
+    if watermark is None or finalized_until > watermark:
+        store.add([(day, cnt) for day, cnt in recent_counts.items() if day <= finalized_until], finalized_until)
+
+    # The start of this range is always finalized, so everything up to it is stored
+    counts = store.get_counts_after(start)
+    counts.update({day: cnt for day, cnt in recent_counts.items() if day > start})
+    total = store.get_total_until(start)
+    result = []
+    day = start + datetime.timedelta(days=1)
+    while day <= today:
+        total += counts.get(day, 0)
+        result.append({'period': day, 'cnt': total})
+        day += datetime.timedelta(days=1)
+    return result
+
+
+def get_commands_per_day_job_config() -> bigquery.QueryJobConfig:
+    return bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter('excluded_commands', 'STRING', ['list', 'set', 'voices', 'languages', 'property']),
+        bigquery.ScalarQueryParameter('start_date', 'DATE', datetime.date(2021, 1, 1))
+    ])
+
+
+def build_commands_per_day(rows: Iterable) -> Dict[str, List[Dict[str, Any]]]:
+    result = {}
+    for row in rows:
+        result.setdefault(row['command_name'], []).append({'date': row['d'], 'text_count': row['text_count'], 'slash_count': row['slash_count']})
+    return result
+
+
+def build_command_usage(rows: Iterable) -> List[Dict[str, Any]]:
+    result = []
+    for row in rows:
+        d = row_to_dict(row)
+        if d['command_name'] not in ['define', 'translate', 'say', 'stop', 'settings']:
+            continue
+        result.append(d)
+    return result
+
+
+def build_dictionary_api_usage(rows: Iterable) -> Dict[str, int]:
+    result = {}
+    for row in rows:
+        d = row_to_dict(row)
+        result[d['api_name']] = d['cnt']
+    return result
@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Awaitable, Dict, List, Optional
+from unittest import mock
+
+from google.cloud import firestore, texttospeech, translate_v2
+
+from discord_dictionary_bot.analytics import tables
+from discord_dictionary_bot.cache import Cache, MemoryCache, MappedFileCache, SQLiteCache
+from discord_dictionary_bot.cogs import dictionary
+from discord_dictionary_bot.dictionary_api import SequentialDictionaryAPI
+from discord_dictionary_bot.discord_bot_client import DiscordBotClient
+from .fakes import Latency, FakeDictionaryAPI, FakeTranslateClient, FakeTextToSpeechClient, FakeFirestoreClient, FakeGuild, FakeTextChannel, FakeVoiceChannel, \
+    FakeMember, FakeInteraction, make_text_to_speech_pcm, make_convert
+from .mock_servers import MockDictionaryServer, BackendBehavior
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+RESULTS_DIRECTORY = Path(__file__).parent / 'results'
+
+WORDS = ['apple', 'banana', 'cherry', 'dog', 'elephant', 'forest', 'guitar', 'house', 'island', 'jungle', 'kite', 'lemon', 'mountain', 'night',
+         'ocean', 'piano', 'quiet', 'river', 'sun', 'tree']
+
+
+class LoopLagMonitor:
+    """
+    Measures how long the event loop is blocked by repeatedly sleeping for a short interval and measuring how late it wakes up.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self._interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._blocked_time = 0.0
+        self._max_lag = 0.0
+        self._sleep_start_time = 0.0
+
+    @property
+    def blocked_time(self) -> float:
+        return self._blocked_time
+
+    @property
+    def max_lag(self) -> float:
+        return self._max_lag
+
+    def _record(self, lag: float):
+        self._blocked_time += lag
+        self._max_lag = max(self._max_lag, lag)
+
+    async def _run(self):
+        while True:
+            self._sleep_start_time = time.perf_counter()
+            await asyncio.sleep(self._interval)
+            self._record(max(0.0, time.perf_counter() - self._sleep_start_time - self._interval))
+
+    def __enter__(self):
+        self._sleep_start_time = time.perf_counter()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._task.cancel()
+
+        # The loop may have been blocked since the last time we woke up
+        self._record(max(0.0, time.perf_counter() - self._sleep_start_time - self._interval))
+
+
+class Environment:
+    """
+    A bot whose Discord, Google Cloud and dictionary API dependencies are all replaced with local fakes. If `http_backends` is True, the real
+    dictionary API classes are used and send their requests to a local mock server.
+    """
+
+    def __init__(self, args, http_backends: bool = False):
+        self._args = args
+        self._http_backends = http_backends
+        self._exit_stack = contextlib.ExitStack()
+        self.firestore_client = FakeFirestoreClient(Latency(args.firestore_latency))
+        self.dictionary_server: Optional[MockDictionaryServer] = None
+        self.dictionary_apis = []
+        self.cache: Optional[Cache] = None
+        self.bot: Optional[DiscordBotClient] = None
+        self.cog: Optional[dictionary.Dictionary] = None
+        self.guilds = [FakeGuild() for _ in range(args.guilds)]
+        self.text_channels = [FakeTextChannel(guild) for guild in self.guilds]
+        self.voice_channels = [FakeVoiceChannel(guild, Latency(args.voice_connect_latency), args.playback_duration) for guild in self.guilds]
+
+    async def __aenter__(self):
+        args = self._args
+        stack = self._exit_stack
+        stack.enter_context(mock.patch.object(firestore, 'Client', return_value=self.firestore_client))
+        stack.enter_context(mock.patch.object(translate_v2, 'Client', return_value=FakeTranslateClient(Latency(args.translate_latency))))
+        stack.enter_context(mock.patch.object(texttospeech, 'TextToSpeechClient', FakeTextToSpeechClient))
+        stack.enter_context(mock.patch.object(dictionary, 'text_to_speech_pcm', make_text_to_speech_pcm(Latency(args.tts_latency))))
+        stack.enter_context(mock.patch.object(dictionary, 'convert', make_convert(Latency(args.ffmpeg_latency))))
+
+        # The voices table is created in the working directory
+        directory = stack.enter_context(tempfile.TemporaryDirectory())
+        stack.callback(os.chdir, os.getcwd())
+        os.chdir(directory)
+
+        if self._http_backends:
+            self.dictionary_server = stack.enter_context(MockDictionaryServer(default_behavior=BackendBehavior(
+                latency=Latency(args.api_latency),
+                error_rate=args.backend_error_rate,
+                unauthorized_rate=args.backend_unauthorized_rate,
+                not_found_rate=args.backend_not_found_rate,
+                malformed_rate=args.backend_malformed_rate
+            )))
+            self.dictionary_apis = self.dictionary_server.create_apis()
+        else:
+            self.dictionary_apis = [
+                FakeDictionaryAPI('unofficial_google', Latency(args.api_latency), miss_rate=args.api_miss_rate),
+                FakeDictionaryAPI('owlbot', Latency(args.api_latency))
+            ]
+        if args.cache == 'memory':
+            self.cache = MemoryCache()
+        elif args.cache == 'mmap':
+            self.cache = MappedFileCache('cache')
+        elif args.cache == 'sqlite':
+            self.cache = SQLiteCache('cache.db')
+        if self.cache is not None:
+            stack.callback(self.cache.close)
+
+        self.bot = DiscordBotClient(self.dictionary_apis, 'ffmpeg', cache=self.cache)
+        await self.bot._async_setup_hook()
+        self.cog = dictionary.Dictionary(self.bot, self.dictionary_apis, 'ffmpeg', cache=self.cache)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._exit_stack.close()
+
+        # Discard the analytics that were recorded
+        for table in tables.values():
+            table.swap()
+
+    def create_interaction(self, i: int, in_voice_channel: bool = False) -> FakeInteraction:
+        index = i % len(self.guilds)
+        user = FakeMember(self.guilds[index], self.voice_channels[index] if in_voice_channel else None)
+        return FakeInteraction(self.text_channels[index], user)
+
+    async def wait_until_idle(self):
+        # Audio is still playing after the commands return
+        while any(count > 0 for count in self.cog._voice_channels.values()) or any(lock.locked() for lock in self.cog._guild_locks.values()):
+            await asyncio.sleep(0.01)
+
+
+SCENARIOS: Dict[str, Callable[[Environment, int], Awaitable]] = {
+    'define': lambda env, i: env.cog.define.callback(env.cog, env.create_interaction(i), WORDS[i % len(WORDS)]),
+    'define_translated': lambda env, i: env.cog.define.callback(env.cog, env.create_interaction(i), WORDS[i % len(WORDS)], language='fr'),
+    'define_text_to_speech': lambda env, i: env.cog.define.callback(env.cog, env.create_interaction(i, in_voice_channel=True), WORDS[i % len(WORDS)], text_to_speech=True),
+    'say': lambda env, i: env.cog.say.callback(env.cog, env.create_interaction(i, in_voice_channel=True), f'Hello number {i}'),
+    'translate': lambda env, i: env.cog.translate.callback(env.cog, env.create_interaction(i), 'French', f'Hello number {i}'),
+    'dictionary_fallback': lambda env, i: SequentialDictionaryAPI(env.dictionary_apis, cache=env.cache).define_with_source(WORDS[i % len(WORDS)])
+}
+
+# Scenarios that always send their requests to the mock dictionary server
+HTTP_SCENARIOS = ['dictionary_fallback']
+
+
+def percentile(quantiles: List[float], p: int) -> float:
+    return round(quantiles[p - 1] * 1000, 2)
+
+
+async def run_scenario(name: str, args) -> dict:
+    errors = 0
+
+    async with Environment(args, http_backends=args.http_backends or name in HTTP_SCENARIOS) as env:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def run(i: int) -> float:
+            nonlocal errors
+            async with semaphore:
+                start_time = time.perf_counter()
+                try:
+                    await SCENARIOS[name](env, i)
+                except Exception as e:
+                    # Malformed responses from the mock server can make a request fail, keep going so that it shows up in the results
+                    if errors == 0:
+                        logger.exception(f'Request failed in scenario "{name}"', exc_info=e)
+                    errors += 1
+                return time.perf_counter() - start_time
+
+        with LoopLagMonitor() as monitor:
+            start_time = time.perf_counter()
+            latencies = await asyncio.gather(*[run(i) for i in range(args.requests)])
+            duration = time.perf_counter() - start_time
+            await env.wait_until_idle()
+
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'throughput': round(args.requests / duration, 2),
+        'latency_ms': {
+            'p50': percentile(quantiles, 50),
+            'p90': percentile(quantiles, 90),
+            'p99': percentile(quantiles, 99),
+            'max': round(max(latencies) * 1000, 2)
+        },
+        'loop_blocked_ms': round(monitor.blocked_time * 1000, 2),
+        'max_loop_lag_ms': round(monitor.max_lag * 1000, 2),
+        'firestore_reads': env.firestore_client.read_count,
+        'errors': errors,
+        'backend_responses': env.dictionary_server.request_counts if env.dictionary_server is not None else None
+    }
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_results(results: dict, baseline: Optional[dict]):
+
+    def format_change(current: float, previous: Optional[float]) -> str:
+        if previous is None or previous == 0:
+            return ''
+        return f' ({(current - previous) / previous * 100:+.1f}%)'
+
+    for name, result in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name) if baseline is not None else None
+        print(f'{name}:')
+        print(f'    throughput: {result["throughput"]} requests/second' + format_change(result['throughput'], previous and previous['throughput']))
+        for key, value in result['latency_ms'].items():
+            print(f'    {key}: {value} ms' + format_change(value, previous and previous['latency_ms'][key]))
+        print(f'    event loop blocked: {result["loop_blocked_ms"]} ms' + format_change(result['loop_blocked_ms'], previous and previous['loop_blocked_ms']))
+        print(f'    max event loop lag: {result["max_loop_lag_ms"]} ms' + format_change(result['max_loop_lag_ms'], previous and previous['max_loop_lag_ms']))
+        print(f'    firestore reads: {result["firestore_reads"]}')
+        print(f'    errors: {result["errors"]}')
+        if result['backend_responses'] is not None:
+            for api_id, counts in result['backend_responses'].items():
+                print(f'    {api_id} responses: ' + ', '.join(f'{status}: {count}' for status, count in sorted(counts.items())))
+
+
+async def run(args) -> dict:
+    results = {
+        'commit': get_commit(),
+        'time': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'scenarios')},
+        'scenarios': {}
+    }
+    for name in args.scenarios:
+        results['scenarios'][name] = await run_scenario(name, args)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dictionary commands without connecting to Discord, Google Cloud or any dictionary API.')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS), help='Which scenarios to run.')
+    parser.add_argument('--requests', type=int, default=200, help='Number of requests to send in each scenario.')
+    parser.add_argument('--concurrency', type=int, default=20, help='Maximum number of requests that are processed at the same time.')
+    parser.add_argument('--guilds', type=int, default=10, help='Number of guilds that the requests are spread over.')
+    parser.add_argument('--api-latency', type=float, default=0.05, help='Mean number of seconds each dictionary API takes to respond.')
+    parser.add_argument('--api-miss-rate', type=float, default=0.2, help='Fraction of requests that the first dictionary API has no definition for.')
+    parser.add_argument('--http-backends', action='store_true', help='Use the real dictionary API classes with a local mock server in every scenario.')
+    parser.add_argument('--backend-error-rate', type=float, default=0.05, help='Fraction of mock server requests that respond with status 500.')
+    parser.add_argument('--backend-unauthorized-rate', type=float, default=0.0, help='Fraction of mock server requests that respond with status 401.')
+    parser.add_argument('--backend-not-found-rate', type=float, default=0.1, help='Fraction of mock server requests that respond with status 404.')
+    parser.add_argument('--backend-malformed-rate', type=float, default=0.0, help='Fraction of mock server requests that respond with an unexpected body.')
+    parser.add_argument('--translate-latency', type=float, default=0.03, help='Mean number of seconds each translation takes.')
+    parser.add_argument('--tts-latency', type=float, default=0.1, help='Mean number of seconds each text-to-speech request takes.')
+    parser.add_argument('--ffmpeg-latency', type=float, default=0.02, help='Mean number of seconds each ffmpeg conversion takes.')
+    parser.add_argument('--firestore-latency', type=float, default=0.02, help='Mean number of seconds each Firestore read or write takes.')
+    parser.add_argument('--voice-connect-latency', type=float, default=0.1, help='Mean number of seconds it takes to connect to a voice channel.')
+    parser.add_argument('--playback-duration', type=float, default=0.05, help='Number of seconds each text-to-speech message takes to play.')
+    parser.add_argument('--cache', choices=['none', 'memory', 'mmap', 'sqlite'], default='none',
+                        help='Cache definitions, translations and audio. Since the same words are requested repeatedly, most requests are cache hits.')
+    parser.add_argument('--output', help='Where to save the results. Defaults to "results/<commit>.json" next to this file.')
+    parser.add_argument('--baseline', help='Results of a previous run to compare against.')
+    args = parser.parse_args()
+
+    # Failed dictionary API requests are expected here, so only show our own logs
+    logging.getLogger('discord_dictionary_bot').setLevel(logging.CRITICAL)
+
+    results = asyncio.run(run(args))
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+
+    output = Path(args.output) if args.output is not None else RESULTS_DIRECTORY / f'{results["commit"]}.json'
+    os.makedirs(output.parent, exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=4)
+    print(f'Saved results to "{output}"')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from discord_dictionary_bot.definitions import DefinitionEntry
+from discord_dictionary_bot.dictionary_api import DictionaryAPI, OwlBotDictionaryAPI, UnofficialGoogleAPI, MerriamWebsterCollegiateAPI, \
+    RapidWordsAPI
+from discord_dictionary_bot.json_decoder import DECODERS, get_json_decoder, set_json_decoder
+
+# Hand-written responses of each dictionary API for the word "water", named by API ID. They follow each API's response format, but they are not
+# recorded responses, so results for real responses may differ.
+PAYLOADS_DIRECTORY = Path(__file__).parent / 'payloads'
+
+
+def create_apis() -> List[DictionaryAPI]:
+    return [OwlBotDictionaryAPI('token'), UnofficialGoogleAPI(), MerriamWebsterCollegiateAPI('key'), RapidWordsAPI('key')]
+
+
+def read_payloads(directory: Path = PAYLOADS_DIRECTORY) -> Dict[str, bytes]:
+    return {path.stem: path.read_bytes() for path in sorted(directory.glob('*.json'))}
+
+
+def measure(function: Callable[[], List[DefinitionEntry]], duration: float) -> float:
+    """
+    :return: The mean number of microseconds that `function` takes.
+    """
+    count = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < duration:
+        for _ in range(100):
+            function()
+        count += 100
+    return (time.perf_counter() - start_time) / count * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how long each dictionary API takes to parse a response with each JSON decoder.')
+    parser.add_argument('--duration', type=float, default=1.0, help='Number of seconds to measure each API and decoder for.')
+    parser.add_argument('--payloads', type=Path, default=PAYLOADS_DIRECTORY,
+                        help='Directory of recorded responses named by API ID, like `owlbot.json`. APIs without a response are skipped. Defaults to the '
+                             'hand-written samples.')
+    args = parser.parse_args()
+
+    payloads = read_payloads(args.payloads)
+    default_decoder = get_json_decoder()
+    for api in create_apis():
+        if api.id() not in payloads:
+            continue
+        body = payloads[api.id()]
+        print(f'{api.id()} ({len(body)} bytes):')
+
+        # Compare every decoder to the standard library
+        baseline = None
+        for name in DECODERS:
+            set_json_decoder(name)
+            duration = measure(lambda: api.parse_response(body), args.duration)
+            if baseline is None:
+                baseline = duration
+            print(f'    {name}: {duration:.2f} us ({(duration - baseline) / baseline * 100:+.1f}%)')
+    set_json_decoder(default_decoder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+import asyncio
+import itertools
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import List, Dict, Optional
+
+import discord
+
+from discord_dictionary_bot.definitions import DefinitionEntry
+from discord_dictionary_bot.dictionary_api import DictionaryAPI
+
+# Languages returned by the fake translation client
+LANGUAGES = [{'language': 'en', 'name': 'English'}, {'language': 'fr', 'name': 'French'}, {'language': 'es', 'name': 'Spanish'}, {'language': 'de', 'name': 'German'}]
+
+# Voices returned by the fake text-to-speech client
+VOICES = ['en-US-Wavenet-C', 'en-US-Standard-B', 'fr-FR-Wavenet-A', 'es-ES-Standard-A', 'de-DE-Wavenet-F']
+
+_ids = itertools.count(1)
+
+
+def _next_id() -> int:
+    # Discord IDs are snowflakes, so make sure they don't collide with the development servers ignored by analytics
+    return (next(_ids) << 22) + 1
+
+
+class Latency:
+    """
+    A latency distribution. Each sample is normally distributed around `mean` seconds and never negative.
+    """
+
+    def __init__(self, mean: float, stddev: Optional[float] = None):
+        self._mean = mean
+        self._stddev = stddev if stddev is not None else mean / 4
+
+    def sample(self) -> float:
+        return max(0.0, random.gauss(self._mean, self._stddev))
+
+    def sleep(self):
+        time.sleep(self.sample())
+
+    async def async_sleep(self):
+        await asyncio.sleep(self.sample())
+
+
+class FakeDictionaryAPI(DictionaryAPI):
+    """
+    A dictionary API that returns canned definitions after a delay. A fraction of the requests return no definitions, so that the fallback to
+    the next API is exercised as well.
+    """
+
+    def __init__(self, api_id: str, latency: Latency, miss_rate: float = 0.0, definition_count: int = 3):
+        self._id = api_id
+        self._latency = latency
+        self._miss_rate = miss_rate
+        self._definition_count = definition_count
+
+    async def define(self, word: str) -> List[DefinitionEntry]:
+        await self._latency.async_sleep()
+        if random.random() < self._miss_rate:
+            return []
+        return [DefinitionEntry('noun', f'Definition {i + 1} of the word "{word}".') for i in range(self._definition_count)]
+
+    def id(self) -> str:
+        return self._id
+
+    @property
+    def name(self) -> str:
+        return f'Fake ({self._id})'
+
+
+class FakeTranslateClient:
+    """
+    Stand-in for `google.cloud.translate_v2.Client`. Like the real client, it blocks the calling thread.
+    """
+
+    def __init__(self, latency: Latency):
+        self._latency = latency
+
+    def get_languages(self, target_language: str = None) -> List[Dict[str, str]]:
+        return list(LANGUAGES)
+
+    def translate(self, text: str, target_language: str = None, source_language: str = None) -> Dict[str, str]:
+        self._latency.sleep()
+        return {'translatedText': text if target_language == 'en' else f'[{target_language}] {text}', 'detectedSourceLanguage': source_language or 'en'}
+
+
+class FakeTextToSpeechClient:
+    """
+    Stand-in for `google.cloud.texttospeech.TextToSpeechClient`, only used to list the supported voices.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def list_voices(self):
+        return SimpleNamespace(voices=[SimpleNamespace(name=name, ssml_gender=SimpleNamespace(name='FEMALE')) for name in VOICES])
+
+
+def make_text_to_speech_pcm(latency: Latency, size: int = 48000 * 2):
+    """
+    Create a stand-in for `text_to_speech_pcm()`. Like the real function, it blocks the calling thread.
+    :param latency:
+    :param size: Number of bytes of audio to return.
+    :return:
+    """
+    def text_to_speech_pcm(text, language='en-us', gender=None) -> bytes:
+        latency.sleep()
+        return bytes(size)
+    return text_to_speech_pcm
+
+
+def make_convert(latency: Latency):
+    """
+    Create a stand-in for `convert()` that doesn't need ffmpeg. The audio is returned unchanged.
+    :param latency:
+    :return:
+    """
+    async def convert(source: bytes, ffmpeg_path='ffmpeg'):
+        await latency.async_sleep()
+        return source
+    return convert
+
+
+class FakeDocumentSnapshot:
+
+    def __init__(self, reference: 'FakeDocument'):
+        self._reference = reference
+        self._data = dict(reference.data) if reference.data is not None else None
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    @property
+    def reference(self) -> 'FakeDocument':
+        return self._reference
+
+    def to_dict(self) -> Optional[dict]:
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+
+    def __init__(self, client: 'FakeFirestoreClient'):
+        self._client = client
+        self._collections: Dict[str, FakeCollection] = {}
+        self.data: Optional[dict] = None
+
+    def collection(self, name: str) -> 'FakeCollection':
+        return self._collections.setdefault(name, FakeCollection(self._client))
+
+    def get(self) -> FakeDocumentSnapshot:
+        self._client.read()
+        return FakeDocumentSnapshot(self)
+
+    def set(self, data: dict, merge: bool = False):
+        self._client.write()
+        if merge and self.data is not None:
+            self.data.update(data)
+        else:
+            self.data = dict(data)
+
+    def update(self, data: dict):
+        self._client.write()
+        self.data.update(data)
+
+
+class FakeCollection:
+
+    def __init__(self, client: 'FakeFirestoreClient'):
+        self._client = client
+        self._documents: Dict[str, FakeDocument] = {}
+
+    def document(self, document_id: str) -> FakeDocument:
+        return self._documents.setdefault(document_id, FakeDocument(self._client))
+
+
+class FakeFirestoreClient:
+    """
+    An in-memory stand-in for `google.cloud.firestore.Client`. Every read and write blocks the calling thread like the real client does, and
+    the number of reads is counted.
+    """
+
+    def __init__(self, latency: Latency):
+        self._latency = latency
+        self._collections: Dict[str, FakeCollection] = {}
+        self._lock = threading.Lock()
+        self._read_count = 0
+
+    @property
+    def read_count(self) -> int:
+        return self._read_count
+
+    def read(self):
+        with self._lock:
+            self._read_count += 1
+        self._latency.sleep()
+
+    def write(self):
+        self._latency.sleep()
+
+    def collection(self, name: str) -> FakeCollection:
+        return self._collections.setdefault(name, FakeCollection(self))
+
+
+class FakeGuild(discord.Guild):
+    """
+    A guild that doesn't need a connection to Discord. It subclasses `discord.Guild` because the property manager checks the type of its scopes.
+    """
+
+    def __init__(self):
+        self.id = _next_id()
+        self.name = f'Guild {self.id}'
+
+    @property
+    def me(self):
+        return None
+
+    def __repr__(self):
+        return f'<FakeGuild id={self.id}>'
+
+
+class FakeTextChannel:
+
+    def __init__(self, guild: FakeGuild):
+        self.id = _next_id()
+        self.guild = guild
+        self.name = f'channel-{self.id}'
+
+    def __str__(self):
+        return self.name
+
+
+class FakeVoiceClient:
+    """
+    Plays audio by waiting for as long as the audio would take to play, then calls `after` from another thread like discord.py does.
+    """
+
+    def __init__(self, channel: 'FakeVoiceChannel', playback_duration: float):
+        self.channel = channel
+        self._playback_duration = playback_duration
+
+    def play(self, source, after=None):
+        if after is not None:
+            threading.Timer(self._playback_duration, after, args=(None,)).start()
+
+    def stop(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+
+class FakeVoiceChannel:
+
+    def __init__(self, guild: FakeGuild, connect_latency: Latency, playback_duration: float):
+        self.id = _next_id()
+        self.guild = guild
+        self.name = f'voice-{self.id}'
+        self._connect_latency = connect_latency
+        self._playback_duration = playback_duration
+
+    def permissions_for(self, member) -> discord.Permissions:
+        return discord.Permissions(view_channel=True, connect=True, speak=True)
+
+    async def connect(self) -> FakeVoiceClient:
+        await self._connect_latency.async_sleep()
+        return FakeVoiceClient(self, self._playback_duration)
+
+
+class FakeMember(discord.Member):
+    """
+    A member that doesn't need a connection to Discord. It subclasses `discord.Member` because the commands check the type of the user before
+    looking up their voice channel.
+    """
+
+    def __init__(self, guild: FakeGuild, voice_channel: Optional[FakeVoiceChannel]):
+        self.guild = guild
+        self._voice = SimpleNamespace(channel=voice_channel) if voice_channel is not None else None
+
+    @property
+    def voice(self):
+        return self._voice
+
+
+class FakeInteractionResponse:
+
+    def __init__(self, interaction: 'FakeInteraction'):
+        self._interaction = interaction
+
+    async def defer(self, ephemeral: bool = False):
+        self._interaction.deferred = True
+
+    async def send_message(self, content=None, ephemeral: bool = False, **kwargs):
+        self._interaction.messages.append(content)
+
+
+class FakeFollowup:
+
+    def __init__(self, interaction: 'FakeInteraction'):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self._interaction.messages.append(content)
+
+
+class FakeInteraction:
+    """
+    Records the messages that a command sends instead of sending them to Discord.
+    """
+
+    def __init__(self, channel: FakeTextChannel, user):
+        self.id = _next_id()
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild = channel.guild
+        self.guild_id = channel.guild.id
+        self.user = user
+        self.deferred = False
+        self.messages: List[str] = []
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
@@ -0,0 +1,198 @@
+import asyncio
+import collections
+import random
+import threading
+from typing import Dict, List, Optional, Callable, Any
+
+from aiohttp import web
+
+from discord_dictionary_bot.dictionary_api import DictionaryAPI, OwlBotDictionaryAPI, UnofficialGoogleAPI, MerriamWebsterCollegiateAPI, \
+    MerriamWebsterMedicalAPI, RapidWordsAPI
+from .fakes import Latency
+
+
+class BackendBehavior:
+    """
+    How a mock dictionary API responds. Each request waits for a sample of `latency`, then fails with the configured probabilities. Requests that
+    don't fail return `definition_count` definitions.
+    """
+
+    def __init__(self, latency: Optional[Latency] = None, error_rate: float = 0.0, unauthorized_rate: float = 0.0, not_found_rate: float = 0.0,
+                 malformed_rate: float = 0.0, definition_count: int = 3):
+        """
+        :param latency: How long each request takes. Defaults to no delay.
+        :param error_rate: Fraction of requests that respond with status 500.
+        :param unauthorized_rate: Fraction of requests that respond with status 401, as if the API key was invalid.
+        :param not_found_rate: Fraction of requests that respond with status 404, as if the word doesn't exist.
+        :param malformed_rate: Fraction of requests that respond with status 200 but a body that doesn't have the usual shape.
+        :param definition_count: Number of definitions to return for each word.
+        """
+        self.latency = latency if latency is not None else Latency(0)
+        self.error_rate = error_rate
+        self.unauthorized_rate = unauthorized_rate
+        self.not_found_rate = not_found_rate
+        self.malformed_rate = malformed_rate
+        self.definition_count = definition_count
+
+
+def _owlbot_body(word: str, count: int) -> Any:
+    return {'word': word, 'pronunciation': word, 'definitions': [{'type': 'noun', 'definition': f'Definition {i + 1} of "{word}".', 'example': None, 'image_url': None, 'emoji': None} for i in range(count)]}
+
+
+def _owlbot_malformed_body(word: str) -> Any:
+    # Missing the definitions
+    return {'word': word}
+
+
+def _unofficial_google_body(word: str, count: int) -> Any:
+    return [{'word': word, 'phonetics': [], 'meanings': [{'partOfSpeech': 'noun', 'definitions': [{'definition': f'Definition {i + 1} of "{word}".', 'synonyms': [], 'antonyms': []}]} for i in range(count)]}]
+
+
+def _unofficial_google_malformed_body(word: str) -> Any:
+    return []
+
+
+def _merriam_webster_body(word: str, count: int) -> Any:
+    return [{'meta': {'id': word}, 'fl': 'noun', 'shortdef': [f'definition {i + 1} of "{word}"' for i in range(count)]}]
+
+
+def _merriam_webster_malformed_body(word: str) -> Any:
+    # When the word isn't found, Merriam Webster returns a list of suggestions instead of definitions
+    return [word + 's', word + 'e', word[:-1]]
+
+
+def _words_api_body(word: str, count: int) -> Any:
+    return {'word': word, 'results': [{'definition': f'definition {i + 1} of "{word}"', 'partOfSpeech': 'noun'} for i in range(count)]}
+
+
+def _words_api_malformed_body(word: str) -> Any:
+    return {'word': word}
+
+
+class MockDictionaryServer:
+    """
+    A local HTTP server that emulates the responses of every dictionary API. It runs its own event loop on a separate thread, so it keeps
+    responding on time even if the event loop of the code being tested is blocked.
+    """
+
+    def __init__(self, behaviors: Optional[Dict[str, BackendBehavior]] = None, default_behavior: Optional[BackendBehavior] = None):
+        """
+        :param behaviors: The behavior of each dictionary API by ID. APIs that are not included use `default_behavior`.
+        :param default_behavior:
+        """
+        self._behaviors = behaviors if behaviors is not None else {}
+        self._default_behavior = default_behavior if default_behavior is not None else BackendBehavior()
+
+        # Number of requests that each API received, by API ID and status code
+        self._request_counts: Dict[str, Dict[int, int]] = collections.defaultdict(lambda: collections.defaultdict(int))
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._port: Optional[int] = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._port}'
+
+    @property
+    def request_counts(self) -> Dict[str, Dict[int, int]]:
+        return {api_id: dict(counts) for api_id, counts in self._request_counts.items()}
+
+    def get_behavior(self, api_id: str) -> BackendBehavior:
+        return self._behaviors.get(api_id, self._default_behavior)
+
+    def create_apis(self) -> List[DictionaryAPI]:
+        """
+        Create one of each dictionary API, all pointing to this server. The order is the same as the default order of the `dictionary_apis`
+        property.
+        :return:
+        """
+        return [
+            UnofficialGoogleAPI(base_url=f'{self.base_url}/unofficial_google'),
+            OwlBotDictionaryAPI('token', base_url=f'{self.base_url}/owlbot'),
+            MerriamWebsterCollegiateAPI('key', base_url=f'{self.base_url}/merriam_webster'),
+            MerriamWebsterMedicalAPI('key', base_url=f'{self.base_url}/merriam_webster'),
+            RapidWordsAPI('key', base_url=f'{self.base_url}/rapid_words')
+        ]
+
+    def _create_handler(self, api_id: str, create_body: Callable[[str, int], Any], create_malformed_body: Callable[[str], Any],
+                        is_authorized: Callable[[web.Request], bool]):
+
+        async def handler(request: web.Request) -> web.Response:
+            behavior = self.get_behavior(api_id)
+            word = request.match_info['word']
+            await behavior.latency.async_sleep()
+
+            if not is_authorized(request) or random.random() < behavior.unauthorized_rate:
+                response = web.json_response({'message': 'Unauthorized'}, status=401)
+            elif random.random() < behavior.error_rate:
+                response = web.Response(text='Internal Server Error', status=500)
+            elif random.random() < behavior.not_found_rate:
+                response = web.json_response({'message': 'No definitions found'}, status=404)
+            elif random.random() < behavior.malformed_rate:
+                response = web.json_response(create_malformed_body(word))
+            else:
+                response = web.json_response(create_body(word, behavior.definition_count))
+
+            self._request_counts[api_id][response.status] += 1
+            return response
+
+        return handler
+
+    def _create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.get('/owlbot/dictionary/{word}', self._create_handler(
+                'owlbot', _owlbot_body, _owlbot_malformed_body, lambda request: request.headers.get('Authorization', '').startswith('Token '))),
+            web.get('/unofficial_google/entries/en/{word}', self._create_handler(
+                'unofficial_google', _unofficial_google_body, _unofficial_google_malformed_body, lambda request: True)),
+            web.get('/merriam_webster/collegiate/json/{word}', self._create_handler(
+                'merriam_webster_collegiate', _merriam_webster_body, _merriam_webster_malformed_body, lambda request: 'key' in request.query)),
+            web.get('/merriam_webster/medical/json/{word}', self._create_handler(
+                'merriam_webster_medical', _merriam_webster_body, _merriam_webster_malformed_body, lambda request: 'key' in request.query)),
+            web.get('/rapid_words/words/{word}', self._create_handler(
+                'rapid_words', _words_api_body, _words_api_malformed_body, lambda request: 'x-rapidapi-key' in request.headers))
+        ])
+        return app
+
+    def start(self):
+        started = threading.Event()
+        errors = []
+
+        async def start_server():
+            self._runner = web.AppRunner(self._create_app(), access_log=None)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            await site.start()
+            self._port = self._runner.addresses[0][1]
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(start_server())
+            except Exception as e:
+                errors.append(e)
+                return
+            finally:
+                started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='mock-dictionary-server', daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -2,10 +2,17 @@ import argparse
 import os
 import logging.config
 import signal
+from typing import List, Tuple, Optional
 
-from .discord_bot_client import DiscordBotClient
-from .dictionary_api import OwlBotDictionaryAPI, UnofficialGoogleAPI, MerriamWebsterCollegiateAPI, RapidWordsAPI, MerriamWebsterMedicalAPI
+from .autocomplete import WordCompleter
+from .cache import MemoryCache, SQLiteCache, MappedFileCache
+from .discord_bot_client import DiscordBotClient, ShardedDiscordBotClient
+from .dictionary_api import OwlBotDictionaryAPI, UnofficialGoogleAPI, MerriamWebsterCollegiateAPI, RapidWordsAPI, MerriamWebsterMedicalAPI, LocalDictionaryAPI
 from .analytics import AnalyticsUploader
+from . import metrics
+from .sharding import ShardLauncher, SettingsBroadcaster, get_recommended_shard_count
+from .spelling import SpellingIndex
+from .tracing import tracer, FileExporter
 
 
 def logging_filter(record):
@@ -36,57 +43,65 @@ def try_read_token(token_or_path: str) -> str:
     return token_or_path
 
 
-def main():
-    dictionary_api_options = {
-        'google': {
-            'class': UnofficialGoogleAPI
-        },
-        'owlbot': {
-            'class': OwlBotDictionaryAPI,
-            'key_arg_dest': 'owlbot_api_token',
-            'key_arg_name': '--owlbot-api-token',
-            'name': 'Owlbot'
-        },
-        'webster-collegiate': {
-            'class': MerriamWebsterCollegiateAPI,
-            'key_arg_dest': 'webster_collegiate_api_token',
-            'key_arg_name': '--webster-collegiate-api-token',
-            'name': 'Merriam Webster Collegiate'
-        },
-        'webster-medical': {
-            'class': MerriamWebsterMedicalAPI,
-            'key_arg_dest': 'webster_medical_api_token',
-            'key_arg_name': '--webster-medical-api-token',
-            'name': 'Merriam Webster Medical'
-        },
-        'rapid-words': {
-            'class': RapidWordsAPI,
-            'key_arg_dest': 'rapid_words_api_token',
-            'key_arg_name': '--rapid-words-api-token',
-            'name': 'RapidWords'
-        },
-    }
+dictionary_api_options = {
+    'google': {
+        'class': UnofficialGoogleAPI
+    },
+    'owlbot': {
+        'class': OwlBotDictionaryAPI,
+        'key_arg_dest': 'owlbot_api_token',
+        'key_arg_name': '--owlbot-api-token',
+        'name': 'Owlbot'
+    },
+    'webster-collegiate': {
+        'class': MerriamWebsterCollegiateAPI,
+        'key_arg_dest': 'webster_collegiate_api_token',
+        'key_arg_name': '--webster-collegiate-api-token',
+        'name': 'Merriam Webster Collegiate',
+        'rate_limited': True
+    },
+    'webster-medical': {
+        'class': MerriamWebsterMedicalAPI,
+        'key_arg_dest': 'webster_medical_api_token',
+        'key_arg_name': '--webster-medical-api-token',
+        'name': 'Merriam Webster Medical',
+        'rate_limited': True
+    },
+    'rapid-words': {
+        'class': RapidWordsAPI,
+        'key_arg_dest': 'rapid_words_api_token',
+        'key_arg_name': '--rapid-words-api-token',
+        'name': 'RapidWords',
+        'rate_limited': True
+    },
+    'local': {
+        'class': LocalDictionaryAPI,
+        'path_arg_dest': 'local_dictionary_path'
+    },
+}
 
-    # Parse arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--discord-token',
-                        help='Token to use when running the bot. You can either use the raw token string or a path to a text file containing the token.',
-                        dest='discord_bot_token',
-                        default='discord_token.txt')
-    parser.add_argument('--ffmpeg-path',
-                        help='Path to ffmpeg executable.',
-                        dest='ffmpeg_path',
-                        default='ffmpeg')
-    parser.add_argument('--google-credentials-path',
-                        help='Path to Google application credentials JSON file.',
-                        dest='google_credentials_path',
-                        default='google_credentials.json')
+
+def add_dictionary_api_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the arguments that choose which dictionary API's to use and provide their tokens.
+    :param parser:
+    :return:
+    """
     parser.add_argument('--dictionary-api',
                         help='A list of dictionary API\'s to use for fetching definitions. These should be in order of priority and separated by comma\'s. Available API\'s are '
                              + ', '.join(['\'' + x + '\'' for x in dictionary_api_options])
                              + '. Some API\'s require tokens that must be provided with the appropriate arguments.',
                         dest='dictionary_api',
                         default=next(iter(dictionary_api_options)))
+    parser.add_argument('--rate-limit-directory',
+                        help='Directory to keep the request counts of rate limited dictionary API\'s in, so that their daily limits survive restarts and are shared by every process.',
+                        dest='rate_limit_directory',
+                        default='rate_limits')
+
+    parser.add_argument('--local-dictionary-path',
+                        help='Path to the word store used by the \'local\' dictionary API. Create one with `python -m discord_dictionary_bot.import_dictionary`.',
+                        dest='local_dictionary_path',
+                        default='dictionary.bin')
 
     # Add API key arguments for dictionary API's
     for k, v in dictionary_api_options.items():
@@ -97,18 +112,22 @@ def main():
                             help=f'The token to use for the {v["name"]} dictionary API. You can use either the raw token string or a path to a text file containing the token.',
                             dest=v['key_arg_dest'],
                             default=f'{v["key_arg_dest"]}.txt')
-    args = parser.parse_args()
 
-    # Set Google API credentials
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = args.google_credentials_path
 
+def get_dictionary_api_specs(args: argparse.Namespace) -> Optional[List[Tuple[type, tuple, dict]]]:
+    """
+    Get the dictionary API's chosen by the arguments added with `add_dictionary_api_arguments()`. The API's are returned as specs instead of
+    instances so that they can be sent to other processes.
+    :param args:
+    :return: The class, constructor arguments and constructor keyword arguments of each dictionary API, or None if the arguments are invalid.
+    """
     # Check which dictionary API we should use
-    dictionary_apis = []
+    dictionary_api_specs = []
     for name in args.dictionary_api.split(','):
 
         if name not in dictionary_api_options:
             print(f'Invalid dictionary API: "{name}"')
-            return
+            return None
 
         api_info = dictionary_api_options[name]
 
@@ -116,28 +135,221 @@ def main():
         if 'key_arg_dest' in api_info:
             if api_info['key_arg_dest'] not in args:
                 print(f'You must specify an API token with {api_info["key_arg_name"]} to use the {api_info["name"]} dictionary API!')
-                return
+                return None
 
             api_token = try_read_token(vars(args)[api_info["key_arg_dest"]])
-            dictionary_apis.append(api_info["class"](api_token))
+            api_args = (api_token,)
+        elif 'path_arg_dest' in api_info:
+            api_args = (vars(args)[api_info['path_arg_dest']],)
+        else:
+            api_args = ()
+
+        # Keep the request count of rate limited API's on disk
+        api_kwargs = {}
+        if api_info.get('rate_limited'):
+            os.makedirs(args.rate_limit_directory, exist_ok=True)
+            api_kwargs['rate_limit_path'] = os.path.join(args.rate_limit_directory, f'{name}.bin')
+
+        dictionary_api_specs.append((api_info["class"], api_args, api_kwargs))
+
+    return dictionary_api_specs
+
+
+def main():
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--discord-token',
+                        help='Token to use when running the bot. You can either use the raw token string or a path to a text file containing the token.',
+                        dest='discord_bot_token',
+                        default='discord_token.txt')
+    parser.add_argument('--ffmpeg-path',
+                        help='Path to ffmpeg executable.',
+                        dest='ffmpeg_path',
+                        default='ffmpeg')
+    parser.add_argument('--google-credentials-path',
+                        help='Path to Google application credentials JSON file.',
+                        dest='google_credentials_path',
+                        default='google_credentials.json')
+    add_dictionary_api_arguments(parser)
+    parser.add_argument('--spell-check',
+                        help='Suggest corrections for words that none of the dictionary API\'s have definitions for. The words of the \'local\' dictionary API are used as the list of known words, so it must be enabled.',
+                        dest='spell_check',
+                        action='store_true')
+    parser.add_argument('--autocomplete-words',
+                        help='Suggest words from this list while the word to define is being typed. This can be a text file with one word per line, or a word store created with `python -m discord_dictionary_bot.import_dictionary`. Defaults to the word store of the \'local\' dictionary API, if it is used.',
+                        dest='autocomplete_words')
+    parser.add_argument('--autocomplete-word-counts',
+                        help='An analytics export of how often each word was requested. The most requested words are suggested first. See `python -m discord_dictionary_bot.warm_cache --help` for the supported formats.',
+                        dest='autocomplete_word_counts')
+    parser.add_argument('--analytics-format',
+                        help='File format to use when uploading analytics to BigQuery. Parquet uploads are smaller but require pyarrow to be installed.',
+                        dest='analytics_format',
+                        choices=['json', 'parquet'],
+                        default='json')
+    parser.add_argument('--loop-stall-threshold',
+                        help='Log the stack of anything that blocks the event loop for longer than this many seconds. Set to 0 to disable.',
+                        dest='loop_stall_threshold',
+                        type=float,
+                        default=0.25)
+    parser.add_argument('--metrics-port',
+                        help='Serve Prometheus metrics at http://localhost:<port>/metrics. Metrics are not served if this is not specified.',
+                        dest='metrics_port',
+                        type=int)
+    parser.add_argument('--trace-path',
+                        help='Write traces of commands to this file in the OpenTelemetry (OTLP JSON) format. Commands are not traced if this is not specified.',
+                        dest='trace_path')
+    parser.add_argument('--trace-sample-rate',
+                        help='Fraction of commands to trace.',
+                        dest='trace_sample_rate',
+                        type=float,
+                        default=0.1)
+    parser.add_argument('--cache-path',
+                        help='Store cached definitions, translations and text-to-speech audio in this file, so they are shared by every process on this host. If this is not specified, each process keeps its own cache in memory.',
+                        dest='cache_path')
+    parser.add_argument('--cache-backend',
+                        help='How to store the cache file. A memory-mapped file is faster, but SQLite can be used on file systems that don\'t support memory mapping.',
+                        dest='cache_backend',
+                        choices=['mmap', 'sqlite'],
+                        default='mmap')
+    parser.add_argument('--cache-size',
+                        help='Maximum size of the cache in megabytes.',
+                        dest='cache_size',
+                        type=int,
+                        default=256)
+    parser.add_argument('--cache-snapshot',
+                        help='Load a snapshot written by `python -m discord_dictionary_bot.warm_cache` into the cache at startup.',
+                        dest='cache_snapshot')
+    parser.add_argument('--sharded',
+                        help='Run all shards recommended by Discord in this process.',
+                        dest='sharded',
+                        action='store_true')
+    parser.add_argument('--processes',
+                        help='Number of processes to split the shards across. Implies --sharded.',
+                        dest='processes',
+                        type=int,
+                        default=1)
+    parser.add_argument('--shard-count',
+                        help='Total number of shards. Defaults to the number recommended by Discord. Implies --sharded.',
+                        dest='shard_count',
+                        type=int)
+
+    args = parser.parse_args()
+
+    # Set Google API credentials
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = args.google_credentials_path
+
+    dictionary_api_specs = get_dictionary_api_specs(args)
+    if dictionary_api_specs is None:
+        return
+    if args.spell_check and LocalDictionaryAPI not in [cls for cls, _, _ in dictionary_api_specs]:
+        print('You must use the \'local\' dictionary API to use --spell-check!')
+        return
+
+    # Run a single process
+    if args.processes <= 1:
+        if args.sharded or args.shard_count is not None:
+            run(args, dictionary_api_specs, shard_count=args.shard_count)
         else:
-            dictionary_apis.append(api_info["class"]())
+            run(args, dictionary_api_specs)
+        return
+
+    # Split the shards across several processes
+    shard_count = args.shard_count
+    if shard_count is None:
+        shard_count = max(get_recommended_shard_count(try_read_token(args.discord_bot_token)), args.processes)
+    if args.cache_path is None:
+        print('No cache path was specified, so each process will keep its own cache.')
+    ShardLauncher(run, args.processes, shard_count, args=(args, dictionary_api_specs)).run()
+
+
+def run(args: argparse.Namespace, dictionary_api_specs: List[Tuple[type, tuple, dict]], process_index: int = 0, shard_ids: Optional[List[int]] = None,
+        shard_count: Optional[int] = None, settings_broadcaster: Optional[SettingsBroadcaster] = None):
+    """
+    Run the bot in the current process.
+    :param args: The parsed command line arguments.
+    :param dictionary_api_specs: The class, constructor arguments and constructor keyword arguments of each dictionary API to use.
+    :param process_index: Index of this process, if the bot is split across several processes.
+    :param shard_ids: The shards to run in this process. If this and `shard_count` are None, the bot is not sharded.
+    :param shard_count: Total number of shards.
+    :param settings_broadcaster: Keeps cached settings coherent with the other processes.
+    :return:
+    """
+    dictionary_apis = [cls(*api_args, **api_kwargs) for cls, api_args, api_kwargs in dictionary_api_specs]
+
+    # Serve metrics. Each process uses its own port.
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port + process_index)
+
+    # Write traces. Each process writes its own file.
+    trace_exporter = None
+    if args.trace_path is not None:
+        trace_exporter = FileExporter(args.trace_path if args.processes <= 1 else f'{args.trace_path}.{process_index}')
+        tracer.configure(trace_exporter, args.trace_sample_rate)
+
+    # Create cache
+    if args.cache_path is not None and args.cache_backend == 'mmap':
+        cache = MappedFileCache(args.cache_path, max_bytes=args.cache_size * 1024 * 1024)
+    elif args.cache_path is not None:
+        cache = SQLiteCache(args.cache_path, max_bytes=args.cache_size * 1024 * 1024)
+    else:
+        cache = MemoryCache(max_bytes=args.cache_size * 1024 * 1024)
+
+    # Load the cache snapshot. A cache file is shared by every process, so only the first process needs to load it.
+    if args.cache_snapshot is not None and (args.cache_path is None or process_index == 0):
+        try:
+            cache.load_snapshot(args.cache_snapshot)
+        except (OSError, ValueError) as e:
+            print(f'Failed to load cache snapshot: {e}')
+
+    # Create spelling index from the words of the local dictionary
+    spelling_index = None
+    if args.spell_check:
+        local_dictionary_api = next(api for api in dictionary_apis if isinstance(api, LocalDictionaryAPI))
+        spelling_index = SpellingIndex(word for word in local_dictionary_api.words() if ' ' not in word)
+
+    # Create word completer. The files are read when the bot starts and then every 10 minutes, so they can be replaced while the bot runs.
+    word_completer = None
+    autocomplete_words = args.autocomplete_words
+    if autocomplete_words is None and any(isinstance(api, LocalDictionaryAPI) for api in dictionary_apis):
+        autocomplete_words = args.local_dictionary_path
+    if autocomplete_words is not None or args.autocomplete_word_counts is not None:
+        word_completer = WordCompleter(autocomplete_words, args.autocomplete_word_counts)
 
     # Start analytics thread
-    analytics_uploader = AnalyticsUploader()
+    analytics_uploader = AnalyticsUploader(data_format=args.analytics_format)
     analytics_uploader.start()
 
     # Create bot client
-    bot = DiscordBotClient(dictionary_apis, args.ffmpeg_path)
+    bot_kwargs = {
+        'loop_stall_threshold': args.loop_stall_threshold if args.loop_stall_threshold > 0 else None,
+        'cache': cache,
+        'sync_commands': process_index == 0,
+        'settings_broadcaster': settings_broadcaster,
+        'spelling_index': spelling_index,
+        'word_completer': word_completer
+    }
+    if shard_ids is not None or shard_count is not None or args.sharded:
+        bot = ShardedDiscordBotClient(dictionary_apis, args.ffmpeg_path, shard_ids=shard_ids, shard_count=shard_count, **bot_kwargs)
+    else:
+        bot = DiscordBotClient(dictionary_apis, args.ffmpeg_path, **bot_kwargs)
 
     # Capture interrupt signal to shut down gracefully
+    is_stopping = False
+
     def stop_gracefully(sig, frame):
+        nonlocal is_stopping
+        if is_stopping:
+            return
+        is_stopping = True
         analytics_uploader.stop()
+        if trace_exporter is not None:
+            trace_exporter.shutdown()
         bot.loop.call_soon((_ for _ in ()).throw(KeyboardInterrupt))  # A bit of a hack to stop the bot
     signal.signal(signal.SIGINT, stop_gracefully)
 
     # Start client
     bot.run(try_read_token(args.discord_bot_token))
+    cache.close()
 
 
 if __name__ == '__main__':
@@ -1,16 +1,37 @@
+import base64
+import collections
+import concurrent.futures
 import datetime
 import io
 import json
 import logging
+import tempfile
 import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, IO, Optional, Callable
 
 import discord
 from discord import Interaction
 from google.cloud import bigquery
 
+from . import metrics
+from .sketches import HyperLogLog, SpaceSaving
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Maximum number of rows to send in a single load job
+MAX_BATCH_SIZE = 50_000
+
+# Serialized batches larger than this many bytes are written to a temporary file instead of being kept in memory
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
 
 def _is_blacklisted(channel):
     # Ignore dev server
@@ -20,36 +41,198 @@ def _is_blacklisted(channel):
     return False
 
 
-def to_bq_file(items):
-    return io.StringIO('\n'.join([json.dumps(x) for x in items]))
-
-
-def upload(config):
-    client = bigquery.Client()
-    logger.info(f'Uploading {len(config["queue"])} items to {config["table"]}')
-    data_as_file = to_bq_file(config['queue'])
-
-    job = client.load_table_from_file(data_as_file, config['table'], job_config=config['job_config'])
+class AnalyticsTable:
+    """
+    Pending analytics events for a single BigQuery table. Events are recorded as compact tuples whose values are in the same order as the
+    table's schema, with the event time stored as a POSIX timestamp. Recording an event is a single `deque.append()`, which is atomic, so the
+    event loop never has to wait on the uploader thread.
+    """
+
+    def __init__(self, table: str, job_config: bigquery.LoadJobConfig):
+        self._table = table
+        self._job_config = job_config
+        self._columns = tuple(field.name for field in job_config.schema)
+        self._queue = collections.deque()
+
+        # Estimated size of a single serialized row. This is updated after every upload and used to estimate the size of the queue.
+        self._average_row_size = 128.0
+
+        # Functions that are called with every batch of rows that was successfully uploaded
+        self._upload_listeners: List[Callable[[List[tuple]], None]] = []
+
+    @property
+    def table(self) -> str:
+        return self._table
+
+    @property
+    def job_config(self) -> bigquery.LoadJobConfig:
+        return self._job_config
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return self._columns
+
+    @property
+    def average_row_size(self) -> float:
+        return self._average_row_size
+
+    @property
+    def estimated_size(self) -> int:
+        """
+        :return: The estimated number of bytes the pending rows will take up once serialized.
+        """
+        return int(len(self._queue) * self._average_row_size)
+
+    @property
+    def oldest_time(self) -> Optional[float]:
+        """
+        :return: The timestamp of the oldest pending row, or None if there are no pending rows.
+        """
+        try:
+            return self._queue[0][-1]
+        except IndexError:
+            return None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def update_average_row_size(self, size: int, row_count: int):
+        if row_count > 0:
+            self._average_row_size = 0.8 * self._average_row_size + 0.2 * (size / row_count)
+
+    def append(self, row: tuple):
+        self._queue.append(row)
+
+    def swap(self) -> List[tuple]:
+        """
+        Remove and return all pending rows. Rows recorded while this is running are either included in the result or left in the queue for the
+        next swap, they are never lost.
+        :return: A list of row tuples.
+        """
+        queue = self._queue
+        return [queue.popleft() for _ in range(len(queue))]
+
+    def add_upload_listener(self, listener: Callable[[List[tuple]], None]):
+        """
+        Add a function to be called with every batch of rows that was successfully uploaded. Listeners are called on the uploader thread.
+        :param listener:
+        :return:
+        """
+        self._upload_listeners.append(listener)
+
+    def notify_uploaded(self, rows: List[tuple]):
+        for listener in self._upload_listeners:
+            try:
+                listener(rows)
+            except Exception as e:
+                logger.exception('Error in upload listener!', exc_info=e)
+
+    def requeue(self, rows: List[tuple]):
+        """
+        Put rows back at the front of the queue, for example after a failed upload.
+        :param rows:
+        :return:
+        """
+        self._queue.extendleft(reversed(rows))
+
+    def to_dicts(self, rows: Iterable[tuple]) -> Iterator[Dict[str, Any]]:
+        """
+        Convert row tuples to dictionaries that can be serialized for BigQuery. The event time is always the last column.
+        :param rows:
+        :return:
+        """
+        columns = self._columns
+        for row in rows:
+            data = dict(zip(columns, row))
+            data['time'] = datetime.datetime.fromtimestamp(row[-1]).isoformat()
+            yield data
+
+
+def _json_default(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def serialize_rows(table: AnalyticsTable, rows: List[tuple]) -> Iterator[bytes]:
+    """
+    Serialize rows to newline delimited JSON, one line at a time.
+    :param table:
+    :param rows:
+    :return:
+    """
+    for data in table.to_dicts(rows):
+        yield json.dumps(data, default=_json_default).encode() + b'\n'
+
+
+def to_bq_file(table: AnalyticsTable, rows: List[tuple], data_format: str = 'json') -> IO[bytes]:
+    """
+    Write rows to a file that can be used in a BigQuery load job. The file is kept in memory until it grows larger than `SPOOL_MAX_SIZE`, after
+    which it is moved to disk. This way we never need to hold the entire serialized batch in memory.
+    :param table:
+    :param rows:
+    :param data_format: Either 'json' or 'parquet'.
+    :return:
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='r+b')
+    if data_format == 'parquet':
+        columns = {name: [row[i] for row in rows] for i, name in enumerate(table.columns[:-1])}
+        columns['time'] = pyarrow.array([datetime.datetime.fromtimestamp(row[-1]) for row in rows], type=pyarrow.timestamp('us'))
+        pyarrow.parquet.write_table(pyarrow.table(columns), file)
+    else:
+        for line in serialize_rows(table, rows):
+            file.write(line)
+    file.seek(0)
+    return file
+
+
+def _get_job_config(table: AnalyticsTable, data_format: str) -> bigquery.LoadJobConfig:
+    if data_format == 'parquet':
+        return bigquery.LoadJobConfig(schema=table.job_config.schema, source_format=bigquery.SourceFormat.PARQUET)
+    return table.job_config
+
+
+def upload(table: AnalyticsTable, client: bigquery.Client, data_format: str = 'json', max_batch_size: int = MAX_BATCH_SIZE) -> bool:
+    """
+    Upload all pending rows for a table.
+    :param table:
+    :param client:
+    :param data_format: Either 'json' or 'parquet'.
+    :param max_batch_size: Maximum number of rows to send in a single load job.
+    :return: True if all rows were uploaded, False if any of them failed and were put back in the queue.
+    """
+    # Take the pending rows so that the upload happens without blocking anyone recording new events
+    rows = table.swap()
+    if len(rows) == 0:
+        return True
 
-    try:
-        job.result()  # Waits for the job to complete.
-        config['queue'].clear()
-    except Exception as e:
-        logger.exception(f'Failed BigQuery upload job! Errors: {job.errors}', exc_info=e)
+    logger.info(f'Uploading {len(rows)} items to {table.table}')
+    job_config = _get_job_config(table, data_format)
 
+    # Split large uploads into multiple load jobs
+    for i in range(0, len(rows), max_batch_size):
+        batch = rows[i:i + max_batch_size]
+        job = None
+        try:
+            with to_bq_file(table, batch, data_format) as file:
+                table.update_average_row_size(file.seek(0, io.SEEK_END), len(batch))
+                file.seek(0)
+                job = client.load_table_from_file(file, table.table, job_config=job_config)
+                job.result()  # Waits for the job to complete.
+        except Exception as e:
+            table.requeue(rows[i:])
+            logger.exception(f'Failed BigQuery upload job! Errors: {job.errors if job is not None else None}', exc_info=e)
+            return False
+        table.notify_uploaded(batch)
 
-def create_qal_item(table, job_config):
-    return {
-        'queue': [],
-        'lock': threading.Lock(),
-        'table': table,
-        'job_config': job_config
-    }
+    return True
 
 
-# Queues and locks
-qal = {
-    'log_command': create_qal_item(
+# Pending events for each table
+tables = {
+    'log_command': AnalyticsTable(
         'formal-scout-290305.analytics.commands',
         bigquery.LoadJobConfig(
             schema=[
@@ -63,7 +246,7 @@ qal = {
             autodetect=True
         )
     ),
-    'log_context_menu': create_qal_item(
+    'log_context_menu': AnalyticsTable(
         'formal-scout-290305.analytics.context_menu_usage',
         bigquery.LoadJobConfig(
             schema=[
@@ -76,7 +259,7 @@ qal = {
             autodetect=True
         )
     ),
-    'log_definition_request': create_qal_item(
+    'log_definition_request': AnalyticsTable(
         'formal-scout-290305.analytics.definition_requests',
         bigquery.LoadJobConfig(
             schema=[
@@ -92,7 +275,7 @@ qal = {
             autodetect=True
         )
     ),
-    'log_dictionary_api_request': create_qal_item(
+    'log_dictionary_api_request': AnalyticsTable(
         'formal-scout-290305.analytics.dictionary_api_requests',
         bigquery.LoadJobConfig(
             schema=[
@@ -103,25 +286,220 @@ qal = {
             source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
             autodetect=True
         )
+    ),
+
+    # Rollups of the tables above. These are much smaller than the raw tables and are meant to be read by dashboards.
+    'daily_command_counts': AnalyticsTable(
+        'formal-scout-290305.analytics.daily_command_counts',
+        bigquery.LoadJobConfig(
+            schema=[
+                bigquery.SchemaField("date", "DATE", mode="REQUIRED"),
+                bigquery.SchemaField("command_name", "STRING", mode="REQUIRED"),
+                bigquery.SchemaField("is_slash", "BOOLEAN", mode="REQUIRED"),
+                bigquery.SchemaField("count", "INTEGER", mode="REQUIRED"),
+                bigquery.SchemaField("time", "TIMESTAMP", mode="REQUIRED"),
+            ],
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+        )
+    ),
+    'daily_dictionary_api_counts': AnalyticsTable(
+        'formal-scout-290305.analytics.daily_dictionary_api_counts',
+        bigquery.LoadJobConfig(
+            schema=[
+                bigquery.SchemaField("date", "DATE", mode="REQUIRED"),
+                bigquery.SchemaField("api_name", "STRING", mode="REQUIRED"),
+                bigquery.SchemaField("success_count", "INTEGER", mode="REQUIRED"),
+                bigquery.SchemaField("failure_count", "INTEGER", mode="REQUIRED"),
+                bigquery.SchemaField("time", "TIMESTAMP", mode="REQUIRED"),
+            ],
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+        )
+    ),
+    'daily_definition_summary': AnalyticsTable(
+        'formal-scout-290305.analytics.daily_definition_summary',
+        bigquery.LoadJobConfig(
+            schema=[
+                bigquery.SchemaField("date", "DATE", mode="REQUIRED"),
+                bigquery.SchemaField("request_count", "INTEGER", mode="REQUIRED"),
+                bigquery.SchemaField("distinct_channels", "INTEGER", mode="REQUIRED"),
+                bigquery.SchemaField("channel_sketch", "BYTES", mode="REQUIRED"),
+                bigquery.SchemaField("top_words", "RECORD", mode="REPEATED", fields=[
+                    bigquery.SchemaField("word", "STRING", mode="REQUIRED"),
+                    bigquery.SchemaField("count", "INTEGER", mode="REQUIRED"),
+                ]),
+                bigquery.SchemaField("time", "TIMESTAMP", mode="REQUIRED"),
+            ],
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+        )
     )
 }
 
+RAW_TABLE_KEYS = ('log_command', 'log_context_menu', 'log_definition_request', 'log_dictionary_api_request')
+ROLLUP_TABLE_KEYS = ('daily_command_counts', 'daily_dictionary_api_counts', 'daily_definition_summary')
+
+
+class AnalyticsRollup:
+    """
+    Maintains per-day aggregates of analytics events. Events are folded into the rollup once they have been uploaded successfully, so
+    retried uploads are never counted twice. Calling `emit()` adds the aggregates collected since the last call to the rollup tables.
+    Dashboards should sum the counts for each day and merge the channel sketches, since a day may be split across several rows.
+    """
+
+    def __init__(self, top_words_count: int = 25, top_words_capacity: int = 500):
+        """
+        :param top_words_count: Number of most requested words to include in each summary row.
+        :param top_words_capacity: Number of words tracked by the heavy hitters sketch. A larger capacity makes the counts more accurate.
+        """
+        self._top_words_count = top_words_count
+        self._top_words_capacity = top_words_capacity
+        self._lock = threading.Lock()
+        self._command_counts: Dict[Tuple[datetime.date, str, bool], int] = collections.Counter()
+        self._dictionary_api_counts: Dict[Tuple[datetime.date, str], List[int]] = collections.defaultdict(lambda: [0, 0])
+        self._definition_counts: Dict[datetime.date, int] = collections.Counter()
+        self._channel_sketches: Dict[datetime.date, HyperLogLog] = collections.defaultdict(HyperLogLog)
+        self._top_words: Dict[datetime.date, SpaceSaving] = collections.defaultdict(lambda: SpaceSaving(self._top_words_capacity))
+
+        # Running totals since the bot started
+        self._totals = collections.Counter()
+
+    @property
+    def totals(self) -> Dict[str, int]:
+        """
+        :return: The number of commands, definition requests and dictionary API requests recorded since the bot started.
+        """
+        return dict(self._totals)
+
+    def add_commands(self, rows: List[tuple]):
+        with self._lock:
+            for command_name, is_slash, guild_id, channel_id, timestamp in rows:
+                self._command_counts[(datetime.date.fromtimestamp(timestamp), command_name, is_slash)] += 1
+            self._totals['commands'] += len(rows)
+
+    def add_dictionary_api_requests(self, rows: List[tuple]):
+        with self._lock:
+            for api_name, success, timestamp in rows:
+                self._dictionary_api_counts[(datetime.date.fromtimestamp(timestamp), api_name)][0 if success else 1] += 1
+            self._totals['dictionary_api_requests'] += len(rows)
+
+    def add_definition_requests(self, rows: List[tuple]):
+        with self._lock:
+            for word, reverse, text_to_speech, language, guild_id, channel_id, timestamp in rows:
+                date = datetime.date.fromtimestamp(timestamp)
+                self._definition_counts[date] += 1
+                self._channel_sketches[date].add(channel_id)
+                self._top_words[date].add(word.lower())
+            self._totals['definition_requests'] += len(rows)
+
+    def emit(self):
+        """
+        Add the aggregates collected since the last call to the rollup tables and reset them.
+        :return:
+        """
+        with self._lock:
+            command_counts, self._command_counts = self._command_counts, collections.Counter()
+            dictionary_api_counts, self._dictionary_api_counts = self._dictionary_api_counts, collections.defaultdict(lambda: [0, 0])
+            definition_counts, self._definition_counts = self._definition_counts, collections.Counter()
+            channel_sketches, self._channel_sketches = self._channel_sketches, collections.defaultdict(HyperLogLog)
+            top_words, self._top_words = self._top_words, collections.defaultdict(lambda: SpaceSaving(self._top_words_capacity))
+
+        now = time.time()
+        for (date, command_name, is_slash), count in command_counts.items():
+            tables['daily_command_counts'].append((date, command_name, is_slash, count, now))
+        for (date, api_name), (success_count, failure_count) in dictionary_api_counts.items():
+            tables['daily_dictionary_api_counts'].append((date, api_name, success_count, failure_count, now))
+        for date, count in definition_counts.items():
+            sketch = channel_sketches[date]
+            words = [{'word': word, 'count': word_count} for word, word_count in top_words[date].top(self._top_words_count)]
+            tables['daily_definition_summary'].append((date, count, sketch.count(), sketch.to_bytes(), words, now))
+
+
+rollup = AnalyticsRollup()
+tables['log_command'].add_upload_listener(rollup.add_commands)
+tables['log_dictionary_api_request'].add_upload_listener(rollup.add_dictionary_api_requests)
+tables['log_definition_request'].add_upload_listener(rollup.add_definition_requests)
+
+for _key, _table in tables.items():
+    metrics.analytics_queue_depth.labels(_key).set_function(_table.__len__)
+
+
+class FlushPolicy:
+    """
+    Determines when pending analytics should be uploaded. A table is flushed as soon as any one of its limits is reached. Failed uploads are
+    retried with exponential backoff.
+    """
+
+    def __init__(self, max_rows: int = 5000, max_bytes: int = 4 * 1024 * 1024, max_age: float = 60 * 5, min_backoff: float = 30, max_backoff: float = 60 * 30,
+                 poll_interval: float = 5):
+        """
+        :param max_rows: Flush once a table has this many pending rows.
+        :param max_bytes: Flush once the pending rows of a table are estimated to take up this many bytes.
+        :param max_age: Flush once the oldest pending row of a table is this many seconds old.
+        :param min_backoff: Number of seconds to wait before retrying after the first failed upload.
+        :param max_backoff: Maximum number of seconds to wait before retrying a failed upload.
+        :param poll_interval: Number of seconds between checking the tables.
+        """
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+
+    def should_flush(self, table: AnalyticsTable, now: float) -> bool:
+        if len(table) == 0:
+            return False
+        if len(table) >= self.max_rows or table.estimated_size >= self.max_bytes:
+            return True
+        oldest_time = table.oldest_time
+        return oldest_time is not None and now - oldest_time >= self.max_age
+
+    def get_backoff(self, failure_count: int) -> float:
+        return min(self.max_backoff, self.min_backoff * 2 ** (failure_count - 1))
+
+
+class UploadStats:
+    """
+    Counters for the uploads of a single table.
+    """
 
-def upload_pending_analytics():
-    for key, value in qal.items():
-        try:
-            queue = value['queue']
-            lock = value['lock']
-            with lock:
-                if len(queue) > 0:
-                    upload(value)
-        except Exception as e:
-            logger.exception('Error uploading analytics!', exc_info=e)
+    def __init__(self):
+        self.uploads = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_latency: Optional[float] = None
+        self.total_latency = 0.0
+
+        # Time when the next upload is allowed, used to back off after failures
+        self.next_attempt_time = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'uploads': self.uploads,
+            'failures': self.failures,
+            'last_latency': self.last_latency,
+            'average_latency': self.total_latency / self.uploads if self.uploads > 0 else None
+        }
 
 
 class AnalyticsUploader:
 
-    def __init__(self):
+    def __init__(self, data_format: str = 'json', flush_policy: Optional[FlushPolicy] = None, rollup_interval: float = 60 * 60):
+        """
+        Creates a new analytics uploader. Each table is uploaded independently of the others according to the flush policy, and at most one
+        upload per table is running at a time. All remaining analytics are uploaded when the uploader is stopped.
+        :param data_format: The file format to use for BigQuery load jobs. Either 'json' or 'parquet'. Parquet files are much smaller but
+        require `pyarrow` to be installed.
+        :param flush_policy: Determines when each table is uploaded.
+        :param rollup_interval: Number of seconds between adding the collected rollups to the rollup tables.
+        """
+        if data_format == 'parquet' and pyarrow is None:
+            logger.warning('Parquet analytics uploads require pyarrow. Falling back to JSON.')
+            data_format = 'json'
+        self._data_format = data_format
+        self._flush_policy = flush_policy if flush_policy is not None else FlushPolicy()
+        self._rollup_interval = rollup_interval
+        self._stats = {key: UploadStats() for key in tables}
+        self._pending_uploads: Dict[str, concurrent.futures.Future] = {}
         self._is_running = False
         self._stop_event = threading.Event()
         self._thread = threading.Thread(target=self._run)
@@ -139,73 +517,82 @@ class AnalyticsUploader:
         self._stop_event.set()
         self._thread.join()
 
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the queue depth and upload counters for every table.
+        :return:
+        """
+        return {key: {'queue_depth': len(tables[key]), **self._stats[key].to_dict()} for key in tables}
+
     def _run(self):
         logger.info('Started analytics uploader')
-        while self._is_running:
-            self._stop_event.wait(60 * 5)
-            upload_pending_analytics()
+        client = bigquery.Client()
+        last_rollup_time = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(tables), thread_name_prefix='analytics') as executor:
+            while self._is_running:
+                self._stop_event.wait(self._flush_policy.poll_interval)
+                now = time.time()
+                if now - last_rollup_time >= self._rollup_interval:
+                    rollup.emit()
+                    last_rollup_time = now
+                for key, table in tables.items():
+                    if key in self._pending_uploads and not self._pending_uploads[key].done():
+                        continue
+                    if now < self._stats[key].next_attempt_time:
+                        continue
+                    if self._flush_policy.should_flush(table, now):
+                        self._pending_uploads[key] = executor.submit(self._upload, key, client)
+
+            # Upload everything that is left before stopping. The rollups are emitted last so that they include the final raw uploads.
+            concurrent.futures.wait(self._pending_uploads.values())
+            concurrent.futures.wait([executor.submit(self._upload, key, client) for key in RAW_TABLE_KEYS if len(tables[key]) > 0])
+            rollup.emit()
+            concurrent.futures.wait([executor.submit(self._upload, key, client) for key in ROLLUP_TABLE_KEYS if len(tables[key]) > 0])
+        client.close()
         logger.info('Stopped analytics uploader')
 
+    def _upload(self, key: str, client: bigquery.Client):
+        stats = self._stats[key]
+        start_time = time.perf_counter()
+        try:
+            success = upload(tables[key], client, self._data_format)
+        except Exception as e:
+            logger.exception('Error uploading analytics!', exc_info=e)
+            success = False
+        latency = time.perf_counter() - start_time
+
+        stats.uploads += 1
+        stats.last_latency = latency
+        stats.total_latency += latency
+        if success:
+            stats.consecutive_failures = 0
+            stats.next_attempt_time = 0.0
+        else:
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            backoff = self._flush_policy.get_backoff(stats.consecutive_failures)
+            stats.next_attempt_time = time.time() + backoff
+            logger.warning(f'Upload to {tables[key].table} failed {stats.consecutive_failures} time(s) in a row. Retrying in {backoff:.0f} seconds.')
+        logger.debug(f'Analytics stats for {key}: {{queue_depth: {len(tables[key])}, latency: {latency:.3f}s}}')
 
-def log_command(command_name: str, interaction: Interaction):
-    queue = qal['log_command']['queue']
-    with qal['log_command']['lock']:
-        if _is_blacklisted(interaction.channel):
-            return
-
-        data = {
-            'command_name': command_name,
-            'is_slash': True,
-            'guild_id': interaction.guild_id,
-            'channel_id': interaction.channel_id,
-            'time': datetime.datetime.now().isoformat()
-        }
 
-        queue.append(data)
+def log_command(command_name: str, interaction: Interaction):
+    if _is_blacklisted(interaction.channel):
+        return
+    tables['log_command'].append((command_name, True, interaction.guild_id, interaction.channel_id, time.time()))
 
 
 def log_context_menu_usage(name: str, interaction: Interaction):
-    queue = qal['log_context_menu']['queue']
-    with qal['log_context_menu']['lock']:
-        if _is_blacklisted(interaction.channel):
-            return
-
-        data = {
-            'name': name,
-            'guild_id': interaction.guild_id,
-            'channel_id': interaction.channel_id,
-            'time': datetime.datetime.now().isoformat()
-        }
-
-        queue.append(data)
+    if _is_blacklisted(interaction.channel):
+        return
+    tables['log_context_menu'].append((name, interaction.guild_id, interaction.channel_id, time.time()))
 
 
 def log_definition_request(word: str, text_to_speech: bool, language: str, channel: discord.TextChannel):
-    queue = qal['log_definition_request']['queue']
-    with qal['log_definition_request']['lock']:
-        if _is_blacklisted(channel):
-            return
-
-        data = {
-            'word': word,
-            'reverse': False,
-            'text_to_speech': text_to_speech,
-            'language': language,
-            'guild_id': channel.guild.id,
-            'channel_id': channel.id,
-            'time': datetime.datetime.now().isoformat()
-        }
-
-        queue.append(data)
+    if _is_blacklisted(channel):
+        return
+    tables['log_definition_request'].append((word, False, text_to_speech, language, channel.guild.id, channel.id, time.time()))
 
 
 def log_dictionary_api_request(dictionary_api_name: str, success: bool):
-    queue = qal['log_dictionary_api_request']['queue']
-    with qal['log_dictionary_api_request']['lock']:
-        data = {
-            'api_name': dictionary_api_name,
-            'success': success,
-            'time': datetime.datetime.now().isoformat()
-        }
-
-        queue.append(data)
+    tables['log_dictionary_api_request'].append((dictionary_api_name, success, time.time()))
@@ -0,0 +1,173 @@
+import bisect
+import collections
+import csv
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Union
+
+from .sketches import SpaceSaving
+from .word_store import WordStore
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def read_word_counts(path: Union[str, os.PathLike], word_filter: Optional[Callable[[str], bool]] = None) -> collections.Counter:
+    """
+    Read how often each word was requested from an analytics export. Two formats are supported:
+
+    - CSV with a header that has a 'word' column and optionally a 'count' column, such as the result of
+      `SELECT word, COUNT(*) AS count FROM log_definition_request GROUP BY word`.
+    - Newline delimited JSON, as exported by BigQuery. Each row is either a single word with an optional count, or a row of the
+      `daily_definition_summary` table with a list of top words.
+
+    Rows without a count are counted once. Words are lower cased, since that is how the rollup counts them.
+    :param path:
+    :param word_filter: Only count the words that this returns True for.
+    :return:
+    """
+    word_counts = collections.Counter()
+
+    def add(word: str, count: Optional[Union[int, str]]):
+        word = word.strip().lower()
+        if len(word) > 0 and (word_filter is None or word_filter(word)):
+            word_counts[word] += int(count) if count not in (None, '') else 1
+
+    with open(path, newline='') as file:
+        if str(path).endswith('.csv'):
+            for row in csv.DictReader(file):
+                add(row['word'], row.get('count'))
+        else:
+            for line in file:
+                if len(line.strip()) == 0:
+                    continue
+                row = json.loads(line)
+                if 'words' in row:
+                    for item in row['words']:
+                        add(item['word'], item.get('count'))
+                else:
+                    add(row['word'], row.get('count'))
+
+    return word_counts
+
+
+def read_word_list(path: Union[str, os.PathLike]) -> List[str]:
+    """
+    :param path: A word store created by `import_dictionary`, or a text file with one word per line.
+    :return:
+    """
+    try:
+        word_store = WordStore(path)
+    except ValueError:
+        with open(path, encoding='utf-8') as file:
+            return [line.strip() for line in file if len(line.strip()) > 0]
+    try:
+        return list(word_store.words())
+    finally:
+        word_store.close()
+
+
+class _Index:
+
+    def __init__(self, words: List[str], popular_words: List[str], popular_counts: List[int], top_words: List[str]):
+        # All known words, sorted
+        self.words = words
+
+        # The most requested words, sorted, and how many times each one was requested
+        self.popular_words = popular_words
+        self.popular_counts = popular_counts
+
+        # The most requested words in order, which are suggested before the user has typed anything
+        self.top_words = top_words
+
+
+def _prefix_range(words: List[str], prefix: str) -> range:
+    # Every string that starts with the prefix sorts before the prefix followed by the largest code point
+    return range(bisect.bisect_left(words, prefix), bisect.bisect_left(words, prefix + '\U0010ffff'))
+
+
+class WordCompleter:
+    """
+    Suggests words that start with what the user has typed so far. The most requested words that match are suggested first, followed by the
+    rest of the matching known words in alphabetical order.
+
+    Words and their request counts are kept in sorted lists, so the words that start with a prefix are found with two binary searches. The
+    lists are rebuilt by `refresh()` and swapped in at once, so suggestions can be made while a refresh is running on another thread.
+    """
+
+    def __init__(self, word_list_path: Optional[Union[str, os.PathLike]] = None, word_counts_path: Optional[Union[str, os.PathLike]] = None,
+                 popular_word_count: int = 10000, history_capacity: int = 1000):
+        """
+        :param word_list_path: A list of known words. See `read_word_list()`.
+        :param word_counts_path: An analytics export of how often each word was requested. See `read_word_counts()`.
+        :param popular_word_count: Maximum number of requested words to rank by popularity. This includes the words requested since the bot
+        started, which are counted by `record()`.
+        :param history_capacity: Maximum number of distinct words to count requests for since the bot started.
+        """
+        self._word_list_path = word_list_path
+        self._word_counts_path = word_counts_path
+        self._popular_word_count = popular_word_count
+        self._history = SpaceSaving(history_capacity)
+        self._history_lock = threading.Lock()
+        self._index = _Index([], [], [], [])
+
+    def record(self, word: str):
+        """
+        Count a request for a word, so that it is ranked higher after the next refresh.
+        :param word:
+        :return:
+        """
+        with self._history_lock:
+            self._history.add(word.lower())
+
+    def refresh(self):
+        """
+        Reload the word list and word counts, and add the words requested since the bot started. This reads files, so it should not be run on
+        the event loop.
+        :return:
+        """
+        start_time = time.perf_counter()
+        words = read_word_list(self._word_list_path) if self._word_list_path is not None else []
+        word_counts = read_word_counts(self._word_counts_path) if self._word_counts_path is not None else collections.Counter()
+        with self._history_lock:
+            history = self._history.top(self._history.capacity)
+        for word, count in history:
+            word_counts[word] += count
+
+        popular = word_counts.most_common(self._popular_word_count)
+        top_words = [word for word, _ in popular[:25]]
+        popular.sort()
+        self._index = _Index(sorted({word.lower() for word in words}), [word for word, _ in popular], [count for _, count in popular], top_words)
+        logger.info(f'Refreshed word completer {{words: {len(self._index.words)}, popular_words: {len(popular)}, seconds: {time.perf_counter() - start_time:.2f}}}')
+
+    def complete(self, prefix: str, limit: int = 25) -> List[str]:
+        """
+        :param prefix:
+        :param limit: Maximum number of suggestions.
+        :return: Words that start with `prefix`, the most requested ones first.
+        """
+        index = self._index
+        prefix = prefix.strip().lower()
+
+        if len(prefix) == 0:
+            suggestions = index.top_words[:limit]
+        else:
+            popular = _prefix_range(index.popular_words, prefix)
+            suggestions = [index.popular_words[i] for i in heapq.nlargest(limit, popular, key=index.popular_counts.__getitem__)]
+        if len(suggestions) >= limit:
+            return suggestions
+
+        # Fill the rest with known words. Only as many as needed are looked at, since there can be thousands for a short prefix.
+        seen = set(suggestions)
+        known = _prefix_range(index.words, prefix)
+        for i in itertools.islice(known, limit + len(seen)):
+            if index.words[i] not in seen:
+                suggestions.append(index.words[i])
+                if len(suggestions) >= limit:
+                    break
+        return suggestions
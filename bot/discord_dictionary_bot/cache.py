@@ -0,0 +1,452 @@
+import collections
+import hashlib
+import io
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional, Union, Tuple, Iterable, Iterator
+
+from . import metrics
+from .utils import FileLock
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class Cache(ABC):
+    """
+    A byte string cache with separate namespaces for each kind of value, such as definitions, translations and audio. Other stores, such as a
+    networked cache shared by several hosts, can be added by implementing `_get()` and `_set()`.
+    """
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        value = self._get(namespace, key)
+        metrics.cache_requests.labels(namespace, 'hit' if value is not None else 'miss').inc()
+        return value
+
+    def open(self, namespace: str, key: str) -> Optional[io.BufferedIOBase]:
+        """
+        Get a value as a readable stream. This is meant for large values like audio, which some caches can stream without copying the whole
+        value first. The stream also supports `getbuffer()` like `io.BytesIO`.
+        :param namespace:
+        :param key:
+        :return: The stream, or None if the value is not cached.
+        """
+        stream = self._open(namespace, key)
+        metrics.cache_requests.labels(namespace, 'hit' if stream is not None else 'miss').inc()
+        return stream
+
+    def set(self, namespace: str, key: str, value: bytes):
+        self._set(namespace, key, value)
+
+    @abstractmethod
+    def _get(self, namespace: str, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def _open(self, namespace: str, key: str) -> Optional[io.BufferedIOBase]:
+        # Creating a BytesIO from a bytes object doesn't copy it
+        value = self._get(namespace, key)
+        return io.BytesIO(value) if value is not None else None
+
+    @abstractmethod
+    def _set(self, namespace: str, key: str, value: bytes):
+        raise NotImplementedError
+
+    def load_snapshot(self, path: Union[str, os.PathLike]) -> int:
+        """
+        Add every value in a snapshot to this cache. See `write_snapshot()`.
+        :param path:
+        :return: The number of values that were loaded.
+        """
+        count = 0
+        for namespace, key, value in read_snapshot(path):
+            self._set(namespace, key, value)
+            count += 1
+        logger.info(f'Loaded cache snapshot {{path: "{path}", values: {count}}}')
+        return count
+
+    def close(self):
+        pass
+
+
+_SNAPSHOT_MAGIC = b'DDBS'
+_SNAPSHOT_VERSION = 1
+
+# magic, version
+_SNAPSHOT_HEADER = struct.Struct('<4sI')
+
+# namespace length, key length, value length
+_SNAPSHOT_RECORD = struct.Struct('<HII')
+
+
+def write_snapshot(path: Union[str, os.PathLike], values: Iterable[Tuple[str, str, bytes]]) -> int:
+    """
+    Write cached values to a snapshot file that can be loaded into any cache with `Cache.load_snapshot()`. The file is written to a temporary
+    path first and then moved into place, so a bot that is starting never reads a partial snapshot.
+    :param path:
+    :param values: The namespace, key and value of each entry.
+    :return: The number of values that were written.
+    """
+    count = 0
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION))
+        for namespace, key, value in values:
+            namespace = namespace.encode()
+            key = key.encode()
+            file.write(_SNAPSHOT_RECORD.pack(len(namespace), len(key), len(value)))
+            file.write(namespace)
+            file.write(key)
+            file.write(value)
+            count += 1
+    os.replace(temporary_path, path)
+    return count
+
+
+def read_snapshot(path: Union[str, os.PathLike]) -> Iterator[Tuple[str, str, bytes]]:
+    """
+    Read the values in a snapshot file written by `write_snapshot()`.
+    :param path:
+    :return: The namespace, key and value of each entry.
+    """
+    with open(path, 'rb') as file:
+        header = file.read(_SNAPSHOT_HEADER.size)
+        if len(header) < _SNAPSHOT_HEADER.size or _SNAPSHOT_HEADER.unpack(header) != (_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION):
+            raise ValueError(f'"{path}" is not a cache snapshot or has an unsupported version')
+        while True:
+            record = file.read(_SNAPSHOT_RECORD.size)
+            if len(record) == 0:
+                return
+            if len(record) < _SNAPSHOT_RECORD.size:
+                raise ValueError(f'Cache snapshot "{path}" is truncated')
+            namespace_length, key_length, value_length = _SNAPSHOT_RECORD.unpack(record)
+            data = file.read(namespace_length + key_length + value_length)
+            if len(data) < namespace_length + key_length + value_length:
+                raise ValueError(f'Cache snapshot "{path}" is truncated')
+            yield data[:namespace_length].decode(), data[namespace_length:namespace_length + key_length].decode(), data[namespace_length + key_length:]
+
+
+class MemoryCache(Cache):
+    """
+    A least-recently-used cache that is local to the current process.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param max_bytes: Maximum total size of all values. The least recently used values are evicted when this is exceeded.
+        """
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._values: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, namespace: str, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._values.get((namespace, key))
+            if value is not None:
+                self._values.move_to_end((namespace, key))
+            return value
+
+    def _set(self, namespace: str, key: str, value: bytes):
+        if len(value) > self._max_bytes:
+            return
+        with self._lock:
+            previous = self._values.pop((namespace, key), None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._values[(namespace, key)] = value
+            self._size += len(value)
+            while self._size > self._max_bytes:
+                _, evicted = self._values.popitem(last=False)
+                self._size -= len(evicted)
+
+    def items(self) -> Iterator[Tuple[str, str, bytes]]:
+        """
+        :return: The namespace, key and value of every cached value, from least to most recently used.
+        """
+        with self._lock:
+            values = list(self._values.items())
+        for (namespace, key), value in values:
+            yield namespace, key, value
+
+
+class SQLiteCache(Cache):
+    """
+    A cache stored in an SQLite database, so that it can be shared by every process on the same host. The oldest values are evicted when the
+    database grows larger than `max_bytes`.
+    """
+
+    # Number of writes between checking the size of the database
+    EVICTION_CHECK_INTERVAL = 100
+
+    def __init__(self, path: Union[str, os.PathLike], max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param path: Path to the database file. Every process that uses the same path shares the same cache.
+        :param max_bytes: Approximate maximum total size of all values.
+        """
+        self._path = path
+        self._max_bytes = max_bytes
+        self._writes = 0
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS cache (namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, PRIMARY KEY (namespace, key))')
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections can't be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _get(self, namespace: str, key: str) -> Optional[bytes]:
+        row = self._connection().execute('SELECT value FROM cache WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+        return row[0] if row is not None else None
+
+    def _set(self, namespace: str, key: str, value: bytes):
+        connection = self._connection()
+        try:
+            connection.execute('INSERT OR REPLACE INTO cache (namespace, key, value) VALUES (?, ?, ?)', (namespace, key, value))
+            self._writes += 1
+            if self._writes % SQLiteCache.EVICTION_CHECK_INTERVAL == 0:
+                self._evict(connection)
+        except sqlite3.OperationalError as e:
+            # Another process is holding the lock. Losing a cache write is harmless.
+            logger.warning(f'Failed to write to cache: {e}')
+
+    def _evict(self, connection: sqlite3.Connection):
+        size = connection.execute('SELECT COALESCE(SUM(LENGTH(value)), 0) FROM cache').fetchone()[0]
+        if size <= self._max_bytes:
+            return
+
+        # Delete the oldest rows until the cache is at 90% of its maximum size, so that we don't need to evict again right away
+        excess = size - int(self._max_bytes * 0.9)
+        deleted = 0
+        rows = connection.execute('SELECT rowid, LENGTH(value) FROM cache ORDER BY rowid').fetchall()
+        row_ids = []
+        for row_id, length in rows:
+            if deleted >= excess:
+                break
+            row_ids.append((row_id,))
+            deleted += length
+        connection.executemany('DELETE FROM cache WHERE rowid = ?', row_ids)
+        logger.info(f'Evicted {len(row_ids)} values from cache {{size: {size}, max_bytes: {self._max_bytes}}}')
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class _RecordReader(io.BufferedIOBase):
+    """
+    Reads a value directly from the memory map of a `MappedFileCache`. Only the chunks that are read are copied. If the record is overwritten
+    while it is being read, the stream ends early instead of returning the new data.
+    """
+
+    def __init__(self, cache: 'MappedFileCache', offset: int, view: memoryview):
+        super().__init__()
+        self._cache = cache
+        self._offset = offset
+        self._view = view
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def getbuffer(self) -> memoryview:
+        return self._view
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(self._position + size, len(self._view))
+        data = bytes(self._view[self._position:end])
+        if not self._cache.is_intact(self._offset):
+            logger.warning('Cached value was overwritten while it was being read')
+            self._position = len(self._view)
+            return b''
+        self._position = end
+        return data
+
+    def read1(self, size: int = -1) -> bytes:
+        return self.read(size)
+
+    def close(self):
+        # The view must be released before the memory map can be closed
+        self._view.release()
+        super().close()
+
+
+class MappedFileCache(Cache):
+    """
+    A fixed-size cache in a memory-mapped file, so that it can be shared by every process on the same host without any copies through a
+    socket or database.
+
+    The file contains a header, a hash index and a data region that is used as a ring buffer:
+
+    - The header holds the layout of the file and the write position, which is the total number of data bytes ever written.
+    - Each index slot holds an 8 byte hash of a namespace and key, and the write position of its record. Collisions are resolved with linear
+      probing over a few slots.
+    - Each record is a 4 byte key length, a 4 byte value length, the key ("<namespace>\\0<key>" in UTF-8) and the value. Records never wrap
+      around the end of the data region.
+
+    New records overwrite the oldest ones, so there is no separate eviction. A record is intact as long as the write position has not moved
+    more than the size of the data region past it. Writers hold an exclusive file lock and advance the write position before writing, so
+    readers don't need a lock. They check that the record is still intact after reading it instead.
+    """
+
+    MAGIC = b'DDBC'
+    VERSION = 1
+
+    # magic, version, slot count, data size, write position
+    _HEADER = struct.Struct('<4sIQQQ')
+    _HEADER_SIZE = 64
+    _WRITE_POSITION_OFFSET = 24
+
+    # key hash, record position + 1 (0 means the slot is empty)
+    _SLOT = struct.Struct('<QQ')
+
+    # key length, value length
+    _RECORD = struct.Struct('<II')
+
+    # Maximum number of slots to check when looking up a key
+    MAX_PROBES = 16
+
+    def __init__(self, path: Union[str, os.PathLike], max_bytes: int = 256 * 1024 * 1024, average_record_size: int = 512):
+        """
+        :param path: Path to the cache file. It is created if it doesn't exist. Every process that uses the same path shares the same cache.
+        :param max_bytes: Size of the data region. If the file already exists, its own size is used instead.
+        :param average_record_size: Used to decide how many index slots to create.
+        """
+        self._lock = threading.Lock()
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT), 'r+b')
+        with self._file_lock():
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() < MappedFileCache._HEADER_SIZE:
+                slot_count = max(1024, max_bytes // average_record_size)
+                self._initialize(slot_count, max_bytes)
+            self._mmap = mmap.mmap(self._file.fileno(), 0)
+            magic, version, self._slot_count, self._data_size, _ = MappedFileCache._HEADER.unpack_from(self._mmap, 0)
+        if magic != MappedFileCache.MAGIC or version != MappedFileCache.VERSION:
+            raise ValueError(f'"{path}" is not a cache file or has an unsupported version')
+        if self._data_size != max_bytes:
+            logger.warning(f'Using the existing cache size {{path: "{path}", max_bytes: {self._data_size}}}')
+        self._data_offset = MappedFileCache._HEADER_SIZE + self._slot_count * MappedFileCache._SLOT.size
+
+    def _initialize(self, slot_count: int, data_size: int):
+        self._file.truncate(MappedFileCache._HEADER_SIZE + slot_count * MappedFileCache._SLOT.size + data_size)
+        self._file.seek(0)
+        self._file.write(MappedFileCache._HEADER.pack(MappedFileCache.MAGIC, MappedFileCache.VERSION, slot_count, data_size, 0))
+        self._file.flush()
+
+    def _file_lock(self):
+        return FileLock(self._file, self._lock)
+
+    @property
+    def _write_position(self) -> int:
+        return struct.unpack_from('<Q', self._mmap, MappedFileCache._WRITE_POSITION_OFFSET)[0]
+
+    @staticmethod
+    def _hash(key: bytes) -> int:
+        # Python's hash() is randomized for each process, so it can't be used here
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+    def is_intact(self, position: int) -> bool:
+        """
+        :param position: Write position of a record.
+        :return: Whether the record at `position` has not been overwritten yet.
+        """
+        return self._write_position - position <= self._data_size
+
+    def _find(self, key: bytes) -> Optional[Tuple[int, int, int]]:
+        """
+        :return: The write position of the record, and the offset and length of its value in the file. None if the key is not cached.
+        """
+        key_hash = self._hash(key)
+        first_slot = key_hash % self._slot_count
+        for i in range(MappedFileCache.MAX_PROBES):
+            slot_hash, position = MappedFileCache._SLOT.unpack_from(self._mmap, MappedFileCache._HEADER_SIZE + ((first_slot + i) % self._slot_count) * MappedFileCache._SLOT.size)
+            if position == 0:
+                return None
+            position -= 1
+            if slot_hash != key_hash or not self.is_intact(position):
+                continue
+            record_offset = self._data_offset + position % self._data_size
+            key_length, value_length = MappedFileCache._RECORD.unpack_from(self._mmap, record_offset)
+            key_offset = record_offset + MappedFileCache._RECORD.size
+            if key_length != len(key) or self._mmap[key_offset:key_offset + key_length] != key or not self.is_intact(position):
+                continue
+            return position, key_offset + key_length, value_length
+        return None
+
+    def _get(self, namespace: str, key: str) -> Optional[bytes]:
+        result = self._find(f'{namespace}\0{key}'.encode())
+        if result is None:
+            return None
+        position, value_offset, value_length = result
+        value = self._mmap[value_offset:value_offset + value_length]
+        return value if self.is_intact(position) else None
+
+    def _open(self, namespace: str, key: str) -> Optional[io.BufferedIOBase]:
+        result = self._find(f'{namespace}\0{key}'.encode())
+        if result is None:
+            return None
+        position, value_offset, value_length = result
+        return _RecordReader(self, position, memoryview(self._mmap)[value_offset:value_offset + value_length])
+
+    def _set(self, namespace: str, key: str, value: bytes):
+        key = f'{namespace}\0{key}'.encode()
+        record_size = MappedFileCache._RECORD.size + len(key) + len(value)
+
+        # Leave half of the data region for other records, so that one large value can't evict everything
+        if record_size > self._data_size // 2:
+            return
+
+        with self._file_lock():
+            position = self._write_position
+
+            # Records don't wrap around the end of the data region, so skip to the start if there is not enough space left
+            remaining = self._data_size - position % self._data_size
+            if record_size > remaining:
+                position += remaining
+
+            # Advance the write position first, so that readers know the records we are about to overwrite are no longer intact
+            struct.pack_into('<Q', self._mmap, MappedFileCache._WRITE_POSITION_OFFSET, position + record_size)
+
+            record_offset = self._data_offset + position % self._data_size
+            MappedFileCache._RECORD.pack_into(self._mmap, record_offset, len(key), len(value))
+            key_offset = record_offset + MappedFileCache._RECORD.size
+            self._mmap[key_offset:key_offset + len(key)] = key
+            self._mmap[key_offset + len(key):key_offset + len(key) + len(value)] = value
+
+            # Point a slot at the new record. Use the slot that already has this key, or else the first empty or overwritten slot, or else the
+            # slot with the oldest record.
+            key_hash = self._hash(key)
+            first_slot = key_hash % self._slot_count
+            chosen_slot = None
+            oldest_position = None
+            for i in range(MappedFileCache.MAX_PROBES):
+                slot = (first_slot + i) % self._slot_count
+                slot_hash, slot_position = MappedFileCache._SLOT.unpack_from(self._mmap, MappedFileCache._HEADER_SIZE + slot * MappedFileCache._SLOT.size)
+                if slot_position == 0 or slot_hash == key_hash or not self.is_intact(slot_position - 1):
+                    chosen_slot = slot
+                    break
+                if oldest_position is None or slot_position < oldest_position:
+                    chosen_slot = slot
+                    oldest_position = slot_position
+            MappedFileCache._SLOT.pack_into(self._mmap, MappedFileCache._HEADER_SIZE + chosen_slot * MappedFileCache._SLOT.size, key_hash, position + 1)
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            # A stream of a cached value is still open. The memory map will be closed when the process exits.
+            logger.warning('Could not close the cache because a cached value is still being read')
+            return
+        self._file.close()
@@ -4,10 +4,12 @@ import asyncio
 import logging
 import sqlite3 as sql
 import re
-from typing import Union, Optional, Dict, List, Tuple, Set
+from typing import Union, Optional, Dict, List, Tuple, Set, Sequence
 from pathlib import Path
 import html
+import json
 
+from discord.ext import tasks
 from discord.ext.commands import Cog, Bot
 from google.cloud import texttospeech
 import babel
@@ -16,9 +18,15 @@ from discord import app_commands
 from google.cloud.texttospeech_v1.services.text_to_speech.transports.grpc import TextToSpeechGrpcTransport
 from google.cloud import translate_v2 as translate
 
+from ..autocomplete import WordCompleter
+from ..cache import Cache
+from ..definitions import DefinitionEntry, DefinitionResult
+from ..spelling import SpellingIndex
 from ..dictionary_api import DictionaryAPI, SequentialDictionaryAPI
 from ..exceptions import InsufficientPermissionsException
 from ..analytics import log_definition_request
+from .. import metrics
+from ..tracing import tracer
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -80,6 +88,36 @@ def is_valid_word(word: str):
     return pattern.search(word) is not None
 
 
+def translation_cache_key(text: str, target_language: str, source_language: Optional[str] = None) -> str:
+    return f'{source_language}:{target_language}:{text}'
+
+
+def encode_translation(result: Dict[str, str]) -> bytes:
+    """
+    Encode the result of a Google Translate request for the 'translations' cache namespace.
+    :param result:
+    :return:
+    """
+    return json.dumps({'translatedText': result['translatedText'], 'detectedSourceLanguage': result.get('detectedSourceLanguage')}).encode()
+
+
+def text_to_speech_cache_key(text_to_speech_input: str, language: str) -> str:
+    return f'{language}:{text_to_speech_input}'
+
+
+def create_text_to_speech_input(word: str, definitions: Sequence[DefinitionEntry]) -> str:
+    """
+    Create the text that is spoken for the definitions of a word.
+    :param word:
+    :param definitions:
+    :return:
+    """
+    tts_input = f'{word}, '
+    for i, definition in enumerate(definitions):
+        tts_input += f' {i + 1}, {definition.word_type}, {definition.definition}'
+    return tts_input
+
+
 class Dictionary(Cog):
     TRANSLATE_MAX_MESSAGE_LENGTH = 200
 
@@ -91,12 +129,26 @@ class Dictionary(Cog):
                                         {'language': 'es', 'name': 'Spanish'}, {'language': 'sv', 'name': 'Swedish'}, {'language': 'th', 'name': 'Thai'}, {'language': 'tr', 'name': 'Turkish'}, {'language': 'uk', 'name': 'Ukrainian'},
                                         {'language': 'vi', 'name': 'Vietnamese'}]
 
-    def __init__(self, bot: Bot, dictionary_apis: [DictionaryAPI], ffmpeg_path: Union[str, Path]):
+    def __init__(self, bot: Bot, dictionary_apis: [DictionaryAPI], ffmpeg_path: Union[str, Path], cache: Optional[Cache] = None,
+                 spelling_index: Optional[SpellingIndex] = None, word_completer: Optional[WordCompleter] = None):
+        """
+        :param bot:
+        :param dictionary_apis:
+        :param ffmpeg_path:
+        :param cache: Cache for definitions, translations and text-to-speech audio. If this is None, nothing is cached.
+        :param spelling_index: Used to suggest corrections for words that none of the dictionary API's have definitions for. If this is None,
+        no corrections are suggested.
+        :param word_completer: Suggests words for the `word` argument of the `define` command. It is refreshed every 10 minutes. If this is
+        None, no words are suggested.
+        """
         super().__init__()
 
         self._bot = bot
         self._dictionary_apis = {api.id(): api for api in dictionary_apis}
         self._ffmpeg_path = Path(ffmpeg_path)
+        self._cache = cache
+        self._spelling_index = spelling_index
+        self._word_completer = word_completer
 
         # Create and populate a table of supported text-to-speech voices
         self._create_voices_table()
@@ -161,9 +213,30 @@ class Dictionary(Cog):
         # Discord enforces a limit of 25 items that can be returned from an interaction, so just return the first 25
         return matched_choices[:25]
 
+    async def _word_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        if self._word_completer is None:
+            return []
+        return [app_commands.Choice(name=word, value=word) for word in self._word_completer.complete(current, limit=25)]
+
+    async def cog_load(self) -> None:
+        if self._word_completer is not None:
+            self._refresh_word_completer_loop.start()
+
+    async def cog_unload(self) -> None:
+        self._refresh_word_completer_loop.cancel()
+
+    @tasks.loop(minutes=10)
+    async def _refresh_word_completer_loop(self):
+        # Reading the word list takes a while, so don't block the event loop
+        try:
+            await asyncio.to_thread(self._word_completer.refresh)
+        except Exception as e:
+            logger.exception('Failed to refresh word completer!', exc_info=e)
+
     @app_commands.command(name='define', description='Gets the definition of a word.')
     @app_commands.describe(word='The word to define', text_to_speech='Use text to speech?', language='The language to translate the definition to.')
-    @app_commands.autocomplete(language=_language_autocomplete)
+    @app_commands.autocomplete(word=_word_autocomplete, language=_language_autocomplete)
+    @tracer.trace_interaction('define')
     async def define(self, interaction: discord.Interaction, word: str, text_to_speech: bool = False, language: Optional[str] = None):
 
         # Get default language if none specified
@@ -210,7 +283,7 @@ class Dictionary(Cog):
 
         # Get dictionary api
         dictionary_api_property = self._bot._scoped_property_manager.get('dictionary_apis', interaction.channel)
-        dictionary_api = SequentialDictionaryAPI([self._dictionary_apis[api_id] for api_id in dictionary_api_property if api_id in self._dictionary_apis])
+        dictionary_api = SequentialDictionaryAPI([self._dictionary_apis[api_id] for api_id in dictionary_api_property if api_id in self._dictionary_apis], cache=self._cache)
 
         # Translate the word to english
         if self._bot._scoped_property_manager.get('auto_translate', interaction.channel):
@@ -219,29 +292,40 @@ class Dictionary(Cog):
             detected_source_language = 'en'
 
         # Get definition
-        definitions, definition_source = await dictionary_api.define_with_source(word)
+        result = await dictionary_api.define_with_source(word)
 
-        if len(definitions) == 0:
+        if len(result.entries) == 0:
             reply = f'__**{word}**__'
             if detected_source_language != 'en':
                 reply += f' (Translated from {self._get_language_name(detected_source_language)})'
             reply += '\nI couldn\'t find any definitions for that word.'
+
+            # Suggest corrections only after every dictionary API failed, since the index is missing inflected forms like "cats" or
+            # "walked". The index only has single words.
+            if self._spelling_index is not None and ' ' not in word and word not in self._spelling_index:
+                with tracer.span('spelling.suggest'):
+                    suggestions = self._spelling_index.suggest(word)
+                if len(suggestions) > 0:
+                    metrics.spelling_suggestions.inc()
+                    reply += ' Did you mean ' + ', '.join(f'`{x}`' for x in suggestions) + '?'
+
             await interaction.followup.send(reply)
             return
 
         # Record analytics only for valid words
         log_definition_request(word, text_to_speech, language, interaction.channel)
+        if self._word_completer is not None:
+            self._word_completer.record(word)
 
         # Translate word and definitions to target language
         if language_code != 'en':
-            word, _ = self._translate(word, language_code)
-            for i in range(len(definitions)):
-                definitions[i]['word_type'], _ = self._translate(definitions[i]['word_type'], language_code)
-                definitions[i]['definition'], _ = self._translate(definitions[i]['definition'], language_code)
+            entries = tuple(DefinitionEntry(self._translate(entry.word_type, language_code)[0], self._translate(entry.definition, language_code)[0]) for entry in result.entries)
+            result = DefinitionResult(self._translate(result.word, language_code)[0], result.source, entries, language_code)
 
         # Prepare response text and text-to-speech input
         show_definition_source = self._bot._scoped_property_manager.get('show_definition_source', interaction.channel)
-        reply, text_to_speech_input = self.create_reply(word, definitions, definition_source=definition_source.name if show_definition_source else None, detected_source_language=detected_source_language)
+        definition_source = self._dictionary_apis[result.source].name if show_definition_source else None
+        reply, text_to_speech_input = self.create_reply(result, definition_source=definition_source, detected_source_language=detected_source_language)
 
         if text_to_speech:
             voice_code = self._language_to_voice_map[language_code]
@@ -261,6 +345,7 @@ class Dictionary(Cog):
         voice='The voice to use when speaking'
     )
     @app_commands.autocomplete(language=_language_autocomplete, voice=_voice_autocomplete)
+    @tracer.trace_interaction('say')
     async def say(self, interaction: discord.Interaction, message: str, language: Optional[str] = None, voice: Optional[str] = None):
 
         # Limit message size
@@ -350,35 +435,53 @@ class Dictionary(Cog):
             self._voice_channels[voice_channel] += 1
 
         # Get text-to-speech data
-        text_to_speech_bytes = await self._get_text_to_speech(text_to_speech_input, language=language)
+        with tracer.span('text_to_speech', language=language):
+            text_to_speech_bytes = await self._get_text_to_speech(text_to_speech_input, language=language)
 
-        # Check if we got valid text-to-speech data
-        if text_to_speech_bytes.getbuffer().nbytes <= 0:
+        # Cached audio may be read straight from the cache's memory map, which can't be closed until the audio is closed
+        playing = False
+        try:
 
-            logger.error('There was a problem generating the text-to-speech!')
-            await interaction.followup.send('There was a problem generating the text-to-speech!')
+            # Check if we got valid text-to-speech data
+            if text_to_speech_bytes.getbuffer().nbytes <= 0:
 
-            if allow_partial_success:
-                # Send text chat reply
-                await interaction.followup.send(text)
+                logger.error('There was a problem generating the text-to-speech!')
+                await interaction.followup.send('There was a problem generating the text-to-speech!')
 
-            # Update voice channel map
-            self._voice_channels[voice_channel] -= 1
+                if allow_partial_success:
+                    # Send text chat reply
+                    await interaction.followup.send(text)
 
-            # Disconnect from the voice channel if we don't need it anymore
-            if self._voice_channels[voice_channel] <= 0:
-                await self._leave_voice_channel(voice_channel)
+                # Update voice channel map
+                self._voice_channels[voice_channel] -= 1
 
-        else:
+                # Disconnect from the voice channel if we don't need it anymore
+                if self._voice_channels[voice_channel] <= 0:
+                    await self._leave_voice_channel(voice_channel)
 
-            # Join the voice channel
-            try:
-                await self._guild_locks[interaction.guild].acquire()
+            else:
 
-                # Check if this request was cancelled
-                if interaction.id not in self._pending_interactions:
-                    await interaction.followup.send('Request cancelled!')
+                # Join the voice channel
+                try:
+                    with tracer.span('guild_lock.wait', locked=self._guild_locks[interaction.guild].locked()):
+                        await self._guild_locks[interaction.guild].acquire()
 
+                    # Check if this request was cancelled
+                    if interaction.id not in self._pending_interactions:
+                        await interaction.followup.send('Request cancelled!')
+
+                        # Update voice channel map
+                        self._voice_channels[voice_channel] -= 1
+
+                        # Disconnect from the voice channel if we don't need it anymore
+                        if self._voice_channels[voice_channel] <= 0:
+                            await self._leave_voice_channel(voice_channel)
+                        self._guild_locks[interaction.guild].release()
+
+                        return
+
+                    voice_client = await self._join_voice_channel(voice_channel)
+                except InsufficientPermissionsException as e:
                     # Update voice channel map
                     self._voice_channels[voice_channel] -= 1
 
@@ -386,50 +489,44 @@ class Dictionary(Cog):
                     if self._voice_channels[voice_channel] <= 0:
                         await self._leave_voice_channel(voice_channel)
                     self._guild_locks[interaction.guild].release()
-
+                    await interaction.followup.send(f'I don\'t have permission to join your voice channel! Please grant me the following permissions: ' + ', '.join(f'`{x}`' for x in e.permissions) + '.')
                     return
 
-                voice_client = await self._join_voice_channel(voice_channel)
-            except InsufficientPermissionsException as e:
-                # Update voice channel map
-                self._voice_channels[voice_channel] -= 1
-
-                # Disconnect from the voice channel if we don't need it anymore
-                if self._voice_channels[voice_channel] <= 0:
-                    await self._leave_voice_channel(voice_channel)
-                self._guild_locks[interaction.guild].release()
-                await interaction.followup.send(f'I don\'t have permission to join your voice channel! Please grant me the following permissions: ' + ', '.join(f'`{x}`' for x in e.permissions) + '.')
-                return
-
-            # Send text chat reply
-            await interaction.followup.send(text)
+                # Send text chat reply
+                await interaction.followup.send(text)
 
-            # Create a callback to be invoked when the bot is finished playing audio
-            def after(error):
+                # Create a callback to be invoked when the bot is finished playing audio
+                def after(error):
 
-                # A nested async function is used here to ensure that the bot leaves the voice channel before releasing the associated locks
-                async def after_coroutine(error):
+                    # A nested async function is used here to ensure that the bot leaves the voice channel before releasing the associated locks
+                    async def after_coroutine(error):
 
-                    if error is not None:
-                        logger.error(f'An error occurred while playing audio: {error}')
+                        if error is not None:
+                            logger.error(f'An error occurred while playing audio: {error}')
 
-                    # Update voice channel map
-                    self._voice_channels[voice_channel] -= 1
+                        # Update voice channel map
+                        self._voice_channels[voice_channel] -= 1
 
-                    # Disconnect from the voice channel if we don't need it anymore
-                    if self._voice_channels[voice_channel] <= 0:
-                        await self._leave_voice_channel(voice_channel)
+                        # Disconnect from the voice channel if we don't need it anymore
+                        if self._voice_channels[voice_channel] <= 0:
+                            await self._leave_voice_channel(voice_channel)
 
-                    self._guild_locks[interaction.guild].release()
+                        self._guild_locks[interaction.guild].release()
 
-                asyncio.run_coroutine_threadsafe(after_coroutine(error), self._bot.loop)
+                    text_to_speech_bytes.close()
+                    asyncio.run_coroutine_threadsafe(after_coroutine(error), self._bot.loop)
 
-            # Speak
-            voice_client.play(discord.PCMAudio(text_to_speech_bytes), after=after)
+                # Speak. The audio is closed by the callback once it has been played.
+                voice_client.play(discord.PCMAudio(text_to_speech_bytes), after=after)
+                playing = True
+        finally:
+            if not playing:
+                text_to_speech_bytes.close()
 
     @app_commands.command(name='translate', description='Translate a message from one language to another.')
     @app_commands.describe(target_language='The language to translate to.', message='The message to translate.')
     @app_commands.autocomplete(target_language=_language_autocomplete)
+    @tracer.trace_interaction('translate')
     async def translate(self, interaction: discord.Interaction, target_language: str, message: str):
 
         # Limit message length
@@ -448,7 +545,15 @@ class Dictionary(Cog):
         await interaction.followup.send(self._create_translate_reply(message, detected_language, translated_message, target_language_code))
 
     def _translate(self, text: str, target_language: str, source_language: str = None):
-        result = self._translate_client.translate(text, target_language=target_language, source_language=source_language)
+        cache_key = translation_cache_key(text, target_language, source_language)
+        cached = self._cache.get('translations', cache_key) if self._cache is not None else None
+        if cached is not None:
+            result = json.loads(cached)
+        else:
+            with tracer.span('translate', target_language=target_language), metrics.translate_duration.time():
+                result = self._translate_client.translate(text, target_language=target_language, source_language=source_language)
+            if self._cache is not None:
+                self._cache.set('translations', cache_key, encode_translation(result))
         translated_text = html.unescape(result['translatedText'])
 
         if source_language is None:
@@ -496,55 +601,67 @@ class Dictionary(Cog):
                 return voice_client
 
         # Connect to the voice channel
-        return await voice_channel.connect()
+        with tracer.span('voice.connect'), metrics.voice_connect_duration.time():
+            return await voice_channel.connect()
 
     async def _leave_voice_channel(self, voice_channel: discord.VoiceChannel) -> None:
         for voice_client in self._bot.voice_clients:
             if voice_client.channel == voice_channel:
                 await voice_client.disconnect()
 
-    def create_reply(self, word: str, definitions, definition_source: Optional[str] = None, detected_source_language: str = 'en') -> (str, str):
+    def create_reply(self, result: DefinitionResult, definition_source: Optional[str] = None, detected_source_language: str = 'en') -> (str, str):
         """
         Create a reply.
-        :param word:
-        :param definitions:
+        :param result:
         :param definition_source:
         :param detected_source_language:
         :return:
         """
 
-        reply = f'__**{word}**__'
+        reply = f'__**{result.word}**__'
         if detected_source_language != 'en':
             reply += f' (Translated from {self._get_language_name(detected_source_language)})'
         reply += '\n'
-        tts_input = f'{word}, '
-
-        for i, definition in enumerate(definitions):
-            word_type = definition['word_type']
-            definition_text = definition['definition']
 
-            reply += f'**[{i + 1}]** ({word_type})\n' + definition_text + '\n'
-            tts_input += f' {i + 1}, {word_type}, {definition_text}'
+        for i, entry in enumerate(result.entries):
+            reply += f'**[{i + 1}]** ({entry.word_type})\n' + entry.definition + '\n'
 
         if definition_source is not None:
             reply += f'\n*Definitions provided by {definition_source}.*'
 
-        return reply, tts_input
+        return reply, create_text_to_speech_input(result.word, result.entries)
+
+    async def _get_text_to_speech(self, tts_input: str, language: str) -> io.BufferedIOBase:
+        """
+        :param tts_input:
+        :param language:
+        :return: The audio, which is empty if it could not be generated. It must be closed once it has been played.
+        """
+        cache_key = text_to_speech_cache_key(tts_input, language)
+        if self._cache is not None:
+            # Cached audio is streamed straight from the cache without copying it
+            cached = self._cache.open('audio', cache_key)
+            if cached is not None:
+                return cached
 
-    async def _get_text_to_speech(self, tts_input: str, language: str) -> io.BytesIO:
         result = io.BytesIO()
 
         try:
-            text_to_speech_bytes = text_to_speech_pcm(tts_input, language=language)
+            with tracer.span('text_to_speech.synthesize', language=language), metrics.text_to_speech_duration.time():
+                text_to_speech_bytes = text_to_speech_pcm(tts_input, language=language)
         except Exception as e:
             logger.error(f'Failed to generate text-to-speech data: {e}. You might be using an invalid language: "{language}"')
             return result
 
         # Convert to proper format
-        text_to_speech_bytes = await convert(text_to_speech_bytes, ffmpeg_path=self._ffmpeg_path)
+        with tracer.span('text_to_speech.convert'), metrics.ffmpeg_duration.time():
+            text_to_speech_bytes = await convert(text_to_speech_bytes, ffmpeg_path=self._ffmpeg_path)
         result.write(text_to_speech_bytes)
         result.seek(0)
 
+        if self._cache is not None and len(text_to_speech_bytes) > 0:
+            self._cache.set('audio', cache_key, text_to_speech_bytes)
+
         return result
 
     @app_commands.command(name='stop', description='Makes the bot stop talking.')
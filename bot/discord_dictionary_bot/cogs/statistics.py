@@ -1,56 +1,124 @@
+import asyncio
 import logging
+import time
+from typing import Optional
 
 from discord import app_commands, Interaction
+from discord.ext import tasks
 from discord.ext.commands import Cog, Bot
 from google.cloud import bigquery
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+CHANNEL_COUNT_QUERY = 'SELECT COUNT(DISTINCT(channel_id)) AS uniqueChannels FROM analytics.definition_requests'
+TOTAL_REQUESTS_QUERY = 'SELECT COUNT(*) AS total FROM analytics.definition_requests'
+TOP_WORDS_QUERY = 'SELECT word, COUNT(word) AS count, MAX(time) as time FROM analytics.definition_requests GROUP BY word HAVING count > 1 ORDER BY count DESC, time DESC LIMIT 5'
+RECENT_WORDS_QUERY = 'SELECT word, MAX(time) as time FROM analytics.definition_requests GROUP BY word ORDER BY time DESC LIMIT 3'
+
 
 class Statistics(Cog):
 
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, cache_ttl: float = 60 * 10):
+        """
+        The statistics are computed in the background and cached, so the `stats` command can reply immediately. If the cached statistics are
+        older than `cache_ttl`, they are still shown while new statistics are computed in the background.
+        :param bot:
+        :param cache_ttl: Number of seconds before the cached statistics are considered stale.
+        """
         super().__init__()
         self._bot = bot
         self._bigquery_client = bigquery.Client()
+        self._cache_ttl = cache_ttl
+
+        # Cached reply and the time it was computed
+        self._reply: Optional[str] = None
+        self._reply_time = 0.0
+
+        # The refresh that is currently running, if any. This makes sure that only one refresh runs at a time.
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        self._refresh_loop.change_interval(seconds=cache_ttl)
+
+    async def cog_load(self) -> None:
+        self._refresh_loop.start()
+
+    async def cog_unload(self) -> None:
+        self._refresh_loop.cancel()
+
+    @tasks.loop(minutes=10)
+    async def _refresh_loop(self):
+        try:
+            await self._start_refresh()
+        except Exception as e:
+            logger.exception('Failed to refresh statistics!', exc_info=e)
+
+    @_refresh_loop.before_loop
+    async def _before_refresh_loop(self):
+        # Wait until we know how many guilds we are in
+        await self._bot.wait_until_ready()
 
     @app_commands.command(name='stats', description='Shows some statistics about the bot.')
     async def stats(self, interaction: Interaction):
-        await interaction.response.defer(ephemeral=True)
-        reply = '**----- Statistics -----**\n'
 
-        # Channel count
-        channel_count_job = self._bigquery_client.query('SELECT COUNT(DISTINCT(channel_id)) AS uniqueChannels FROM analytics.definition_requests')
-        channel_count_results = channel_count_job.result()
-        for row in channel_count_results:
-            channel_count = row.uniqueChannels
+        # We have never computed the statistics, so we need to wait for them
+        if self._reply is None:
+            await interaction.response.defer(ephemeral=True)
+            try:
+                reply = await asyncio.shield(self._start_refresh())
+            except Exception as e:
+                logger.exception('Failed to compute statistics!', exc_info=e)
+                await interaction.followup.send('Statistics are not available right now. Please try again later.')
+                return
+            await interaction.followup.send(reply)
+            return
+
+        # Reply with the cached statistics and refresh them in the background if they are stale
+        if time.monotonic() - self._reply_time > self._cache_ttl:
+            self._start_refresh()
+        await interaction.response.send_message(self._reply, ephemeral=True)
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+
+            # Retrieve the exception so that it isn't reported as unhandled when nobody is waiting on the task
+            self._refresh_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+        return self._refresh_task
+
+    def _query(self, query: str) -> list:
+        return list(self._bigquery_client.query(query).result())
+
+    async def _refresh(self) -> str:
+        # Run all queries concurrently on worker threads so that they don't block the event loop
+        channel_count_results, total_requests_results, top_5_words_results, recent_words_results = await asyncio.gather(
+            asyncio.to_thread(self._query, CHANNEL_COUNT_QUERY),
+            asyncio.to_thread(self._query, TOTAL_REQUESTS_QUERY),
+            asyncio.to_thread(self._query, TOP_WORDS_QUERY),
+            asyncio.to_thread(self._query, RECENT_WORDS_QUERY)
+        )
+
+        reply = '**----- Statistics -----**\n'
 
         # Guild count
         reply += '**Guilds**\n'
-        reply += f'Active in **{len(self._bot.guilds):,}** guilds and **{channel_count:,}** channels.\n\n'
+        reply += f'Active in **{len(self._bot.guilds):,}** guilds and **{channel_count_results[0].uniqueChannels:,}** channels.\n\n'
 
         # Total requests
         reply += '**Total Requests**\n'
-        total_requests_job = self._bigquery_client.query('SELECT COUNT(*) AS total FROM analytics.definition_requests')
-        total_requests_results = total_requests_job.result()
-        for row in total_requests_results:
-            total_requests = row.total
-        reply += f'**{total_requests:,}** requests.\n\n'
+        reply += f'**{total_requests_results[0].total:,}** requests.\n\n'
 
         # Most common words
         reply += '**Most Common Words**\n'
-        top_5_words_job = self._bigquery_client.query(
-            'SELECT word, COUNT(word) AS count, MAX(time) as time FROM analytics.definition_requests GROUP BY word HAVING count > 1 ORDER BY count DESC, time DESC LIMIT 5')
-        top_5_words_results = top_5_words_job.result()
         for i, row in enumerate(top_5_words_results):
             reply += f'{i + 1}. `{row.word}` ({row.count})\n'
 
         # Most recent words
         reply += '\n**Most Recent Words**\n'
-        job = self._bigquery_client.query('SELECT word, MAX(time) as time FROM analytics.definition_requests GROUP BY word ORDER BY time DESC LIMIT 3')
-        results = job.result()
-        for i, row in enumerate(results):
+        for i, row in enumerate(recent_words_results):
             reply += f'{i + 1}. `{row.word}`\n'
 
-        await interaction.followup.send(reply)
+        self._reply = reply
+        self._reply_time = time.monotonic()
+        return reply
@@ -0,0 +1,51 @@
+from typing import NamedTuple, Optional, Tuple
+
+
+class DefinitionEntry(NamedTuple):
+    # Part of speech, such as "noun"
+    word_type: str
+
+    definition: str
+
+
+class DefinitionResult(NamedTuple):
+    """
+    The definitions of a word from a single dictionary API.
+
+    Results are encoded for caches as a version byte followed by the fields in UTF-8, separated by null characters. A definition takes only
+    two bytes more than its text, and decoding is a single `decode()` and `split()` without parsing any structure.
+    """
+
+    word: str
+
+    # ID of the dictionary API that provided the definitions, or None if no API had any
+    source: Optional[str]
+
+    entries: Tuple[DefinitionEntry, ...]
+
+    # Language of the word and definitions
+    language: str = 'en'
+
+    VERSION = 1
+
+    def to_bytes(self) -> bytes:
+        fields = [self.word, self.source or '', self.language]
+        for entry in self.entries:
+            fields.append(entry.word_type)
+            fields.append(entry.definition)
+        return bytes([DefinitionResult.VERSION]) + '\0'.join(field.replace('\0', '') for field in fields).encode()
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'DefinitionResult':
+        """
+        :param data: Data encoded by `to_bytes()`.
+        :return:
+        :raises ValueError: If the data is not a result or was encoded by an unsupported version.
+        """
+        if len(data) == 0 or data[0] != DefinitionResult.VERSION:
+            raise ValueError('Unsupported definition result version')
+        fields = data[1:].decode().split('\0')
+        if len(fields) < 3 or len(fields) % 2 == 0:
+            raise ValueError('Invalid definition result')
+        entries = tuple(DefinitionEntry(fields[i], fields[i + 1]) for i in range(3, len(fields), 2))
+        return DefinitionResult(fields[0], fields[1] or None, entries, fields[2])
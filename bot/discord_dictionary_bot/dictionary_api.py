@@ -2,27 +2,46 @@ import asyncio
 from abc import ABC, abstractmethod
 import aiohttp
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import struct
+import time
+from datetime import timedelta
+from typing import List, Optional, Iterator, TypedDict
 
 from . import analytics
+from .cache import Cache
+from .definitions import DefinitionEntry, DefinitionResult
+from .json_decoder import decode_json
+from . import metrics
+from .rate_limiter import RateLimiter
+from .tracing import tracer
+from .word_store import WordStore
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Responses larger than this many bytes are not read. The responses for real words are a few kilobytes at most.
+MAX_RESPONSE_SIZE = 256 * 1024
+
+# Maximum number of definitions to keep from a response. More than this won't fit in a Discord message anyway.
+MAX_DEFINITIONS = 10
+
+
+class DictionaryAPIError(Exception):
+    """
+    Raised when a dictionary API could not be asked for definitions, or its response could not be read. Unlike an empty list of definitions,
+    this doesn't mean that the API doesn't know the word.
+    """
+
 
 class DictionaryAPI(ABC):
 
     @abstractmethod
-    async def define(self, word: str) -> List[Dict[str, str]]:
+    async def define(self, word: str) -> List[DefinitionEntry]:
         """
-        Get the definitions for the specified word. The returned format should be as follows:
-        [
-        {word_type: 'str', definition: 'str'},
-        ...
-        ]
+        Get the definitions for the specified word.
         :param word: The word to define.
-        :return: A list of definitions for the specified word.
+        :return: A list of definitions for the specified word. The list is empty only if the API doesn't have any definitions for it.
+        :raises DictionaryAPIError: If the API failed to respond with definitions.
         """
         return []
 
@@ -38,80 +57,137 @@ class DictionaryAPI(ABC):
     def name(self) -> str:
         raise NotImplementedError
 
+    def remaining_requests(self) -> Optional[int]:
+        """
+        :return: The number of requests that can be made right now, or None if this API is not rate limited.
+        """
+        return None
+
+    def is_cacheable(self) -> bool:
+        """
+        :return: Whether the results of this API should be cached. API's that are as fast as the cache don't need to be.
+        """
+        return True
 
-async def handle_default_status(api, word, response):
+
+async def handle_default_status(api, word, response) -> bool:
+    """
+    :return: True if the response has definitions, or False if the API doesn't know the word.
+    :raises DictionaryAPIError: If the request failed.
+    """
     if response.status == 401:
         logger.error(f'{api} Permission denied! You are probably using an invalid API key. {{Status code: {response.status}, Word: "{word}"}}')
-        return False
+        raise DictionaryAPIError(f'Permission denied (status code {response.status})')
     elif response.status == 404:
         logger.info(f'{api} Could not find a definition for "{word}"')
         return False
 
     if response.status != 200:
         logger.error(f'{api} Error getting definition! {{status_code: {response.status}, word: "{word}", content: "{await response.text()}"}}')
-        return False
+        raise DictionaryAPIError(f'Error getting definition (status code {response.status})')
 
     return True
 
 
-class RequestLimiter:
+async def read_definitions(api, word: str, response: aiohttp.ClientResponse) -> List[DefinitionEntry]:
+    """
+    Read the body of a successful response and get up to `MAX_DEFINITIONS` definitions from it with the API's `parse_response()` method. The body
+    is read in chunks, and reading stops as soon as it is larger than `MAX_RESPONSE_SIZE`.
+    :param api:
+    :param word:
+    :param response:
+    :return: The definitions.
+    :raises DictionaryAPIError: If the response is too large or doesn't have the expected format.
+    """
+    if response.content_length is not None and response.content_length > MAX_RESPONSE_SIZE:
+        raise DictionaryAPIError(f'Response is too large! {{content_length: {response.content_length}, word: "{word}"}}')
 
-    def __init__(self, request_limit: int, request_period: timedelta):
-        self._request_limit = request_limit
-        self._request_period = request_period
-        self._request_period_start = datetime.now()
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        body += chunk
+        if len(body) > MAX_RESPONSE_SIZE:
+            raise DictionaryAPIError(f'Response is too large! {{word: "{word}"}}')
 
-        # Number of requests made in the current time period
-        self._request_count = 0
+    try:
+        return api.parse_response(bytes(body), max_definitions=MAX_DEFINITIONS)
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise DictionaryAPIError(f'Bad response format: {e!r} {{word: "{word}"}}') from e
 
-    @property
-    def request_limit(self):
-        return self._request_limit
 
-    @property
-    def request_count(self):
-        return self._request_count
+# The parts of each API's response that are used. These are only type annotations for `parse_response()`. The decoder still builds the whole
+# response, so they don't make decoding any faster.
+
+class _OwlBotDefinition(TypedDict):
+    type: str
+    definition: str
 
-    def can_request(self):
-        return self._request_count < self._request_limit
 
-    def request(self):
-        # Reset request count
-        if datetime.now() > self._request_period_start + self._request_period:
-            self._request_count = 0
-            self._request_period_start = datetime.now()
-            logger.info(f'{self} Reset request count.')
+class _OwlBotResponse(TypedDict):
+    definitions: List[_OwlBotDefinition]
 
-        # Increment request count
-        self._request_count += 1
+
+class _UnofficialGoogleDefinition(TypedDict):
+    definition: str
+
+
+class _UnofficialGoogleMeaning(TypedDict):
+    partOfSpeech: str
+    definitions: List[_UnofficialGoogleDefinition]
+
+
+class _UnofficialGoogleEntry(TypedDict):
+    meanings: List[_UnofficialGoogleMeaning]
+
+
+class _MerriamWebsterEntry(TypedDict):
+    fl: str
+    shortdef: List[str]
+
+
+class _WordsAPIResult(TypedDict):
+    definition: str
+    partOfSpeech: str
+
+
+class _WordsAPIResponse(TypedDict, total=False):
+    results: List[_WordsAPIResult]
 
 
 class OwlBotDictionaryAPI(DictionaryAPI):
 
-    def __init__(self, token: str):
+    def __init__(self, token: str, base_url: str = 'https://owlbot.info/api/v4'):
+        """
+        :param token: OwlBot API token.
+        :param base_url: Base URL of the API, without a trailing slash.
+        """
         self._token = token
+        self._base_url = base_url
 
-    async def define(self, word: str) -> List[Dict[str, str]]:
+    async def define(self, word: str) -> List[DefinitionEntry]:
         headers = {'Authorization': f'Token {self._token}'}
         async with aiohttp.ClientSession() as client:
-            async with client.get('https://owlbot.info/api/v4/dictionary/' + word.replace(' ', '%20'), headers=headers) as response:
+            async with client.get(f'{self._base_url}/dictionary/' + word.replace(' ', '%20'), headers=headers) as response:
 
                 if not await handle_default_status(self, word, response):
                     return []
 
                 logger.info(f'{self} {{status_code: {response.status}, word: "{word}"}}')
 
-                response_json = await response.json()
-
-                result = []
-                for d in response_json['definitions']:
-                    result.append({
-                        'word_type': d['type'],
-                        'definition': d['definition']
-                    })
+                result = await read_definitions(self, word, response)
 
         return result
 
+    def parse_response(self, body: bytes, max_definitions: Optional[int] = None) -> List[DefinitionEntry]:
+        """
+        Get the definitions from the body of a successful response.
+        :param body:
+        :param max_definitions: Maximum number of definitions to get. The rest are never converted.
+        :return:
+        :raises ValueError: If the body is not valid JSON. Other errors are raised if it doesn't have the expected format.
+        """
+        response: _OwlBotResponse = decode_json(body)
+        return [DefinitionEntry(d['type'], d['definition']) for d in response['definitions'][:max_definitions]]
+
     def id(self) -> str:
         return 'owlbot'
 
@@ -125,27 +201,30 @@ class UnofficialGoogleAPI(DictionaryAPI):
     https://github.com/meetDeveloper/freeDictionaryAPI
     """
 
-    async def define(self, word: str) -> List[Dict[str, str]]:
+    def __init__(self, base_url: str = 'https://api.dictionaryapi.dev/api/v2'):
+        """
+        :param base_url: Base URL of the API, without a trailing slash.
+        """
+        self._base_url = base_url
+
+    async def define(self, word: str) -> List[DefinitionEntry]:
         async with aiohttp.ClientSession() as client:
-            async with client.get('https://api.dictionaryapi.dev/api/v2/entries/en/' + word.replace(' ', '%20') + '?format=json') as response:
+            async with client.get(f'{self._base_url}/entries/en/' + word.replace(' ', '%20') + '?format=json') as response:
 
                 if not await handle_default_status(self, word, response):
                     return []
 
                 logger.info(f'{self} {{status_code: {response.status}, word: "{word}"}}')
 
-                result = []
-
-                response_json = await response.json()
-                for d in response_json[0]['meanings']:
-                    definition = {
-                        'word_type': d['partOfSpeech'],
-                        'definition': d['definitions'][0]['definition']
-                    }
-                    result.append(definition)
+                result = await read_definitions(self, word, response)
 
             return result
 
+    def parse_response(self, body: bytes, max_definitions: Optional[int] = None) -> List[DefinitionEntry]:
+        # Only the first definition of each meaning is used
+        response: List[_UnofficialGoogleEntry] = decode_json(body)
+        return [DefinitionEntry(m['partOfSpeech'], m['definitions'][0]['definition']) for m in response[0]['meanings'][:max_definitions]]
+
     def id(self) -> str:
         return 'unofficial_google'
 
@@ -156,11 +235,24 @@ class UnofficialGoogleAPI(DictionaryAPI):
 
 class MerriamWebsterAPI(DictionaryAPI, ABC):
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, base_url: str = 'https://dictionaryapi.com/api/v3/references', rate_limit_path: Optional[str] = None):
+        """
+        :param api_key: Merriam Webster API key.
+        :param base_url: Base URL of the API, without a trailing slash.
+        :param rate_limit_path: File to keep the number of requests in, so that the daily limit survives restarts and is shared by every
+        process that uses the same file. If this is None, the count is only kept in memory.
+        """
         self._api_key = api_key
-        self._request_limiter = RequestLimiter(1000, timedelta(days=1))
+        self._base_url = base_url
+        self._rate_limiter = RateLimiter(1000, timedelta(days=1), path=rate_limit_path, reserved=100)
 
-    def _get_short_definitions(self, response_json) -> []:
+    def remaining_requests(self) -> Optional[int]:
+        return self._rate_limiter.remaining()
+
+    def parse_response(self, body: bytes, max_definitions: Optional[int] = None) -> List[DefinitionEntry]:
+        return self._get_short_definitions(decode_json(body), max_definitions)
+
+    def _get_short_definitions(self, response_json: List[_MerriamWebsterEntry], max_definitions: Optional[int] = None) -> List[DefinitionEntry]:
 
         # Sometimes the response is an empty list
         if len(response_json) == 0:
@@ -183,36 +275,31 @@ class MerriamWebsterAPI(DictionaryAPI, ABC):
             logger.warning(f'{self} Bad response definition: {response_definition}')
             return []
 
-        for definition in response_definition['shortdef']:
-            results.append({
-                'word_type': word_type,
-                'definition': definition
-            })
+        for definition in response_definition['shortdef'][:max_definitions]:
+            results.append(DefinitionEntry(word_type, definition))
 
         return results
 
 
 class MerriamWebsterCollegiateAPI(MerriamWebsterAPI):
 
-    async def define(self, word: str) -> List[Dict[str, str]]:
+    async def define(self, word: str) -> List[DefinitionEntry]:
 
         # Limit requests
-        if self._request_limiter.can_request():
-            self._request_limiter.request()
-            logger.info(f'{self} Request {self._request_limiter.request_count} / {self._request_limiter.request_limit}')
-        else:
+        if not self._rate_limiter.try_acquire():
             logger.critical(f'{self} Request limit reached!')
-            return []
+            raise DictionaryAPIError('Request limit reached')
+        logger.info(f'{self} Remaining requests: {self._rate_limiter.remaining()} / {self._rate_limiter.limit}')
 
         word = word.lower()
 
         async with aiohttp.ClientSession() as client:
-            async with client.get('https://dictionaryapi.com/api/v3/references/collegiate/json/' + word.replace(' ', '%20') + '?key=' + self._api_key) as response:
+            async with client.get(f'{self._base_url}/collegiate/json/' + word.replace(' ', '%20') + '?key=' + self._api_key) as response:
 
                 if not await handle_default_status(self, word, response):
                     return []
 
-                result = self._get_short_definitions(await response.json())
+                result = await read_definitions(self, word, response)
 
             return result
 
@@ -226,25 +313,23 @@ class MerriamWebsterCollegiateAPI(MerriamWebsterAPI):
 
 class MerriamWebsterMedicalAPI(MerriamWebsterAPI):
 
-    async def define(self, word: str) -> List[Dict[str, str]]:
+    async def define(self, word: str) -> List[DefinitionEntry]:
 
         # Limit requests
-        if self._request_limiter.can_request():
-            self._request_limiter.request()
-            logger.info(f'{self} Request {self._request_limiter.request_count} / {self._request_limiter.request_limit}')
-        else:
+        if not self._rate_limiter.try_acquire():
             logger.critical(f'{self} Request limit reached!')
-            return []
+            raise DictionaryAPIError('Request limit reached')
+        logger.info(f'{self} Remaining requests: {self._rate_limiter.remaining()} / {self._rate_limiter.limit}')
 
         word = word.lower()
 
         async with aiohttp.ClientSession() as client:
-            async with client.get('https://dictionaryapi.com/api/v3/references/medical/json/' + word.replace(' ', '%20') + '?key=' + self._api_key) as response:
+            async with client.get(f'{self._base_url}/medical/json/' + word.replace(' ', '%20') + '?key=' + self._api_key) as response:
 
                 if not await handle_default_status(self, word, response):
                     return []
 
-                result = self._get_short_definitions(await response.json())
+                result = await read_definitions(self, word, response)
 
             return result
 
@@ -258,48 +343,50 @@ class MerriamWebsterMedicalAPI(MerriamWebsterAPI):
 
 class RapidWordsAPI(DictionaryAPI):
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, base_url: str = 'https://wordsapiv1.p.rapidapi.com', rate_limit_path: Optional[str] = None):
+        """
+        :param api_key: RapidAPI key.
+        :param base_url: Base URL of the API, without a trailing slash.
+        :param rate_limit_path: File to keep the number of requests in, so that the daily limit survives restarts and is shared by every
+        process that uses the same file. If this is None, the count is only kept in memory.
+        """
         self._api_key = api_key
-        self._request_limiter = RequestLimiter(2000, timedelta(days=1))
+        self._base_url = base_url
+        self._rate_limiter = RateLimiter(2000, timedelta(days=1), path=rate_limit_path, reserved=200)
 
-    async def define(self, word: str) -> List[Dict[str, str]]:
+    def remaining_requests(self) -> Optional[int]:
+        return self._rate_limiter.remaining()
 
-        if self._request_limiter.can_request():
-            self._request_limiter.request()
-            logger.info(f'{self} Request {self._request_limiter.request_count} / {self._request_limiter.request_limit}')
-        else:
+    async def define(self, word: str) -> List[DefinitionEntry]:
+
+        if not self._rate_limiter.try_acquire():
             logger.critical(f'{self} Request limit reached!')
-            return []
+            raise DictionaryAPIError('Request limit reached')
+        logger.info(f'{self} Remaining requests: {self._rate_limiter.remaining()} / {self._rate_limiter.limit}')
 
         headers = {
             'x-rapidapi-key': self._api_key,
             'x-rapidapi-host': 'wordsapiv1.p.rapidapi.com'
         }
         async with aiohttp.ClientSession() as client:
-            async with client.get('https://wordsapiv1.p.rapidapi.com/words/' + word.replace(' ', '%20'), headers=headers) as response:
+            async with client.get(f'{self._base_url}/words/' + word.replace(' ', '%20'), headers=headers) as response:
 
                 if not await handle_default_status(self, word, response):
                     return []
 
                 logger.info(f'{self} {{status_code: {response.status}, word: "{word}"}}')
 
-                results = []
+                results = await read_definitions(self, word, response)
 
-                response_json = await response.json()
-
-                if 'results' not in response_json:
+                if len(results) == 0:
                     logger.warning(f'{self} No results for word: "{word}"')
-                    return []
-
-                results_json = response_json['results']
-                for definition_json in results_json:
-                    results.append({
-                        'word_type': definition_json['partOfSpeech'],
-                        'definition': definition_json['definition'] + '.'
-                    })
 
             return results
 
+    def parse_response(self, body: bytes, max_definitions: Optional[int] = None) -> List[DefinitionEntry]:
+        response: _WordsAPIResponse = decode_json(body)
+        return [DefinitionEntry(r['partOfSpeech'], r['definition'] + '.') for r in response.get('results', [])[:max_definitions]]
+
     def id(self) -> str:
         return 'rapid_words'
 
@@ -308,12 +395,61 @@ class RapidWordsAPI(DictionaryAPI):
         return 'Rapid Words'
 
 
+class LocalDictionaryAPI(DictionaryAPI):
+    """
+    Serves definitions from a `WordStore` file on this host, so common words don't need any network requests. A word store can be created from
+    a WordNet or Wiktionary dump with `python -m discord_dictionary_bot.import_dictionary`.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path to the word store file.
+        """
+        self._word_store = WordStore(path)
+        logger.info(f'{self} Loaded word store {{path: "{path}", words: {len(self._word_store)}}}')
+
+    async def define(self, word: str) -> List[DefinitionEntry]:
+        definitions = self._word_store.get(word)
+        return definitions if definitions is not None else []
+
+    def words(self) -> Iterator[str]:
+        return self._word_store.words()
+
+    def words_with_prefix(self, prefix: str, limit: int = 25) -> List[str]:
+        return self._word_store.words_with_prefix(prefix, limit)
+
+    def is_cacheable(self) -> bool:
+        return False
+
+    def id(self) -> str:
+        return 'local'
+
+    @property
+    def name(self) -> str:
+        return 'Local Dictionary'
+
+
+# Cached in place of a `DefinitionResult` when an API has no definitions for a word, along with the time at which it expires. It can't be
+# mistaken for an encoded result, since those start with their version.
+_NO_DEFINITIONS = struct.Struct('<4sd')
+_NO_DEFINITIONS_MAGIC = b'NONE'
+
+
+def _is_no_definitions(cached: bytes) -> bool:
+    return len(cached) == _NO_DEFINITIONS.size and cached.startswith(_NO_DEFINITIONS_MAGIC)
+
+
+def _cache_key(api: DictionaryAPI, word: str) -> str:
+    # The dictionary API's don't care about case, so "Cat" and "cat" share the same definitions
+    return f'{api.id()}:{word.strip().lower()}'
+
+
 class SequentialDictionaryAPI(DictionaryAPI):
     """
     This class is a wrapper for other 'DictionaryAPI's. The API's will be called sequentially until one succeeds.
     """
 
-    def __init__(self, apis: List[DictionaryAPI], timeout: int = 2):
+    def __init__(self, apis: List[DictionaryAPI], timeout: int = 2, cache: Optional[Cache] = None, negative_ttl: int = 60 * 15):
         """
 
         :param apis: A list of dictionary API's that will be called sequentially
@@ -321,27 +457,76 @@ class SequentialDictionaryAPI(DictionaryAPI):
         :param timeout: The maximum number of seconds to wait for a response
         from a DictionaryAPI. If a request times out, then the next available
         API will be called.
+        :param cache: Cache for the results of each API. Words that an API has
+        no definitions for are cached too, so that API is skipped next time.
+        Errors are never cached.
+        :param negative_ttl: Number of seconds to skip an API for a word that
+        it has no definitions for.
         """
         self._apis = apis
         self._timeout = timeout
+        self._cache = cache
+        self._negative_ttl = negative_ttl
+
+    async def define(self, word: str) -> List[DefinitionEntry]:
+        return list((await self.define_with_source(word)).entries)
 
-    async def define(self, word: str) -> List[Dict[str, str]]:
-        return (await self.define_with_source(word))[0]
-
-    async def define_with_source(self, word: str) -> ([{str: str}], Optional[DictionaryAPI]):
-        for api in self._apis:
-            try:
-                definitions = await asyncio.wait_for(api.define(word), self._timeout)
-                if len(definitions) > 0:
-                    analytics.log_dictionary_api_request(api.id(), True)
-                    return definitions, api
-                logger.warning(f'{api} did not return any definitions!')
-            except aiohttp.ClientError as e:
-                logger.warning(f'Client error for API "{api}"', exc_info=e)
-            except asyncio.TimeoutError:
-                logger.warning(f'{api} Took too long to respond!')
-            analytics.log_dictionary_api_request(api.id(), False)
-        return [], None
+    async def define_with_source(self, word: str) -> DefinitionResult:
+        """
+        :param word:
+        :return: The definitions from the first API that has any. If no API has any, the result has no entries and no source.
+        """
+        with tracer.span('dictionary.define_with_source', word=word):
+            for api in self._apis:
+                cache = self._cache if api.is_cacheable() else None
+                cache_key = _cache_key(api, word)
+                if cache is not None:
+                    cached = cache.get('definitions', cache_key)
+                    if cached is not None and _is_no_definitions(cached):
+                        if _NO_DEFINITIONS.unpack(cached)[1] > time.time():
+                            continue
+                    elif cached is not None:
+                        try:
+                            result = DefinitionResult.from_bytes(cached)
+                            if len(result.entries) > 0:
+                                return result._replace(word=word)
+                        except ValueError:
+                            # Written by an older version of the bot, so fetch it again
+                            pass
+
+                # Skip APIs that have reached their request limit without waiting for them
+                if api.remaining_requests() == 0:
+                    logger.warning(f'{api} Request limit reached! Skipping.')
+                    continue
+
+                with tracer.span('dictionary_api.define', api=api.id()) as span:
+                    start_time = time.perf_counter()
+                    try:
+                        definitions = DefinitionResult(word, api.id(), tuple(await asyncio.wait_for(api.define(word), self._timeout)))
+                        if len(definitions.entries) > 0:
+                            if cache is not None:
+                                cache.set('definitions', cache_key, definitions.to_bytes())
+                            metrics.dictionary_api_request_duration.labels(api.id(), 'success').observe(time.perf_counter() - start_time)
+                            analytics.log_dictionary_api_request(api.id(), True)
+                            span.set_attribute('result', 'success')
+                            return definitions
+                        if cache is not None:
+                            cache.set('definitions', cache_key, _NO_DEFINITIONS.pack(_NO_DEFINITIONS_MAGIC, time.time() + self._negative_ttl))
+                        logger.warning(f'{api} did not return any definitions!')
+                        result = 'empty'
+                    except DictionaryAPIError as e:
+                        logger.warning(f'{api} {e}')
+                        result = 'error'
+                    except aiohttp.ClientError as e:
+                        logger.warning(f'Client error for API "{api}"', exc_info=e)
+                        result = 'error'
+                    except asyncio.TimeoutError:
+                        logger.warning(f'{api} Took too long to respond!')
+                        result = 'timeout'
+                    metrics.dictionary_api_request_duration.labels(api.id(), result).observe(time.perf_counter() - start_time)
+                    analytics.log_dictionary_api_request(api.id(), False)
+                    span.set_attribute('result', result)
+            return DefinitionResult(word, None, ())
 
     def id(self) -> str:
         return 'sequential'
@@ -1,21 +1,28 @@
 import datetime
 import logging
 import sys
+import time
 from pathlib import Path
 from typing import Union, Any, Optional, Sequence
 
 import discord.ext.commands
-from discord import Message, Guild, Interaction
+from discord import Message, Guild, Interaction, app_commands
 from discord.abc import Snowflake
 from discord.app_commands import ContextMenu, Command
 from discord.ext.commands import Cog
-from discord.ext.commands.bot import Bot
+from discord.ext.commands.bot import Bot, AutoShardedBot
 from google.cloud import firestore
 
+from . import metrics
 from .analytics import log_command, log_context_menu_usage
+from .autocomplete import WordCompleter
+from .cache import Cache
+from .spelling import SpellingIndex
 from .cogs import Settings, Dictionary, Statistics
 from .dictionary_api import DictionaryAPI
+from .loop_monitor import LoopMonitor
 from .property_manager import FirestorePropertyManager, Property, BooleanProperty, ListProperty
+from .sharding import SettingsBroadcaster
 from .utils import get_bot_permissions
 
 # Set up logging
@@ -42,18 +49,51 @@ def interaction_data_to_string(data):
     return name
 
 
+class CommandTree(app_commands.CommandTree):
+
+    async def interaction_check(self, interaction: Interaction, /) -> bool:
+        # Everything that runs while this interaction is processed, including the completion event, can see which command it belongs to
+        if interaction.type == discord.InteractionType.application_command:
+            metrics.current_command.set(metrics.CommandMetrics(interaction.data.get('name', 'unknown')))
+        return True
+
+
 class DiscordBotClient(Bot):
 
-    def __init__(self, dictionary_apis: [DictionaryAPI], ffmpeg_path: Union[str, Path], **kwargs):
+    def __init__(self, dictionary_apis: [DictionaryAPI], ffmpeg_path: Union[str, Path], loop_stall_threshold: Optional[float] = 0.25,
+                 cache: Optional[Cache] = None, sync_commands: bool = True, settings_broadcaster: Optional[SettingsBroadcaster] = None,
+                 spelling_index: Optional[SpellingIndex] = None, word_completer: Optional[WordCompleter] = None, **kwargs):
         """
         Creates a new Discord bot client.
         :param dictionary_apis: A list of dictionary APIs that are available for the bot to use.
         :param ffmpeg_path: Path to ffmpeg executable.
+        :param loop_stall_threshold: Report anything that blocks the event loop for longer than this many seconds. Set to None to disable.
+        :param cache: Cache for definitions, translations and text-to-speech audio. If this is None, nothing is cached.
+        :param sync_commands: Sync slash commands with Discord on startup. When the bot runs in several processes, only one of them needs to.
+        :param settings_broadcaster: Keeps cached settings coherent with the other processes, if the bot runs in several processes.
+        :param spelling_index: Used to suggest corrections for misspelled words without calling the dictionary API's. If this is None, words
+        are not checked.
+        :param word_completer: Suggests words for the `word` argument of the `define` command. If this is None, no words are suggested.
         :param kwargs:
         """
-        super().__init__('', help_command=None, intents=discord.Intents.default(), **kwargs)
+        super().__init__('', help_command=None, intents=discord.Intents.default(), tree_cls=CommandTree, **kwargs)
         self._dictionary_apis = dictionary_apis
         self._ffmpeg_path = ffmpeg_path
+        self._cache = cache
+        self._sync_commands = sync_commands
+        self._settings_broadcaster = settings_broadcaster
+        self._spelling_index = spelling_index
+        self._word_completer = word_completer
+        self._loop_monitor = LoopMonitor(threshold=loop_stall_threshold) if loop_stall_threshold is not None else None
+
+        metrics.gateway_latency.set_function(lambda: self.latency)
+        for api in dictionary_apis:
+            if api.remaining_requests() is not None:
+                metrics.dictionary_api_remaining_requests.labels(api.id()).set_function(api.remaining_requests)
+        if self._loop_monitor is not None:
+            metrics.event_loop_lag.set_function(lambda: self._loop_monitor.stats()['last_lag'])
+            metrics.event_loop_max_lag.set_function(lambda: self._loop_monitor.stats()['max_lag'])
+            metrics.event_loop_stalls.set_function(lambda: self._loop_monitor.stats()['stalls'])
         self._scoped_property_manager = FirestorePropertyManager([
             Property(
                 'text_to_speech',
@@ -78,11 +118,11 @@ class DiscordBotClient(Bot):
             ),
             ListProperty(
                 'dictionary_apis',
-                default=['unofficial_google', 'owlbot', 'merriam_webster_collegiate', 'merriam_webster_medical', 'rapid_words'],
-                choices=['owlbot', 'unofficial_google', 'merriam_webster_medical', 'merriam_webster_collegiate', 'rapid_words'],
+                default=['local', 'unofficial_google', 'owlbot', 'merriam_webster_collegiate', 'merriam_webster_medical', 'rapid_words'],
+                choices=['local', 'owlbot', 'unofficial_google', 'merriam_webster_medical', 'merriam_webster_collegiate', 'rapid_words'],
                 description='A comma-separated list of dictionary APIs to use in order of preference.\n'
                             'Choices:\n'
-                            '`unofficial_google`, `owlbot`, `merriam_webster_collegiate`, `merriam_webster_medical`, `rapid_words`'
+                            '`local`, `unofficial_google`, `owlbot`, `merriam_webster_collegiate`, `merriam_webster_medical`, `rapid_words`'
             ),
             BooleanProperty(
                 'auto_translate',
@@ -93,7 +133,16 @@ class DiscordBotClient(Bot):
             )
         ])
 
+    @property
+    def loop_monitor(self) -> Optional[LoopMonitor]:
+        return self._loop_monitor
+
     async def setup_hook(self) -> None:
+        if self._loop_monitor is not None:
+            self._loop_monitor.start()
+        if self._settings_broadcaster is not None:
+            self._settings_broadcaster.start(self._scoped_property_manager, self.loop)
+
         guild_ids = []
 
         async def add_cog_wrapper(cog: Cog, guilds: Optional[Sequence[Snowflake]] = None):
@@ -103,11 +152,13 @@ class DiscordBotClient(Bot):
             await self.add_cog(cog, guilds=guilds)
 
         # Add cogs
-        await add_cog_wrapper(Dictionary(self, self._dictionary_apis, self._ffmpeg_path))
+        await add_cog_wrapper(Dictionary(self, self._dictionary_apis, self._ffmpeg_path, cache=self._cache, spelling_index=self._spelling_index, word_completer=self._word_completer))
         await add_cog_wrapper(Settings(self._scoped_property_manager))
         await add_cog_wrapper(Statistics(self), guilds=[discord.Object(id='799455809297842177'), discord.Object(id='454852632528420876')])
 
         # Sync slash commands
+        if not self._sync_commands:
+            return
         await self.tree.sync()
         for guild in guild_ids:
             try:
@@ -116,7 +167,19 @@ class DiscordBotClient(Bot):
                 # If the bot isn't in the guild, we will get a Forbidden error
                 logger.warning(f'Failed to sync commands for guild {guild.id}')
 
+    async def close(self) -> None:
+        if self._loop_monitor is not None:
+            self._loop_monitor.stop()
+        if self._settings_broadcaster is not None:
+            self._settings_broadcaster.stop()
+        await super().close()
+
     async def on_app_command_completion(self, interaction: Interaction, command: Union[Command, ContextMenu]):
+        command_metrics = metrics.current_command.get()
+        if command_metrics is not None:
+            metrics.command_duration.labels(command_metrics.command).observe(time.perf_counter() - command_metrics.start_time)
+            metrics.firestore_reads_per_command.labels(command_metrics.command).observe(command_metrics.firestore_reads)
+
         if isinstance(command, Command):
             logger.info(f'[G: "{interaction.guild}", C: "{interaction.channel}"] "/{interaction_data_to_string(interaction.data)}"')
             log_command(command.name, interaction)
@@ -133,6 +196,7 @@ class DiscordBotClient(Bot):
         firestore_client = firestore.Client()
         for guild in self.guilds:
             document = firestore_client.collection('guilds').document(str(guild.id))
+            metrics.record_firestore_read()
             snapshot = document.get()
             if not snapshot.exists:
                 await self.on_guild_join(guild)
@@ -142,6 +206,7 @@ class DiscordBotClient(Bot):
 
         firestore_client = firestore.Client()
         guild_document = firestore_client.collection('guilds').document(str(guild.id))
+        metrics.record_firestore_read()
         snapshot = guild_document.get()
 
         if not snapshot.exists:
@@ -157,3 +222,10 @@ class DiscordBotClient(Bot):
                 logger.error(f'Missing permissions. We have {get_bot_permissions(message.channel)}')
                 return
         await super().on_error(event_method, *args, **kwargs)
+
+
+class ShardedDiscordBotClient(DiscordBotClient, AutoShardedBot):
+    """
+    A bot client that runs several shards in one process. Pass `shard_ids` and `shard_count` to run a subset of the shards, so the bot can be
+    split across several processes. If they are not specified, Discord's recommended number of shards is used.
+    """
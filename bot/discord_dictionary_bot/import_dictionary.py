@@ -0,0 +1,120 @@
+import argparse
+import collections
+import json
+import logging
+import os
+from typing import Dict, List, Union
+
+from .definitions import DefinitionEntry
+from .word_store import write_word_store
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Longest word that the /define command accepts
+MAX_WORD_LENGTH = 100
+
+WORDNET_WORD_TYPES = {
+    'noun': 'noun',
+    'verb': 'verb',
+    'adj': 'adjective',
+    'adv': 'adverb'
+}
+
+
+def read_wordnet(directory: Union[str, os.PathLike]) -> Dict[str, List[DefinitionEntry]]:
+    """
+    Read the definitions in a WordNet database directory, which contains the `index.<pos>` and `data.<pos>` files. The senses of each word
+    are kept in the order of the index files, which lists the most common senses first.
+    :param directory:
+    :return: The definitions of each word in the same format as `DictionaryAPI.define()`.
+    """
+    definitions = collections.defaultdict(list)
+    for pos, word_type in WORDNET_WORD_TYPES.items():
+
+        # Read the gloss of each synset. Lines that start with spaces are the license.
+        glosses = {}
+        with open(os.path.join(directory, f'data.{pos}'), encoding='utf-8') as file:
+            for line in file:
+                if line.startswith(' ') or ' | ' not in line:
+                    continue
+                offset = line.split(' ', 1)[0]
+
+                # The gloss is the definition followed by examples in quotes
+                gloss = line.split(' | ', 1)[1].strip()
+                glosses[offset] = gloss.split('; "', 1)[0].strip()
+
+        # Each index line ends with the offsets of the synsets the word belongs to
+        with open(os.path.join(directory, f'index.{pos}'), encoding='utf-8') as file:
+            for line in file:
+                if line.startswith(' '):
+                    continue
+                fields = line.split()
+                word = fields[0].replace('_', ' ')
+                synset_count = int(fields[2])
+                for offset in fields[len(fields) - synset_count:]:
+                    if offset in glosses:
+                        definitions[word].append(DefinitionEntry(word_type, glosses[offset]))
+
+    return definitions
+
+
+def read_wiktionary(path: Union[str, os.PathLike], language_code: str = 'en') -> Dict[str, List[DefinitionEntry]]:
+    """
+    Read the definitions in a Wiktionary dump extracted by wiktextract, such as the JSON lines files from https://kaikki.org.
+    :param path:
+    :param language_code: Only read words of this language.
+    :return: The definitions of each word in the same format as `DictionaryAPI.define()`.
+    """
+    definitions = collections.defaultdict(list)
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            entry = json.loads(line)
+            if entry.get('lang_code', language_code) != language_code or 'word' not in entry:
+                continue
+            for sense in entry.get('senses', []):
+
+                # Glosses go from the most general to the most specific
+                glosses = sense.get('glosses')
+                if not glosses:
+                    continue
+                definitions[entry['word']].append(DefinitionEntry(entry.get('pos', ''), glosses[-1]))
+
+    return definitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create a word store for the \'local\' dictionary API from a WordNet database or a Wiktionary dump.')
+    parser.add_argument('input',
+                        help='Path to a WordNet database directory, or a Wiktionary JSON lines file extracted by wiktextract.')
+    parser.add_argument('--output',
+                        help='Path to write the word store to.',
+                        dest='output',
+                        default='dictionary.bin')
+    parser.add_argument('--language',
+                        help='Language code of the words to read from a Wiktionary dump.',
+                        dest='language',
+                        default='en')
+    parser.add_argument('--max-definitions',
+                        help='Maximum number of definitions to keep for each word.',
+                        dest='max_definitions',
+                        type=int,
+                        default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s [%(name)s] [%(levelname)s] %(message)s', level=logging.INFO, datefmt='%m/%d/%Y %H:%M:%S')
+
+    if os.path.isdir(args.input):
+        definitions = read_wordnet(args.input)
+    else:
+        definitions = read_wiktionary(args.input, args.language)
+
+    # Remove words that can't be looked up anyway
+    definitions = {word: word_definitions[:args.max_definitions] for word, word_definitions in definitions.items() if len(word) <= MAX_WORD_LENGTH}
+    logger.info(f'Read definitions {{path: "{args.input}", words: {len(definitions)}}}')
+
+    write_word_store(args.output, definitions)
+
+
+if __name__ == '__main__':
+    main()
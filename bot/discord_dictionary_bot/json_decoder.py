@@ -0,0 +1,53 @@
+import json
+from typing import Any, Callable, Dict, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSONDecoder = Callable[[bytes], Any]
+
+
+def _stdlib_decode(data: bytes) -> Any:
+    # Decoding the string first is faster than letting json.loads() detect the encoding of the bytes
+    return json.loads(data.decode('utf-8'))
+
+
+# Available decoders by name. Each one takes the raw body of a response.
+DECODERS: Dict[str, JSONDecoder] = {
+    'json': _stdlib_decode
+}
+if orjson is not None:
+    DECODERS['orjson'] = orjson.loads
+
+# Use the fastest available decoder by default
+_decoder: JSONDecoder = DECODERS['orjson' if orjson is not None else 'json']
+
+
+def set_json_decoder(decoder: Union[str, JSONDecoder]):
+    """
+    Change the decoder used by `decode_json()`.
+    :param decoder: The name of one of the `DECODERS`, or a function that decodes bytes. It must raise a `ValueError` if the data is not
+    valid JSON.
+    :return:
+    """
+    global _decoder
+    if isinstance(decoder, str):
+        if decoder not in DECODERS:
+            raise ValueError(f'Unknown JSON decoder: "{decoder}". Available decoders are: {", ".join(DECODERS)}')
+        decoder = DECODERS[decoder]
+    _decoder = decoder
+
+
+def get_json_decoder() -> JSONDecoder:
+    return _decoder
+
+
+def decode_json(data: bytes) -> Any:
+    """
+    :param data:
+    :return:
+    :raises ValueError: If the data is not valid JSON.
+    """
+    return _decoder(data)
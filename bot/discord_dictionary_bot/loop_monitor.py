@@ -0,0 +1,163 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional, Dict, Any, List, NamedTuple, Deque
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class Stall(NamedTuple):
+    # Time when the stall ended
+    time: float
+
+    # Number of seconds that the event loop was blocked for
+    duration: float
+
+    # Name of the task that was running when the stall was detected, if any
+    task_name: Optional[str]
+
+    # Stack of the event loop thread while it was blocked. None if the stall ended before the watchdog noticed it.
+    stack: Optional[str]
+
+
+class LoopMonitor:
+    """
+    Measures the lag of an event loop and reports callbacks that block it.
+
+    A heartbeat callback is scheduled on the event loop every `interval` seconds, and the lag is how late it runs. A watchdog thread checks that
+    the heartbeat keeps running, and when it is more than `threshold` seconds late, the watchdog captures the stack of the event loop thread.
+    Since the event loop is still blocked at that point, the stack shows exactly which code is blocking it. The stall is logged once the event
+    loop is running again.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, max_stalls: int = 100, summary_interval: float = 60 * 10):
+        """
+        :param interval: Number of seconds between heartbeats.
+        :param threshold: Any callback that blocks the event loop for longer than this many seconds is reported.
+        :param max_stalls: Maximum number of recent stalls to remember.
+        :param summary_interval: Number of seconds between logging the lag statistics.
+        """
+        self._interval = interval
+        self._threshold = threshold
+        self._summary_interval = summary_interval
+        self._last_summary_time = 0.0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat_handle: Optional[asyncio.TimerHandle] = None
+        self._watchdog_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+        # Protects the stall that the watchdog is capturing
+        self._lock = threading.Lock()
+
+        # Time when the next heartbeat is expected to run
+        self._expected_time = 0.0
+
+        # Stack and task name captured by the watchdog for the current stall
+        self._pending_stack: Optional[str] = None
+        self._pending_task_name: Optional[str] = None
+
+        # Statistics
+        self._heartbeats = 0
+        self._total_lag = 0.0
+        self._max_lag = 0.0
+        self._last_lag = 0.0
+        self._stall_count = 0
+        self._blocked_time = 0.0
+        self._stalls: Deque[Stall] = collections.deque(maxlen=max_stalls)
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+    @property
+    def stalls(self) -> List[Stall]:
+        return list(self._stalls)
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """
+        Start monitoring an event loop. This must be called from the thread that runs the event loop.
+        :param loop: The event loop to monitor. Defaults to the running event loop.
+        :return:
+        """
+        if self._loop is not None:
+            return
+        self._loop = loop if loop is not None else asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop_event.clear()
+        self._expected_time = time.monotonic() + self._interval
+        self._last_summary_time = time.monotonic()
+        self._heartbeat_handle = self._loop.call_later(self._interval, self._heartbeat)
+        self._watchdog_thread = threading.Thread(target=self._watchdog, name='loop-monitor', daemon=True)
+        self._watchdog_thread.start()
+        logger.info(f'Started event loop monitor {{interval: {self._interval}, threshold: {self._threshold}}}')
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self._stop_event.set()
+        self._heartbeat_handle.cancel()
+        self._watchdog_thread.join()
+        self._loop = None
+
+    def _heartbeat(self):
+        now = time.monotonic()
+        lag = max(0.0, now - self._expected_time)
+        self._heartbeats += 1
+        self._total_lag += lag
+        self._max_lag = max(self._max_lag, lag)
+        self._last_lag = lag
+
+        with self._lock:
+            stack, task_name = self._pending_stack, self._pending_task_name
+            self._pending_stack = None
+            self._pending_task_name = None
+            self._expected_time = now + self._interval
+
+        if lag > self._threshold:
+            self._stall_count += 1
+            self._blocked_time += lag
+            self._stalls.append(Stall(time.time(), lag, task_name, stack))
+            if stack is not None:
+                logger.warning(f'Event loop was blocked for {lag * 1000:.0f} ms {{task: "{task_name}"}}. Stack while blocked:\n{stack}')
+            else:
+                logger.warning(f'Event loop was blocked for {lag * 1000:.0f} ms')
+
+        if now - self._last_summary_time >= self._summary_interval:
+            self._last_summary_time = now
+            logger.info(f'Event loop stats: {self.stats()}')
+
+        self._heartbeat_handle = self._loop.call_later(self._interval, self._heartbeat)
+
+    def _watchdog(self):
+        while not self._stop_event.wait(self._threshold / 2):
+            with self._lock:
+                if self._pending_stack is not None or time.monotonic() - self._expected_time <= self._threshold:
+                    continue
+
+                # The event loop is blocked right now, so its stack shows what is blocking it
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+                self._pending_stack = ''.join(traceback.format_stack(frame))
+                task = asyncio.current_task(self._loop)
+                self._pending_task_name = task.get_name() if task is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the lag and stall statistics since the monitor was started.
+        :return:
+        """
+        return {
+            'last_lag': self._last_lag,
+            'average_lag': self._total_lag / self._heartbeats if self._heartbeats > 0 else None,
+            'max_lag': self._max_lag,
+            'stalls': self._stall_count,
+            'blocked_time': self._blocked_time
+        }
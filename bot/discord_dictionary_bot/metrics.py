@@ -0,0 +1,296 @@
+import bisect
+import contextvars
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Tuple, Callable, Iterable, Sequence
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets in seconds. These cover everything from cache lookups to slow text-to-speech requests.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if math.isnan(value):
+        return 'NaN'
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metric:
+    """
+    Base class for metrics. A metric with label names has one child per combination of label values, which is returned by `labels()`. A metric
+    without label names is its own only child.
+
+    Metrics are updated without locking. Almost all of them are only updated from the event loop thread, and an occasional lost update from
+    another thread is an acceptable price for keeping the hot path cheap.
+    """
+
+    type_name = ''
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self._name = name
+        self._description = description
+        self._label_names = tuple(label_names)
+        self._children: Dict[Tuple[str, ...], 'Metric'] = {}
+        self._children_lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self._label_names):
+                raise ValueError(f'Expected {len(self._label_names)} label values for "{self._name}" but got {len(values)}')
+            with self._children_lock:
+                child = self._children.setdefault(values, self._create_child())
+        return child
+
+    def _create_child(self) -> 'Metric':
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[Tuple[str, str, float]]:
+        """
+        :return: The samples of a single child as (suffix, extra labels, value) tuples.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self._name} {self._description}', f'# TYPE {self._name} {self.type_name}']
+        children = [((), self)] if not self._label_names else list(self._children.items())
+        for values, child in children:
+            for suffix, extra, value in child._samples():
+                lines.append(f'{self._name}{suffix}{_format_labels(self._label_names, values, extra)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self._value = 0
+        self._function: Optional[Callable[[], float]] = None
+
+    def _create_child(self) -> 'Counter':
+        return Counter(self._name, self._description)
+
+    def inc(self, amount: float = 1):
+        self._value += amount
+
+    def set_function(self, function: Callable[[], float]):
+        """
+        Read the value from `function` every time the metrics are collected, for things that are already counted elsewhere.
+        """
+        self._function = function
+
+    def _samples(self):
+        yield '_total', '', self._function() if self._function is not None else self._value
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def _create_child(self) -> 'Gauge':
+        return Gauge(self._name, self._description)
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1):
+        self._value += amount
+
+    def dec(self, amount: float = 1):
+        self._value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """
+        Read the value from `function` every time the metrics are collected.
+        """
+        self._function = function
+
+    def _samples(self):
+        yield '', '', self._function() if self._function is not None else self._value
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, label_names)
+        self._buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+
+    def _create_child(self) -> 'Histogram':
+        return Histogram(self._name, self._description, buckets=self._buckets)
+
+    def observe(self, value: float):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sum += value
+
+    def time(self) -> 'Timer':
+        """
+        :return: A context manager that observes how many seconds its body takes.
+        """
+        return Timer(self)
+
+    def _samples(self):
+        cumulative = 0
+        for bound, count in zip(self._buckets + (math.inf,), self._counts):
+            cumulative += count
+            yield '_bucket', f'le="{_format_value(bound)}"', cumulative
+        yield '_sum', '', self._sum
+        yield '_count', '', cumulative
+
+
+class Timer:
+
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+        self._start_time = 0.0
+
+    def __enter__(self):
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._histogram.observe(time.perf_counter() - self._start_time)
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f'A metric named "{metric.name}" is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, description, label_names))
+
+    def gauge(self, name: str, description: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, description, label_names))
+
+    def histogram(self, name: str, description: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, label_names, buckets))
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+        :return:
+        """
+        result = []
+        for metric in list(self._metrics.values()):
+            try:
+                result.append(metric.render())
+            except Exception as e:
+                logger.exception(f'Failed to collect metric "{metric.name}"', exc_info=e)
+        return ''.join(result)
+
+
+registry = Registry()
+
+dictionary_api_request_duration = registry.histogram('dictionary_api_request_duration_seconds', 'Time taken by each dictionary API request.', ['api', 'result'])
+dictionary_api_remaining_requests = registry.gauge('dictionary_api_remaining_requests', 'Number of requests each rate limited dictionary API can make right now.', ['api'])
+translate_duration = registry.histogram('translate_duration_seconds', 'Time taken by each translation.')
+text_to_speech_duration = registry.histogram('text_to_speech_duration_seconds', 'Time taken to synthesize speech.')
+ffmpeg_duration = registry.histogram('ffmpeg_duration_seconds', 'Time taken to convert audio with ffmpeg.')
+voice_connect_duration = registry.histogram('voice_connect_duration_seconds', 'Time taken to connect to a voice channel.')
+command_duration = registry.histogram('command_duration_seconds', 'Time taken to complete each command.', ['command'])
+firestore_reads = registry.counter('firestore_reads', 'Number of Firestore document reads.', ['command'])
+firestore_reads_per_command = registry.histogram('firestore_reads_per_command', 'Number of Firestore document reads made by each command.', ['command'],
+                                                 buckets=(0, 1, 2, 3, 5, 10))
+spelling_suggestions = registry.counter('spelling_suggestions', 'Number of definition requests without definitions that were answered with spelling suggestions.')
+cache_requests = registry.counter('cache_requests', 'Number of cache lookups.', ['cache', 'result'])
+analytics_queue_depth = registry.gauge('analytics_queue_depth', 'Number of analytics rows waiting to be uploaded.', ['table'])
+gateway_latency = registry.gauge('gateway_latency_seconds', 'Latency between a Discord gateway heartbeat and its acknowledgement.')
+event_loop_lag = registry.gauge('event_loop_lag_seconds', 'How late the last event loop heartbeat ran.')
+event_loop_max_lag = registry.gauge('event_loop_max_lag_seconds', 'Largest event loop lag since the bot started.')
+event_loop_stalls = registry.counter('event_loop_stalls', 'Number of times the event loop was blocked for longer than the stall threshold.')
+
+
+class CommandMetrics:
+    """
+    Metrics collected while a single command is being processed.
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+        self.start_time = time.perf_counter()
+        self.firestore_reads = 0
+
+
+# The command that is being processed in the current context, if any
+current_command: contextvars.ContextVar[Optional[CommandMetrics]] = contextvars.ContextVar('current_command', default=None)
+
+
+def record_firestore_read():
+    command = current_command.get()
+    if command is not None:
+        command.firestore_reads += 1
+        firestore_reads.labels(command.command).inc()
+    else:
+        firestore_reads.labels('none').inc()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't log every scrape
+        pass
+
+
+def start_http_server(port: int, host: str = '127.0.0.1', metrics_registry: Registry = registry) -> ThreadingHTTPServer:
+    """
+    Serve the metrics at "/metrics" on a background thread, so that scrapes never run on the event loop.
+    :param port:
+    :param host:
+    :param metrics_registry:
+    :return: The server, which can be stopped with `shutdown()`.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    server.registry = metrics_registry
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f'Serving metrics at http://{host}:{server.server_port}/metrics')
+    return server
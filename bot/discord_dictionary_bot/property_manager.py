@@ -1,10 +1,13 @@
-from typing import Union, Any, Iterable, Optional
+from typing import Union, Any, Iterable, Optional, Callable, List
 import logging
 from abc import ABC, abstractmethod
 
 import discord
 from google.cloud import firestore
 
+from . import metrics
+from .tracing import tracer
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
@@ -146,12 +149,47 @@ class FirestorePropertyManager(ScopedPropertyManager):
         # This dictionary keeps track of which scopes are dirty and need to be fetched from Firestore next time
         self._dirty = {}
 
+        # Functions that are called with the ID of a scope whenever one of its properties is changed
+        self._change_listeners: List[Callable[[int], None]] = []
+
+    def add_change_listener(self, listener: Callable[[int], None]):
+        """
+        Call `listener` with the ID of a scope whenever one of its properties is changed. This is used to tell other processes to invalidate
+        their cached copies.
+        :param listener:
+        :return:
+        """
+        self._change_listeners.append(listener)
+
+    def invalidate(self, scope_id: int):
+        """
+        Mark the cached properties of a scope as dirty, so they are fetched from Firestore next time they are used.
+        :param scope_id: The ID of the guild or channel that changed.
+        :return:
+        """
+        for scope in self._dirty:
+            if scope.id == scope_id:
+                self._dirty[scope] = True
+
+    def _notify_change(self, scope: Union[discord.Guild, 'discord.abc.MessageableChannel']):
+        for listener in self._change_listeners:
+            try:
+                listener(scope.id)
+            except Exception as e:
+                logger.exception('Failed to notify listener of property change', exc_info=e)
+
     def get(self, key: str, scope: Union[discord.Guild, 'discord.abc.MessageableChannel'], recursive: bool = True) -> Optional[Any]:
+        with tracer.span('settings.get', key=key):
+            return self._get(key, scope, recursive)
+
+    def _get(self, key: str, scope: Union[discord.Guild, 'discord.abc.MessageableChannel'], recursive: bool) -> Optional[Any]:
 
         # Check the cache
         if scope in self._cache and not self._dirty[scope]:
+            metrics.cache_requests.labels('settings', 'hit').inc()
             data = self._cache[scope]
         else:
+            metrics.cache_requests.labels('settings', 'miss').inc()
             # The data was either not in the cache, or was in the cache but it's dirty so we need to fetch it again
             snapshot = self._get_snapshot(scope)
             data = snapshot.to_dict() if snapshot.exists else {}
@@ -181,7 +219,7 @@ class FirestorePropertyManager(ScopedPropertyManager):
 
                 if guild:
                     # The channel did not have the requested property, maybe the guild has it
-                    return self.get(key, guild)
+                    return self._get(key, guild, True)
 
                 raise TypeError(f'Unsupported scope: {type(scope)} "{scope}"')
 
@@ -209,6 +247,7 @@ class FirestorePropertyManager(ScopedPropertyManager):
 
         self._get_snapshot(scope).reference.set({key: value}, merge=True)
         self._dirty[scope] = True
+        self._notify_change(scope)
 
     def remove(self, key: str, scope: Union[discord.Guild, 'discord.abc.MessageableChannel']):
 
@@ -224,20 +263,27 @@ class FirestorePropertyManager(ScopedPropertyManager):
                 key: firestore.DELETE_FIELD
             })
             self._dirty[scope] = True
+            self._notify_change(scope)
+
+    @staticmethod
+    def _read(document: firestore.DocumentReference) -> firestore.DocumentSnapshot:
+        metrics.record_firestore_read()
+        with tracer.span('firestore.read'):
+            return document.get()
 
     def _get_snapshot(self, scope: Union[discord.Guild, 'discord.abc.MessageableChannel']) -> firestore.DocumentSnapshot:
         if isinstance(scope, discord.Guild):
             guild_document = self._firestore_client.collection('guilds').document(str(scope.id))
-            return guild_document.get()
+            return self._read(guild_document)
         elif isinstance(scope, discord.DMChannel):
             guild_document = self._firestore_client.collection('dms').document(str(scope.id))
-            snapshot = guild_document.get()
+            snapshot = self._read(guild_document)
 
             # Write default preferences
             if not snapshot.exists:
                 logger.info(f'Preferences for "DM with {scope.recipient.name}" did not exist. Setting defaults.')
                 guild_document.set({p.key: p.default for p in self.properties})
-                snapshot = guild_document.get()
+                snapshot = self._read(guild_document)
 
             return snapshot
         else:
@@ -250,6 +296,6 @@ class FirestorePropertyManager(ScopedPropertyManager):
             if guild_id:
                 guild_document = self._firestore_client.collection('guilds').document(str(guild_id))
                 channel_document = guild_document.collection('channels').document(str(scope.id))
-                channel_snapshot = channel_document.get()
+                channel_snapshot = self._read(channel_document)
                 return channel_snapshot
         raise TypeError(f'Unknown scope: {type(scope)} "{scope}"')
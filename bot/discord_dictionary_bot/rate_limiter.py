@@ -0,0 +1,146 @@
+import contextlib
+import contextvars
+import enum
+import logging
+import math
+import os
+import struct
+import threading
+import time
+from datetime import timedelta
+from typing import Optional, Union, Tuple
+
+from .utils import FileLock
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+
+    # Background work like prefetching definitions, which can wait until more requests are available
+    LOW = 0
+
+    # Requests made for a user
+    NORMAL = 1
+
+
+# Priority of the requests made in the current context
+_current_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar('current_priority', default=Priority.NORMAL)
+
+
+@contextlib.contextmanager
+def request_priority(priority: Priority):
+    """
+    Make every rate limited request in this context use `priority`.
+    :param priority:
+    :return:
+    """
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class RateLimiter:
+    """
+    Limits the number of requests in any period of time with a sliding window counter. The count of the previous fixed window is weighted by
+    how much of it overlaps the sliding window, and added to the count of the current fixed window. This only needs three numbers of state,
+    so it can be saved after every request.
+
+    Acquiring is atomic: the count is checked and incremented under a lock. If `path` is specified, the state is kept in that file and locked
+    with `flock()`, so the limit survives restarts and is shared by every process that uses the same file.
+    """
+
+    # window start, count in the current window, count in the previous window
+    _STATE = struct.Struct('<dqq')
+
+    def __init__(self, limit: int, period: timedelta, path: Optional[Union[str, os.PathLike]] = None, reserved: int = 0):
+        """
+        :param limit: Maximum number of requests in any `period`.
+        :param period:
+        :param path: File to keep the state in. If this is None, the state is only kept in memory.
+        :param reserved: Number of requests in each period that are reserved for `Priority.NORMAL` requests. `Priority.LOW` requests can't
+        use them.
+        """
+        self._limit = limit
+        self._period = period.total_seconds()
+        self._reserved = reserved
+        self._lock = threading.Lock()
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT), 'r+b') if path is not None else None
+        self._state = (0.0, 0, 0)
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def _load(self) -> Tuple[float, int, int]:
+        if self._file is None:
+            return self._state
+        self._file.seek(0)
+        data = self._file.read(RateLimiter._STATE.size)
+        if len(data) < RateLimiter._STATE.size:
+            return 0.0, 0, 0
+        return RateLimiter._STATE.unpack(data)
+
+    def _save(self, state: Tuple[float, int, int]):
+        self._state = state
+        if self._file is not None:
+            self._file.seek(0)
+            self._file.write(RateLimiter._STATE.pack(*state))
+            self._file.flush()
+
+    def _advance(self, state: Tuple[float, int, int], now: float) -> Tuple[float, int, int]:
+        window_start, count, previous_count = state
+        current_window_start = math.floor(now / self._period) * self._period
+        if current_window_start == window_start:
+            return state
+        if current_window_start == window_start + self._period:
+            return current_window_start, 0, count
+        return current_window_start, 0, 0
+
+    def _available(self, state: Tuple[float, int, int], now: float, priority: Priority) -> float:
+        window_start, count, previous_count = state
+        overlap = 1 - (now - window_start) / self._period
+        available = self._limit - (previous_count * overlap + count)
+        if priority < Priority.NORMAL:
+            available -= self._reserved
+        return available
+
+    def _locked(self):
+        return FileLock(self._file, self._lock) if self._file is not None else self._lock
+
+    def try_acquire(self, count: int = 1, priority: Optional[Priority] = None) -> bool:
+        """
+        Use up `count` requests if they are available.
+        :param count:
+        :param priority: Defaults to the priority of the current context. See `request_priority()`.
+        :return: True if the requests can be made, or False if the limit was reached.
+        """
+        priority = priority if priority is not None else _current_priority.get()
+        now = time.time()
+        with self._locked():
+            state = self._advance(self._load(), now)
+            if self._available(state, now, priority) < count:
+                return False
+            window_start, window_count, previous_count = state
+            self._save((window_start, window_count + count, previous_count))
+        return True
+
+    def remaining(self, priority: Optional[Priority] = None) -> int:
+        """
+        Get the number of requests that can be made right now.
+        :param priority: Defaults to the priority of the current context. See `request_priority()`.
+        :return:
+        """
+        priority = priority if priority is not None else _current_priority.get()
+        now = time.time()
+        with self._locked():
+            state = self._advance(self._load(), now)
+        return max(0, math.floor(self._available(state, now, priority)))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
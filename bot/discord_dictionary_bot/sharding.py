@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import urllib.request
+from typing import List, Callable, Optional, Any
+
+from .property_manager import FirestorePropertyManager
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def get_recommended_shard_count(token: str) -> int:
+    """
+    Ask Discord how many shards it recommends for this bot.
+    :param token: The bot token.
+    :return:
+    """
+    request = urllib.request.Request('https://discord.com/api/v10/gateway/bot', headers={'Authorization': f'Bot {token}', 'User-Agent': 'DiscordBot'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())['shards']
+
+
+def get_shard_ids(process_index: int, process_count: int, shard_count: int) -> List[int]:
+    """
+    Get the shards that a process is responsible for. Shards are assigned to processes in a round-robin order, so each process gets roughly
+    the same number of guilds.
+    :param process_index:
+    :param process_count:
+    :param shard_count:
+    :return:
+    """
+    return list(range(process_index, shard_count, process_count))
+
+
+class SettingsBroadcaster:
+    """
+    Keeps the cached settings of every shard process coherent. Each process has its own queue, and when a process changes a setting, it puts
+    the ID of the changed scope on the queues of all other processes, which then invalidate their cached copies.
+    """
+
+    def __init__(self, queues: List[multiprocessing.Queue], process_index: int):
+        """
+        :param queues: One queue for each process, in the same order on every process.
+        :param process_index: Index of the current process.
+        """
+        self._queues = queues
+        self._process_index = process_index
+        self._thread: Optional[threading.Thread] = None
+
+    def publish(self, scope_id: int):
+        for i, q in enumerate(self._queues):
+            if i != self._process_index:
+                q.put(scope_id)
+
+    def start(self, property_manager: FirestorePropertyManager, loop: asyncio.AbstractEventLoop):
+        """
+        Publish the changes made by `property_manager`, and invalidate its cache when other processes make changes.
+        :param property_manager:
+        :param loop: The event loop that uses `property_manager`. Invalidations are run on this loop.
+        :return:
+        """
+        property_manager.add_change_listener(self.publish)
+
+        def run():
+            while True:
+                scope_id = self._queues[self._process_index].get()
+                if scope_id is None:
+                    return
+                loop.call_soon_threadsafe(property_manager.invalidate, scope_id)
+
+        self._thread = threading.Thread(target=run, name='settings-broadcaster', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queues[self._process_index].put(None)
+        self._thread.join()
+
+
+class ShardLauncher:
+    """
+    Runs the bot in several processes, each with its own event loop and a subset of the shards. Processes that crash are restarted.
+    """
+
+    # Number of seconds to wait before restarting a process that crashed
+    RESTART_DELAY = 5
+
+    def __init__(self, target: Callable[..., Any], process_count: int, shard_count: int, args: tuple = ()):
+        """
+        :param target: The function that runs the bot. It is called in each process as
+        `target(*args, process_index=..., shard_ids=..., shard_count=..., settings_broadcaster=...)`. It must be picklable.
+        :param process_count: Number of processes to start.
+        :param shard_count: Total number of shards across all processes.
+        :param args:
+        """
+        if shard_count < process_count:
+            raise ValueError(f'Need at least one shard per process {{process_count: {process_count}, shard_count: {shard_count}}}')
+        self._target = target
+        self._process_count = process_count
+        self._shard_count = shard_count
+        self._args = args
+        self._context = multiprocessing.get_context('spawn')
+        self._settings_queues = [self._context.Queue() for _ in range(process_count)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * process_count
+        self._stop_event = threading.Event()
+
+    def _start_process(self, index: int):
+        shard_ids = get_shard_ids(index, self._process_count, self._shard_count)
+        process = self._context.Process(
+            target=self._target,
+            args=self._args,
+            kwargs={
+                'process_index': index,
+                'shard_ids': shard_ids,
+                'shard_count': self._shard_count,
+                'settings_broadcaster': SettingsBroadcaster(self._settings_queues, index)
+            },
+            name=f'shard-process-{index}'
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f'Started process {index} {{pid: {process.pid}, shards: {shard_ids}}}')
+
+    def run(self):
+        """
+        Start all processes and wait until they exit. SIGINT and SIGTERM are forwarded to every process as SIGINT.
+        :return:
+        """
+        def stop(sig, frame):
+            self._stop_event.set()
+            for process in self._processes:
+                if process is not None and process.is_alive():
+                    os.kill(process.pid, signal.SIGINT)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        for i in range(self._process_count):
+            self._start_process(i)
+
+        while not self._stop_event.is_set():
+            for i, process in enumerate(self._processes):
+                if not process.is_alive() and process.exitcode != 0 and not self._stop_event.is_set():
+                    logger.error(f'Process {i} exited unexpectedly {{exit_code: {process.exitcode}}}. Restarting in {ShardLauncher.RESTART_DELAY} seconds.')
+                    time.sleep(ShardLauncher.RESTART_DELAY)
+                    if not self._stop_event.is_set():
+                        self._start_process(i)
+            if not any(process.is_alive() for process in self._processes):
+                break
+            self._stop_event.wait(1)
+
+        for process in self._processes:
+            process.join()
@@ -0,0 +1,127 @@
+import array
+import bisect
+import logging
+import time
+from typing import Iterable, List, Set
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Get the optimal string alignment distance between two strings, which is the Levenshtein distance where swapping two adjacent characters
+    also counts as one edit.
+    :param a:
+    :param b:
+    :param max_distance: Stop early once the distance is known to be larger than this.
+    :return: The distance, or `max_distance + 1` if it is larger than `max_distance`.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+def _deletes(word: str, max_distance: int) -> Set[str]:
+    """
+    :return: Every string that can be made by deleting up to `max_distance` characters from `word`, including `word` itself.
+    """
+    result = {word}
+    queue = [word]
+    for _ in range(max_distance):
+        next_queue = []
+        for x in queue:
+            for i in range(len(x)):
+                delete = x[:i] + x[i + 1:]
+                if delete not in result:
+                    result.add(delete)
+                    next_queue.append(delete)
+        queue = next_queue
+    return result
+
+
+class SpellingIndex:
+    """
+    Finds known words that are close to a misspelled word, using the symmetric delete algorithm from SymSpell. Every string that can be made
+    by deleting up to `max_distance` characters from the first `prefix_length` characters of a known word is indexed. Two words are within
+    `max_distance` edits of each other only if they share one of these deletes, so a lookup only needs to generate the deletes of the
+    misspelled word instead of every possible edit.
+
+    A dictionary of deletes would take hundreds of megabytes for a full English word list, so the index is a sorted array of 64 bit
+    integers instead, each holding the hash of a delete in the upper 40 bits and the index of its word in the lower 24 bits. Hash collisions
+    only add candidates, which are removed when the edit distance of each candidate is checked.
+    """
+
+    _INDEX_BITS = 24
+
+    def __init__(self, words: Iterable[str], max_distance: int = 2, prefix_length: int = 7):
+        """
+        :param words: The known words.
+        :param max_distance: Maximum number of edits between a misspelled word and its suggestions.
+        :param prefix_length: Number of characters of each word to index. A shorter prefix makes the index smaller, but lookups of long words
+        check more candidates.
+        """
+        self._max_distance = max_distance
+        self._prefix_length = prefix_length
+
+        start_time = time.perf_counter()
+        self._words = sorted({word.lower() for word in words})[:1 << SpellingIndex._INDEX_BITS]
+        self._word_set = set(self._words)
+        entries = []
+        for i, word in enumerate(self._words):
+            for delete in _deletes(word[:prefix_length], max_distance):
+                entries.append(self._key(delete) | i)
+        entries.sort()
+        self._entries = array.array('Q', entries)
+        logger.info(f'Created spelling index {{words: {len(self._words)}, entries: {len(self._entries)}, seconds: {time.perf_counter() - start_time:.2f}}}')
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def __contains__(self, word: str) -> bool:
+        return word.lower() in self._word_set
+
+    @staticmethod
+    def _key(delete: str) -> int:
+        # The hash of a string is only stable within a process, which is fine since the index is never saved
+        return (hash(delete) & ((1 << (64 - SpellingIndex._INDEX_BITS)) - 1)) << SpellingIndex._INDEX_BITS
+
+    def suggest(self, word: str, limit: int = 5) -> List[str]:
+        """
+        Get the known words that are closest to `word`.
+        :param word:
+        :param limit: Maximum number of suggestions.
+        :return: The suggestions, closest first. If `word` is a known word, it is the only suggestion.
+        """
+        word = word.lower()
+        if word in self._word_set:
+            return [word]
+
+        candidates = set()
+        for delete in _deletes(word[:self._prefix_length], self._max_distance):
+            key = self._key(delete)
+            start = bisect.bisect_left(self._entries, key)
+            end = bisect.bisect_left(self._entries, key + (1 << SpellingIndex._INDEX_BITS), start)
+            for entry in self._entries[start:end]:
+                candidates.add(entry & ((1 << SpellingIndex._INDEX_BITS) - 1))
+
+        suggestions = []
+        for i in candidates:
+            candidate = self._words[i]
+            distance = edit_distance(word, candidate, self._max_distance)
+            if distance <= self._max_distance:
+                suggestions.append((distance, abs(len(candidate) - len(word)), candidate))
+        suggestions.sort()
+        return [candidate for _, _, candidate in suggestions[:limit]]
@@ -0,0 +1,225 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Optional, Dict, Any, List, Union
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """
+    A timed operation within a trace. Spans are created with `Tracer.start_trace()` and `Tracer.span()`.
+    """
+
+    __slots__ = ('name', 'trace', 'span_id', 'parent_id', 'start_time', 'end_time', 'attributes', 'error')
+
+    def __init__(self, name: str, trace: 'Trace', parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.start_time = time.time_ns()
+        self.end_time: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict[str, Any]:
+        result = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start_time),
+            'endTimeUnixNano': str(self.end_time),
+            'attributes': [_to_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error is not None else {'code': 1}
+        }
+        if self.parent_id is not None:
+            result['parentSpanId'] = self.parent_id
+        return result
+
+
+class _NoOpSpan:
+    """
+    Returned instead of a span when the current trace is not sampled, so that callers never need to check.
+    """
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+_NO_OP_SPAN = _NoOpSpan()
+
+
+def _to_otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class Trace:
+    """
+    All spans of a single interaction. The trace is exported once its root span ends.
+    """
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Span] = []
+
+
+# The innermost span in the current context
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+
+
+class _SpanContext:
+
+    def __init__(self, tracer: 'Tracer', span: Optional[Span]):
+        self._tracer = tracer
+        self._span = span
+        self._token: Optional[contextvars.Token] = None
+
+    def __enter__(self) -> Union[Span, _NoOpSpan]:
+        if self._span is None:
+            return _NO_OP_SPAN
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._span is None:
+            return
+        span = self._span
+        span.end_time = time.time_ns()
+        if exc_val is not None:
+            span.error = f'{exc_type.__name__}: {exc_val}'
+        _current_span.reset(self._token)
+        span.trace.spans.append(span)
+        if span.parent_id is None:
+            self._tracer.export(span.trace)
+
+
+class FileExporter:
+    """
+    Writes traces to a file in the OTLP JSON format, one `ExportTraceServiceRequest` per line. Files in this format can be imported by the
+    OpenTelemetry Collector's file receiver. Writing happens on a background thread so that exporting never blocks the event loop.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], service_name: str = 'discord-dictionary-bot'):
+        self._path = path
+        self._resource = {'attributes': [_to_otlp_attribute('service.name', service_name)]}
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, trace: Trace):
+        self._queue.put(trace)
+
+    def shutdown(self):
+        """
+        Write all pending traces and stop the background thread.
+        :return:
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        with open(self._path, 'a') as file:
+            while True:
+                traces = [self._queue.get()]
+
+                # Write everything that is waiting at once
+                while not self._queue.empty():
+                    traces.append(self._queue.get())
+                stop = None in traces
+
+                for trace in traces:
+                    if trace is None:
+                        continue
+                    request = {'resourceSpans': [{
+                        'resource': self._resource,
+                        'scopeSpans': [{'scope': {'name': 'discord_dictionary_bot'}, 'spans': [span.to_otlp() for span in trace.spans]}]
+                    }]}
+                    file.write(json.dumps(request, separators=(',', ':')) + '\n')
+                file.flush()
+
+                if stop:
+                    return
+
+
+class Tracer:
+    """
+    Creates traces for interactions and spans within them. Whether a trace is recorded is decided when it starts, so spans of traces that are
+    not sampled cost almost nothing.
+    """
+
+    def __init__(self, exporter: Optional[FileExporter] = None, sample_rate: float = 1.0):
+        """
+        :param exporter: Where to export finished traces. If this is None, nothing is traced.
+        :param sample_rate: Fraction of traces to record.
+        """
+        self._exporter = exporter
+        self._sample_rate = sample_rate
+
+    def configure(self, exporter: Optional[FileExporter], sample_rate: float = 1.0):
+        self._exporter = exporter
+        self._sample_rate = sample_rate
+
+    def start_trace(self, name: str, interaction_id: int, **attributes) -> _SpanContext:
+        """
+        Start a new trace with a root span. The trace ID is derived from the interaction ID, so the trace of an interaction can be found easily.
+        :param name:
+        :param interaction_id:
+        :param attributes:
+        :return: A context manager for the root span.
+        """
+        if self._exporter is None or random.random() >= self._sample_rate:
+            return _SpanContext(self, None)
+        trace = Trace(f'{interaction_id:032x}')
+        attributes['discord.interaction_id'] = interaction_id
+        return _SpanContext(self, Span(name, trace, None, attributes))
+
+    def span(self, name: str, **attributes) -> _SpanContext:
+        """
+        Start a child span of the current span. If there is no current span, or the current trace is not sampled, this does nothing.
+        :param name:
+        :param attributes:
+        :return: A context manager for the span.
+        """
+        parent = _current_span.get()
+        if parent is None:
+            return _SpanContext(self, None)
+        return _SpanContext(self, Span(name, parent.trace, parent.span_id, attributes))
+
+    def export(self, trace: Trace):
+        if self._exporter is not None:
+            self._exporter.export(trace)
+
+    def trace_interaction(self, name: str):
+        """
+        Decorator for command callbacks that records each call as a new trace.
+        :param name: Name of the root span.
+        :return:
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            async def wrapper(self_, interaction, *args, **kwargs):
+                with self.start_trace(name, interaction.id, **{'discord.guild_id': interaction.guild_id or 0, 'discord.channel_id': interaction.channel_id or 0}):
+                    return await function(self_, interaction, *args, **kwargs)
+            return wrapper
+        return decorator
+
+
+tracer = Tracer()
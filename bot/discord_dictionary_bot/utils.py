@@ -1,7 +1,14 @@
 import logging
+import threading
+from typing import Optional
 
 import discord
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
@@ -16,3 +23,28 @@ def get_bot_permissions(channel):
         'speak': permissions.speak
     }
     return permission_names
+
+
+class FileLock:
+    """
+    Locks a file against other processes with `flock()`, and against other threads of this process with a regular lock. On platforms without
+    `flock()`, only other threads are locked out.
+    """
+
+    def __init__(self, file, lock: Optional[threading.Lock] = None):
+        """
+        :param file: An open file.
+        :param lock: A lock that is shared by every thread that locks the same file.
+        """
+        self._file = file
+        self._lock = lock if lock is not None else threading.Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._lock.release()
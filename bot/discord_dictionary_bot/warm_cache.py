@@ -0,0 +1,213 @@
+import argparse
+import asyncio
+import logging
+import os
+from typing import List, Dict
+
+from google.cloud import translate_v2 as translate
+
+from .__main__ import add_dictionary_api_arguments, get_dictionary_api_specs
+from .autocomplete import read_word_counts
+from .cache import MemoryCache, write_snapshot
+from .cogs.dictionary import text_to_speech_pcm, convert, is_valid_word, translation_cache_key, encode_translation, text_to_speech_cache_key, \
+    create_text_to_speech_input
+from .definitions import DefinitionEntry
+from .dictionary_api import DictionaryAPI, SequentialDictionaryAPI
+from .rate_limiter import request_priority, Priority
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class CacheWarmer:
+    """
+    Fetches definitions, translations and text-to-speech audio for the most requested words ahead of time, so that they can be served from
+    the cache instead of calling the dictionary API's and Google Cloud. Everything is fetched with `Priority.LOW`, so the requests reserved
+    for users of rate limited dictionary API's are never used.
+    """
+
+    def __init__(self, dictionary_apis: List[DictionaryAPI], cache: MemoryCache, all_backends: bool = False, concurrency: int = 8):
+        """
+        :param dictionary_apis: The dictionary API's to fetch definitions from, in order of priority.
+        :param cache: The cache to fill.
+        :param all_backends: Fetch definitions from every dictionary API instead of stopping at the first one that has definitions. This
+        helps servers that use a different order of dictionary API's.
+        :param concurrency: Maximum number of words to fetch at the same time.
+        """
+        self._dictionary_apis = dictionary_apis
+        self._cache = cache
+        self._all_backends = all_backends
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def define(self, words: List[str]) -> Dict[str, List[DefinitionEntry]]:
+        """
+        :param words:
+        :return: The definitions of each word that has any, from the first dictionary API that has them.
+        """
+        if self._all_backends:
+            apis = [SequentialDictionaryAPI([api], cache=self._cache) for api in self._dictionary_apis]
+        else:
+            apis = [SequentialDictionaryAPI(self._dictionary_apis, cache=self._cache)]
+
+        async def define(word: str) -> List[DefinitionEntry]:
+            async with self._semaphore:
+                result = []
+                for api in apis:
+                    definitions = await api.define(word)
+                    if len(result) == 0:
+                        result = definitions
+                return result
+
+        with request_priority(Priority.LOW):
+            results = await asyncio.gather(*[define(word) for word in words])
+        return {word: definitions for word, definitions in zip(words, results) if len(definitions) > 0}
+
+    def translate(self, definitions: Dict[str, List[DefinitionEntry]], languages: List[str]) -> int:
+        """
+        Translate each word and its definitions the same way the /define command does.
+        :param definitions:
+        :param languages: The target languages.
+        :return: The number of texts that were translated.
+        """
+        client = translate.Client()
+        count = 0
+        for language in languages:
+            texts = set()
+            for word, word_definitions in definitions.items():
+                texts.add(word)
+                for definition in word_definitions:
+                    texts.add(definition.word_type)
+                    texts.add(definition.definition)
+
+            # Google Translate accepts up to 128 texts per request
+            texts = [text for text in texts if self._cache.get('translations', translation_cache_key(text, language)) is None]
+            for i in range(0, len(texts), 128):
+                batch = texts[i:i + 128]
+                for text, result in zip(batch, client.translate(batch, target_language=language)):
+                    self._cache.set('translations', translation_cache_key(text, language), encode_translation(result))
+                count += len(batch)
+            logger.info(f'Translated definitions {{language: "{language}", texts: {len(texts)}}}')
+        return count
+
+    async def synthesize(self, definitions: Dict[str, List[DefinitionEntry]], voice: str, ffmpeg_path: str = 'ffmpeg') -> int:
+        """
+        Generate the text-to-speech audio that the /define command plays for each word.
+        :param definitions:
+        :param voice: The voice code, which must match the one the bot uses.
+        :param ffmpeg_path:
+        :return: The number of words that audio was generated for.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def synthesize(word: str, word_definitions: List[DefinitionEntry]) -> bool:
+            key = text_to_speech_cache_key(create_text_to_speech_input(word, word_definitions), voice)
+            if self._cache.get('audio', key) is not None:
+                return False
+            async with self._semaphore:
+                try:
+                    pcm = await loop.run_in_executor(None, text_to_speech_pcm, create_text_to_speech_input(word, word_definitions), voice)
+                except Exception as e:
+                    logger.error(f'Failed to generate text-to-speech data: {e} {{word: "{word}"}}')
+                    return False
+                audio = await convert(pcm, ffmpeg_path=ffmpeg_path)
+            if len(audio) == 0:
+                return False
+            self._cache.set('audio', key, audio)
+            return True
+
+        results = await asyncio.gather(*[synthesize(word, word_definitions) for word, word_definitions in definitions.items()])
+        return sum(results)
+
+
+async def warm(args: argparse.Namespace, dictionary_apis: List[DictionaryAPI]):
+    word_counts = read_word_counts(args.word_counts, word_filter=is_valid_word)
+    words = [word for word, _ in word_counts.most_common(args.words)]
+    logger.info(f'Warming cache {{words: {len(words)}, distinct_words: {len(word_counts)}}}')
+
+    # Only the most requested words are kept, so the snapshot must fit in the bot's cache
+    cache = MemoryCache(max_bytes=args.cache_size * 1024 * 1024)
+    warmer = CacheWarmer(dictionary_apis, cache, all_backends=args.all_backends, concurrency=args.concurrency)
+
+    definitions = await warmer.define(words)
+    logger.info(f'Fetched definitions {{words: {len(definitions)}, missing: {len(words) - len(definitions)}}}')
+    for api in dictionary_apis:
+        remaining = api.remaining_requests()
+        if remaining is not None:
+            logger.info(f'{api} Remaining requests: {remaining}')
+
+    languages = [language for language in args.languages.split(',') if len(language) > 0] if args.languages is not None else []
+    if len(languages) > 0:
+        warmer.translate(definitions, languages)
+
+    if args.text_to_speech > 0:
+        top_definitions = {word: definitions[word] for word in words[:args.text_to_speech] if word in definitions}
+        count = await warmer.synthesize(top_definitions, args.voice, ffmpeg_path=args.ffmpeg_path)
+        logger.info(f'Generated text-to-speech audio {{words: {count}}}')
+
+    count = write_snapshot(args.output, cache.items())
+    logger.info(f'Wrote cache snapshot {{path: "{args.output}", values: {count}}}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch definitions, translations and text-to-speech audio for the most requested words and write them to a snapshot that the bot can load at startup with --cache-snapshot.')
+    parser.add_argument('word_counts',
+                        help='Path to an analytics export of word counts. Either a CSV file with "word" and "count" columns, or newline delimited JSON.')
+    parser.add_argument('--output',
+                        help='Path to write the snapshot to.',
+                        dest='output',
+                        default='cache_snapshot.bin')
+    parser.add_argument('--words',
+                        help='Number of most requested words to fetch definitions for.',
+                        dest='words',
+                        type=int,
+                        default=1000)
+    parser.add_argument('--all-backends',
+                        help='Fetch definitions from every dictionary API instead of stopping at the first one that has definitions.',
+                        dest='all_backends',
+                        action='store_true')
+    parser.add_argument('--languages',
+                        help='Comma separated list of languages to translate the definitions to.',
+                        dest='languages')
+    parser.add_argument('--text-to-speech',
+                        help='Number of most requested words to generate text-to-speech audio for.',
+                        dest='text_to_speech',
+                        type=int,
+                        default=0)
+    parser.add_argument('--voice',
+                        help='Voice to use for text-to-speech audio. This must match the voice the bot uses for English.',
+                        dest='voice',
+                        default='en-US-Wavenet-C')
+    parser.add_argument('--ffmpeg-path',
+                        help='Path to ffmpeg executable.',
+                        dest='ffmpeg_path',
+                        default='ffmpeg')
+    parser.add_argument('--google-credentials-path',
+                        help='Path to Google application credentials JSON file.',
+                        dest='google_credentials_path',
+                        default='google_credentials.json')
+    parser.add_argument('--cache-size',
+                        help='Maximum size of the snapshot in megabytes.',
+                        dest='cache_size',
+                        type=int,
+                        default=256)
+    parser.add_argument('--concurrency',
+                        help='Maximum number of words to fetch at the same time.',
+                        dest='concurrency',
+                        type=int,
+                        default=8)
+    add_dictionary_api_arguments(parser)
+    args = parser.parse_args()
+
+    # Set Google API credentials
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = args.google_credentials_path
+
+    dictionary_api_specs = get_dictionary_api_specs(args)
+    if dictionary_api_specs is None:
+        return
+    dictionary_apis = [cls(*api_args, **api_kwargs) for cls, api_args, api_kwargs in dictionary_api_specs]
+
+    asyncio.run(warm(args, dictionary_apis))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import bisect
+import logging
+import mmap
+import os
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from .definitions import DefinitionEntry
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class WordStore:
+    """
+    A read-only dictionary in a memory-mapped file. Lookups don't load anything into memory, so a large dictionary costs nothing until its
+    pages are read, and the pages are shared by every process that opens the same file.
+
+    The file contains a header, a prefix table, an entry table and the entries:
+
+    - The prefix table has 65537 entry indices. Entry `prefix_table[p]` is the first word whose first two bytes are at least `p`, so the
+      words starting with a two byte prefix are found without searching and only that range is binary searched.
+    - The entry table holds the offset of each entry, sorted by word.
+    - Each entry is a 2 byte word length, a 2 byte definition count and the word, followed by a 1 byte word type length, a 2 byte definition
+      length, the word type and the definition for each definition. All strings are UTF-8.
+
+    Words are stored in lower case. Files are written with `write_word_store()`.
+    """
+
+    MAGIC = b'DDBW'
+    VERSION = 1
+
+    # magic, version, word count
+    _HEADER = struct.Struct('<4sII')
+    _HEADER_SIZE = 16
+
+    _PREFIX_TABLE_SIZE = 65536 + 1
+
+    # The prefix table is padded so that the entry table is 8 byte aligned
+    _ENTRY_TABLE_OFFSET = _HEADER_SIZE + (_PREFIX_TABLE_SIZE * 4 + 7) // 8 * 8
+
+    # word length, definition count
+    _ENTRY = struct.Struct('<HH')
+
+    # word type length, definition length
+    _DEFINITION = struct.Struct('<BH')
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._word_count = WordStore._HEADER.unpack_from(self._mmap, 0)
+        if magic != WordStore.MAGIC or version != WordStore.VERSION:
+            self._mmap.close()
+            raise ValueError(f'"{path}" is not a word store or has an unsupported version')
+        self._prefix_table = memoryview(self._mmap)[WordStore._HEADER_SIZE:WordStore._HEADER_SIZE + WordStore._PREFIX_TABLE_SIZE * 4].cast('I')
+        self._entry_table = memoryview(self._mmap)[WordStore._ENTRY_TABLE_OFFSET:WordStore._ENTRY_TABLE_OFFSET + self._word_count * 8].cast('Q')
+
+    def __len__(self) -> int:
+        return self._word_count
+
+    def _word_at(self, index: int) -> bytes:
+        offset = self._entry_table[index]
+        word_length, _ = WordStore._ENTRY.unpack_from(self._mmap, offset)
+        offset += WordStore._ENTRY.size
+        return self._mmap[offset:offset + word_length]
+
+    @staticmethod
+    def _prefix(word: bytes) -> int:
+        # Words shorter than two bytes are padded with zeros, which sorts them before every longer word with the same first byte
+        return int.from_bytes(word[:2].ljust(2, b'\0'), 'big')
+
+    def _range(self, word: bytes) -> Tuple[int, int]:
+        """
+        :return: The range of entries that start with the same two bytes as `word`.
+        """
+        prefix = WordStore._prefix(word)
+        return self._prefix_table[prefix], self._prefix_table[prefix + 1]
+
+    def _bisect(self, word: bytes, low: int, high: int) -> int:
+        # The same as bisect.bisect_left(), but without loading the words into a list
+        while low < high:
+            middle = (low + high) // 2
+            if self._word_at(middle) < word:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, word: str) -> Optional[List[DefinitionEntry]]:
+        """
+        :param word:
+        :return: The definitions of `word` in the same format as `DictionaryAPI.define()`, or None if the word is not in this store.
+        """
+        key = word.lower().encode()
+        low, high = self._range(key)
+        index = self._bisect(key, low, high)
+        if index >= high or self._word_at(index) != key:
+            return None
+
+        offset = self._entry_table[index]
+        word_length, definition_count = WordStore._ENTRY.unpack_from(self._mmap, offset)
+        offset += WordStore._ENTRY.size + word_length
+        definitions = []
+        for _ in range(definition_count):
+            word_type_length, definition_length = WordStore._DEFINITION.unpack_from(self._mmap, offset)
+            offset += WordStore._DEFINITION.size
+            word_type = self._mmap[offset:offset + word_type_length].decode()
+            offset += word_type_length
+            definition = self._mmap[offset:offset + definition_length].decode()
+            offset += definition_length
+            definitions.append(DefinitionEntry(word_type, definition))
+        return definitions
+
+    def words(self) -> Iterator[str]:
+        """
+        :return: Every word in this store, in sorted order.
+        """
+        for index in range(self._word_count):
+            yield self._word_at(index).decode()
+
+    def words_with_prefix(self, prefix: str, limit: int = 25) -> List[str]:
+        """
+        :param prefix:
+        :param limit: Maximum number of words to return.
+        :return: The words that start with `prefix`, in sorted order.
+        """
+        key = prefix.lower().encode()
+        if len(key) >= 2:
+            low, high = self._range(key)
+        else:
+            # Short prefixes span several ranges of the prefix table
+            low = self._prefix_table[WordStore._prefix(key)] if len(key) == 1 else 0
+            high = self._prefix_table[WordStore._prefix(key) + 256] if len(key) == 1 else self._word_count
+        words = []
+        for index in range(self._bisect(key, low, high), high):
+            word = self._word_at(index)
+            if not word.startswith(key) or len(words) >= limit:
+                break
+            words.append(word.decode())
+        return words
+
+    def close(self):
+        self._prefix_table.release()
+        self._entry_table.release()
+        self._mmap.close()
+
+
+def _truncate(text: str, max_bytes: int) -> bytes:
+    # Don't split multi-byte characters
+    return text.encode()[:max_bytes].decode(errors='ignore').encode()
+
+
+def write_word_store(path: Union[str, os.PathLike], definitions: Dict[str, List[DefinitionEntry]]) -> int:
+    """
+    Write definitions to a file that can be opened with `WordStore`. The file is written to a temporary path first and then moved into place,
+    so processes that have the old file open are not affected.
+    :param path:
+    :param definitions: The definitions of each word in the same format as `DictionaryAPI.define()`. Words are converted to lower case, and
+    the definitions of words that only differ in case are merged.
+    :return: The number of words that were written.
+    """
+    merged: Dict[bytes, List[DefinitionEntry]] = {}
+    for word, word_definitions in definitions.items():
+        if len(word_definitions) > 0:
+            merged.setdefault(word.lower().encode(), []).extend(word_definitions)
+    words = sorted(merged)
+
+    # Encode the entries
+    entries = []
+    for word in words:
+        word_definitions = merged[word][:0xFFFF]
+        entry = [WordStore._ENTRY.pack(len(word), len(word_definitions)), word]
+        for definition in word_definitions:
+            word_type = _truncate(definition.word_type, 0xFF)
+            text = _truncate(definition.definition, 0xFFFF)
+            entry += [WordStore._DEFINITION.pack(len(word_type), len(text)), word_type, text]
+        entries.append(b''.join(entry))
+
+    # Build the prefix table
+    prefixes = [WordStore._prefix(word) for word in words]
+    prefix_table = [bisect.bisect_left(prefixes, prefix) for prefix in range(WordStore._PREFIX_TABLE_SIZE)]
+
+    # Build the entry table
+    offset = WordStore._ENTRY_TABLE_OFFSET + len(words) * 8
+    entry_table = []
+    for entry in entries:
+        entry_table.append(offset)
+        offset += len(entry)
+
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(WordStore._HEADER.pack(WordStore.MAGIC, WordStore.VERSION, len(words)).ljust(WordStore._HEADER_SIZE, b'\0'))
+        file.write(struct.pack(f'<{len(prefix_table)}I', *prefix_table).ljust(WordStore._ENTRY_TABLE_OFFSET - WordStore._HEADER_SIZE, b'\0'))
+        file.write(struct.pack(f'<{len(entry_table)}Q', *entry_table))
+        for entry in entries:
+            file.write(entry)
+    os.replace(temporary_path, path)
+    logger.info(f'Wrote word store {{path: "{path}", words: {len(words)}}}')
+    return len(words)
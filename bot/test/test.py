@@ -1,6 +1,31 @@
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import time
 import unittest
+from unittest import mock
 
+from benchmark.decoding import create_apis, read_payloads
+from benchmark.mock_servers import MockDictionaryServer, BackendBehavior
+from discord_dictionary_bot.cache import MemoryCache, SQLiteCache, MappedFileCache, write_snapshot
+from discord_dictionary_bot.autocomplete import WordCompleter, read_word_counts
+from discord_dictionary_bot.analytics import tables, to_bq_file, FlushPolicy, AnalyticsRollup
+from discord_dictionary_bot.cogs.dictionary import is_valid_word
+from discord_dictionary_bot.definitions import DefinitionEntry, DefinitionResult
+from discord_dictionary_bot import dictionary_api
+from discord_dictionary_bot.dictionary_api import SequentialDictionaryAPI, LocalDictionaryAPI, DictionaryAPIError
 from discord_dictionary_bot.discord_bot_client import interaction_data_to_string
+from discord_dictionary_bot.json_decoder import DECODERS, get_json_decoder, set_json_decoder
+from discord_dictionary_bot.loop_monitor import LoopMonitor
+from discord_dictionary_bot.metrics import Registry
+from discord_dictionary_bot.rate_limiter import RateLimiter, Priority, request_priority
+from discord_dictionary_bot.sketches import HyperLogLog, SpaceSaving
+from discord_dictionary_bot.spelling import SpellingIndex, edit_distance
+from discord_dictionary_bot.tracing import Tracer, FileExporter
+from discord_dictionary_bot.warm_cache import CacheWarmer
+from discord_dictionary_bot.word_store import WordStore, write_word_store
 
 
 class TestDiscordBotClient(unittest.TestCase):
@@ -18,5 +43,503 @@ class TestDiscordBotClient(unittest.TestCase):
             self.assertEqual(interaction_data_to_string(data), expected)
 
 
+class TestAnalyticsTable(unittest.TestCase):
+
+    def test_swap(self):
+        table = tables['log_dictionary_api_request']
+        table.append(('owlbot', True, 0))
+        table.append(('rapid_words', False, 1))
+        rows = table.swap()
+        self.assertEqual(rows, [('owlbot', True, 0), ('rapid_words', False, 1)])
+        self.assertEqual(len(table), 0)
+
+        # Rows that failed to upload are kept for the next swap
+        table.requeue(rows)
+        self.assertEqual(table.swap(), rows)
+
+    def test_to_dicts(self):
+        table = tables['log_dictionary_api_request']
+        timestamp = datetime.datetime(2023, 5, 1, 12, 30).timestamp()
+        self.assertEqual(list(table.to_dicts([('owlbot', True, timestamp)])), [{'api_name': 'owlbot', 'success': True, 'time': '2023-05-01T12:30:00'}])
+
+    def test_to_bq_file(self):
+        table = tables['log_dictionary_api_request']
+        timestamp = datetime.datetime(2023, 5, 1, 12, 30).timestamp()
+        with to_bq_file(table, [('owlbot', True, timestamp), ('rapid_words', False, timestamp)]) as file:
+            self.assertEqual(file.read(), b'{"api_name": "owlbot", "success": true, "time": "2023-05-01T12:30:00"}\n'
+                                          b'{"api_name": "rapid_words", "success": false, "time": "2023-05-01T12:30:00"}\n')
+
+
+class TestFlushPolicy(unittest.TestCase):
+
+    def test_should_flush(self):
+        table = tables['log_context_menu']
+        self.addCleanup(table.swap)
+        policy = FlushPolicy(max_rows=3, max_age=60)
+        self.assertFalse(policy.should_flush(table, 1000))
+
+        table.append(('Translate', 1, 2, 1000))
+        self.assertFalse(policy.should_flush(table, 1030))
+        self.assertTrue(policy.should_flush(table, 1060))
+
+        table.append(('Translate', 1, 2, 1001))
+        table.append(('Translate', 1, 2, 1002))
+        self.assertTrue(policy.should_flush(table, 1000))
+
+    def test_get_backoff(self):
+        policy = FlushPolicy(min_backoff=30, max_backoff=100)
+        self.assertEqual([policy.get_backoff(i) for i in range(1, 5)], [30, 60, 100, 100])
+
+
+class TestAnalyticsRollup(unittest.TestCase):
+
+    def tearDown(self):
+        # Discard the rows that were emitted, even if the test failed before reading them
+        for table in tables.values():
+            table.swap()
+
+    def test_emit(self):
+        rollup = AnalyticsRollup(top_words_count=2)
+        timestamp = datetime.datetime(2023, 5, 1, 12, 30).timestamp()
+        rollup.add_definition_requests([
+            ('Water', False, False, 'en', 1, 10, timestamp),
+            ('water', False, False, 'en', 1, 10, timestamp),
+            ('fire', False, True, 'en', 1, 11, timestamp),
+        ])
+        rollup.add_dictionary_api_requests([('owlbot', True, timestamp), ('owlbot', False, timestamp), ('owlbot', True, timestamp)])
+        rollup.emit()
+
+        date, count, distinct_channels, sketch, top_words, _ = tables['daily_definition_summary'].swap()[0]
+        self.assertEqual((date, count, distinct_channels), (datetime.date(2023, 5, 1), 3, 2))
+        self.assertEqual(HyperLogLog.from_bytes(sketch).count(), 2)
+        self.assertEqual(top_words, [{'word': 'water', 'count': 2}, {'word': 'fire', 'count': 1}])
+        self.assertEqual(tables['daily_dictionary_api_counts'].swap()[0][:4], (datetime.date(2023, 5, 1), 'owlbot', 2, 1))
+        self.assertEqual(rollup.totals, {'definition_requests': 3, 'dictionary_api_requests': 3})
+
+
+class TestSketches(unittest.TestCase):
+
+    def test_hyper_log_log(self):
+        a = HyperLogLog()
+        b = HyperLogLog()
+        for i in range(20000):
+            (a if i % 2 == 0 else b).add(i)
+            a.add(i % 100)
+        a.merge(b)
+        self.assertAlmostEqual(a.count(), 20000, delta=20000 * 0.05)
+
+    def test_space_saving(self):
+        sketch = SpaceSaving(capacity=3)
+        for word in ['a'] * 10 + ['b'] * 5 + ['c', 'd', 'e', 'f'] + ['b'] * 3:
+            sketch.add(word)
+        self.assertEqual([word for word, _ in sketch.top(2)], ['a', 'b'])
+        self.assertEqual(sketch.top(1), [('a', 10)])
+
+
+class TestDictionaryAPI(unittest.TestCase):
+
+    def tearDown(self):
+        # Discard the analytics of the requests
+        for table in tables.values():
+            table.swap()
+
+    def test_mock_server(self):
+        behaviors = {
+            'unofficial_google': BackendBehavior(malformed_rate=1),
+            'merriam_webster_medical': BackendBehavior(malformed_rate=1),
+            'rapid_words': BackendBehavior(not_found_rate=1)
+        }
+        with MockDictionaryServer(behaviors, BackendBehavior(definition_count=2)) as server:
+            apis = server.create_apis()
+            for api in apis:
+                if api.id() == 'unofficial_google':
+                    with self.assertRaises(DictionaryAPIError):
+                        asyncio.run(api.define('water'))
+                    continue
+                definitions = asyncio.run(api.define('water'))
+                self.assertEqual(len(definitions), 0 if api.id() in behaviors else 2, api)
+
+            # Fall back to the next API when the first one fails
+            apis[0] = apis[3]
+            result = asyncio.run(SequentialDictionaryAPI(apis).define_with_source('water'))
+            self.assertEqual(result.source, 'owlbot')
+            self.assertEqual(result.entries[0].word_type, 'noun')
+
+    def test_response_limits(self):
+        with MockDictionaryServer({'owlbot': BackendBehavior(malformed_rate=1)}, BackendBehavior(definition_count=50)) as server:
+            apis = server.create_apis()
+            for api in apis:
+                if api.id() == 'owlbot':
+                    with self.assertRaises(DictionaryAPIError):
+                        asyncio.run(api.define('water'))
+                    continue
+                definitions = asyncio.run(api.define('water'))
+                self.assertEqual(len(definitions), dictionary_api.MAX_DEFINITIONS, api)
+
+            # Responses larger than the limit are not read
+            with mock.patch.object(dictionary_api, 'MAX_RESPONSE_SIZE', 100), self.assertRaises(DictionaryAPIError):
+                asyncio.run(apis[0].define('water'))
+
+    def test_cache(self):
+        behaviors = {
+            'unofficial_google': BackendBehavior(error_rate=1),
+            'owlbot': BackendBehavior(not_found_rate=1)
+        }
+        with MockDictionaryServer(behaviors, BackendBehavior(definition_count=2)) as server:
+            apis = server.create_apis()[:3]
+            cache = MemoryCache()
+
+            # Errors are not cached, but an API without definitions is skipped
+            for _ in range(2):
+                result = asyncio.run(SequentialDictionaryAPI(apis, cache=cache).define_with_source('water'))
+                self.assertEqual(result.source, 'merriam_webster_collegiate')
+            self.assertEqual(server.request_counts, {'unofficial_google': {500: 2}, 'owlbot': {404: 1}, 'merriam_webster_collegiate': {200: 1}})
+
+            # The same word with different case or surrounding whitespace is cached too
+            result = asyncio.run(SequentialDictionaryAPI(apis, cache=cache).define_with_source(' Water'))
+            self.assertEqual(result.word, ' Water')
+            self.assertEqual(server.request_counts['owlbot'], {404: 1})
+            self.assertEqual(server.request_counts['merriam_webster_collegiate'], {200: 1})
+
+            # Until its cached result expires
+            for _ in range(2):
+                asyncio.run(SequentialDictionaryAPI(apis, cache=cache, negative_ttl=0).define_with_source('fire'))
+            self.assertEqual(server.request_counts['owlbot'], {404: 3})
+
+            # An API is asked again once it recovers
+            behaviors['unofficial_google'] = BackendBehavior(definition_count=2)
+            result = asyncio.run(SequentialDictionaryAPI(apis, cache=cache).define_with_source('water'))
+            self.assertEqual(result.source, 'unofficial_google')
+
+
+class TestLoopMonitor(unittest.TestCase):
+
+    def test_stall(self):
+        monitor = LoopMonitor(interval=0.01, threshold=0.1)
+
+        def block():
+            time.sleep(0.3)
+
+        async def run():
+            monitor.start()
+            await asyncio.sleep(0.05)
+            block()
+            await asyncio.sleep(0.05)
+            monitor.stop()
+
+        asyncio.run(run())
+        stalls = monitor.stalls
+        self.assertEqual(len(stalls), 1)
+        self.assertGreaterEqual(stalls[0].duration, 0.2)
+        self.assertIn('in block', stalls[0].stack)
+        self.assertEqual(monitor.stats()['stalls'], 1)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_render(self):
+        registry = Registry()
+        counter = registry.counter('requests', 'Number of requests.', ['api'])
+        histogram = registry.histogram('latency_seconds', 'Request latency.', buckets=(0.1, 1))
+        counter.labels('owlbot').inc()
+        counter.labels('owlbot').inc(2)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(registry.render(), '# HELP requests Number of requests.\n'
+                                            '# TYPE requests counter\n'
+                                            'requests_total{api="owlbot"} 3\n'
+                                            '# HELP latency_seconds Request latency.\n'
+                                            '# TYPE latency_seconds histogram\n'
+                                            'latency_seconds_bucket{le="0.1"} 1\n'
+                                            'latency_seconds_bucket{le="1"} 2\n'
+                                            'latency_seconds_bucket{le="+Inf"} 3\n'
+                                            'latency_seconds_sum 5.55\n'
+                                            'latency_seconds_count 3\n')
+
+
+class TestCache(unittest.TestCase):
+
+    def tearDown(self):
+        # Discard the analytics of the dictionary API requests
+        for table in tables.values():
+            table.swap()
+
+    def test_memory_cache(self):
+        cache = MemoryCache(max_bytes=10)
+        cache.set('definitions', 'a', b'12345')
+        cache.set('definitions', 'b', b'12345')
+        self.assertEqual(cache.get('definitions', 'a'), b'12345')
+
+        # "b" is the least recently used, so it is evicted first
+        cache.set('audio', 'a', b'123')
+        self.assertIsNone(cache.get('definitions', 'b'))
+        self.assertEqual(cache.get('definitions', 'a'), b'12345')
+        self.assertEqual(cache.get('audio', 'a'), b'123')
+
+    def test_sqlite_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.db')
+            first = SQLiteCache(path, max_bytes=1000)
+            second = SQLiteCache(path, max_bytes=1000)
+
+            # Values written by one instance can be read by another
+            first.set('translations', 'en:fr:water', b'eau')
+            self.assertEqual(second.get('translations', 'en:fr:water'), b'eau')
+            self.assertIsNone(second.get('definitions', 'en:fr:water'))
+
+            # The oldest values are evicted
+            for i in range(SQLiteCache.EVICTION_CHECK_INTERVAL):
+                second.set('audio', str(i), bytes(100))
+            self.assertIsNone(first.get('translations', 'en:fr:water'))
+            self.assertIsNotNone(first.get('audio', str(SQLiteCache.EVICTION_CHECK_INTERVAL - 1)))
+
+            first.close()
+            second.close()
+
+    def test_mapped_file_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache')
+            first = MappedFileCache(path, max_bytes=4096, average_record_size=64)
+            second = MappedFileCache(path)
+
+            # Values written by one instance can be read by another
+            first.set('definitions', 'water', b'liquid')
+            self.assertEqual(second.get('definitions', 'water'), b'liquid')
+            self.assertIsNone(second.get('translations', 'water'))
+
+            # Streams read directly from the file
+            first.set('audio', 'water', bytes(range(100)))
+            stream = second.open('audio', 'water')
+            self.assertEqual(stream.getbuffer().nbytes, 100)
+            self.assertEqual(stream.read(10), bytes(range(10)))
+
+            # New records overwrite the oldest ones. A stream of an overwritten record ends early.
+            for i in range(100):
+                first.set('audio', str(i), bytes(100))
+            self.assertIsNone(second.get('definitions', 'water'))
+            self.assertEqual(stream.read(), b'')
+            self.assertEqual(second.get('audio', '99'), bytes(100))
+
+            stream.close()
+            first.close()
+            second.close()
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            word_counts_path = os.path.join(directory, 'word_counts.csv')
+            with open(word_counts_path, 'w') as file:
+                file.write('word,count\nwater,3\nWater,2\nfire,4\n$$$,10\n')
+            word_counts = read_word_counts(word_counts_path, word_filter=is_valid_word)
+            self.assertEqual(word_counts.most_common(), [('water', 5), ('fire', 4)])
+
+            # Warm a cache and write it to a snapshot
+            staging = MemoryCache()
+            with MockDictionaryServer({}, BackendBehavior(definition_count=2)) as server:
+                apis = server.create_apis()
+                definitions = asyncio.run(CacheWarmer(apis, staging).define(['water', 'fire']))
+            self.assertEqual(len(definitions['water']), 2)
+            snapshot_path = os.path.join(directory, 'snapshot.bin')
+            self.assertEqual(write_snapshot(snapshot_path, staging.items()), 2)
+
+            # Definitions are served from the loaded snapshot after the server is gone
+            cache = MappedFileCache(os.path.join(directory, 'cache'), max_bytes=4096, average_record_size=64)
+            self.assertEqual(cache.load_snapshot(snapshot_path), 2)
+            result = asyncio.run(SequentialDictionaryAPI(apis, cache=cache).define_with_source('fire'))
+            self.assertEqual(list(result.entries), definitions['fire'])
+            cache.close()
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_limit(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch('time.time', return_value=1000.0) as time_mock:
+            path = os.path.join(directory, 'limit.bin')
+            limiter = RateLimiter(10, datetime.timedelta(seconds=100), path=path, reserved=3)
+
+            # Low priority requests can't use the reserved requests
+            with request_priority(Priority.LOW):
+                self.assertEqual(limiter.remaining(), 7)
+                for _ in range(7):
+                    self.assertTrue(limiter.try_acquire())
+                self.assertFalse(limiter.try_acquire())
+            self.assertEqual(limiter.remaining(), 3)
+            self.assertTrue(limiter.try_acquire(3))
+
+            # The count is kept after a restart
+            limiter.close()
+            limiter = RateLimiter(10, datetime.timedelta(seconds=100), path=path, reserved=3)
+            self.assertFalse(limiter.try_acquire())
+
+            # Halfway through the next window, half of the previous window's requests still count
+            time_mock.return_value = 1150.0
+            self.assertEqual(limiter.remaining(), 5)
+            limiter.close()
+
+
+class TestTracing(unittest.TestCase):
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.json')
+            exporter = FileExporter(path)
+            tracer = Tracer(exporter)
+
+            async def child():
+                with tracer.span('child'):
+                    await asyncio.sleep(0)
+
+            async def run():
+                with tracer.start_trace('define', 1234):
+                    with tracer.span('settings.get', key='language') as span:
+                        span.set_attribute('hit', True)
+                    await asyncio.wait_for(child(), 1)
+
+                # Spans outside of a trace are ignored
+                with tracer.span('ignored'):
+                    pass
+
+            asyncio.run(run())
+
+            # Traces that are not sampled are not exported
+            with Tracer(exporter, sample_rate=0).start_trace('define', 5678):
+                pass
+            exporter.shutdown()
+
+            with open(path) as file:
+                lines = file.readlines()
+        self.assertEqual(len(lines), 1)
+        spans = {span['name']: span for span in json.loads(lines[0])['resourceSpans'][0]['scopeSpans'][0]['spans']}
+        self.assertEqual(set(spans), {'define', 'settings.get', 'child'})
+        self.assertEqual({span['traceId'] for span in spans.values()}, {f'{1234:032x}'})
+        self.assertNotIn('parentSpanId', spans['define'])
+        self.assertEqual(spans['settings.get']['parentSpanId'], spans['define']['spanId'])
+        self.assertEqual(spans['child']['parentSpanId'], spans['define']['spanId'])
+        self.assertIn({'key': 'hit', 'value': {'boolValue': True}}, spans['settings.get']['attributes'])
+
+
+class TestWordStore(unittest.TestCase):
+
+    def tearDown(self):
+        # Discard the analytics of the dictionary API requests
+        for table in tables.values():
+            table.swap()
+
+    def test_lookup(self):
+        definitions = {
+            'Water': [DefinitionEntry('noun', 'A clear liquid.')],
+            'water': [DefinitionEntry('verb', 'To pour water on.')],
+            'waterfall': [DefinitionEntry('noun', 'Water falling from a height.')],
+            'a': [DefinitionEntry('noun', 'The first letter of the alphabet.')],
+            'café': [DefinitionEntry('noun', 'A coffee shop.')],
+            'empty': []
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dictionary.bin')
+            self.assertEqual(write_word_store(path, definitions), 4)
+
+            store = WordStore(path)
+            self.assertEqual(store.get('WATER'), definitions['Water'] + definitions['water'])
+            self.assertEqual(store.get('a'), definitions['a'])
+            self.assertEqual(store.get('café'), definitions['café'])
+            self.assertIsNone(store.get('wat'))
+            self.assertIsNone(store.get('empty'))
+            self.assertEqual(store.words_with_prefix('wa'), ['water', 'waterfall'])
+            self.assertEqual(store.words_with_prefix('a'), ['a'])
+            self.assertEqual(store.words_with_prefix('', limit=2), ['a', 'café'])
+            store.close()
+
+            # Local definitions are not cached
+            cache = MemoryCache()
+            result = asyncio.run(SequentialDictionaryAPI([LocalDictionaryAPI(path)], cache=cache).define_with_source('waterfall'))
+            self.assertEqual(result.source, 'local')
+            self.assertEqual(len(result.entries), 1)
+            self.assertEqual(list(cache.items()), [])
+
+
+class TestSpellingIndex(unittest.TestCase):
+
+    def test_suggest(self):
+        self.assertEqual(edit_distance('water', 'wtaer', 2), 1)
+        self.assertEqual(edit_distance('water', 'wafer', 2), 1)
+        self.assertEqual(edit_distance('water', 'fire', 2), 3)
+
+        index = SpellingIndex(['water', 'wafer', 'waiter', 'later', 'dictionary', 'definition', 'fire'], prefix_length=5)
+        self.assertIn('Water', index)
+        self.assertNotIn('watr', index)
+        self.assertEqual(index.suggest('water'), ['water'])
+        self.assertEqual(index.suggest('wtaer')[0], 'water')
+        self.assertEqual(set(index.suggest('watr')), {'water', 'wafer', 'waiter', 'later'})
+
+        # Typos past the indexed prefix are found too
+        self.assertEqual(index.suggest('dictionery'), ['dictionary'])
+        self.assertEqual(index.suggest('zzzzz'), [])
+
+
+class TestWordCompleter(unittest.TestCase):
+
+    def test_complete(self):
+        with tempfile.TemporaryDirectory() as directory:
+            word_list_path = os.path.join(directory, 'words.txt')
+            with open(word_list_path, 'w') as file:
+                file.write('water\nwaterfall\nwave\nwax\nfire\n')
+            word_counts_path = os.path.join(directory, 'word_counts.csv')
+            with open(word_counts_path, 'w') as file:
+                file.write('word,count\nwax,5\nwave,2\nfire,1\n')
+
+            completer = WordCompleter(word_list_path, word_counts_path)
+            self.assertEqual(completer.complete('wa'), [])
+            completer.refresh()
+
+            # Popular words come first, then the rest in alphabetical order
+            self.assertEqual(completer.complete('WA'), ['wax', 'wave', 'water', 'waterfall'])
+            self.assertEqual(completer.complete('wa', limit=2), ['wax', 'wave'])
+            self.assertEqual(completer.complete(''), ['wax', 'wave', 'fire', 'water', 'waterfall'])
+            self.assertEqual(completer.complete('z'), [])
+
+            # Requests since the bot started count after the next refresh
+            for _ in range(10):
+                completer.record('Waterfall')
+            completer.refresh()
+            self.assertEqual(completer.complete('wa'), ['waterfall', 'wax', 'wave', 'water'])
+
+
+class TestDefinitionResult(unittest.TestCase):
+
+    def test_serialization(self):
+        result = DefinitionResult('café', 'owlbot', (DefinitionEntry('noun', 'A coffee shop.'), DefinitionEntry('', 'Null\0 character.')), 'fr')
+        decoded = DefinitionResult.from_bytes(result.to_bytes())
+        self.assertEqual(decoded, result._replace(entries=(result.entries[0], DefinitionEntry('', 'Null character.'))))
+        self.assertEqual(DefinitionResult.from_bytes(DefinitionResult('missing', None, ()).to_bytes()), DefinitionResult('missing', None, ()))
+
+        # Entries cached as JSON before this format existed are rejected
+        with self.assertRaises(ValueError):
+            DefinitionResult.from_bytes(json.dumps([{'word_type': 'noun', 'definition': 'A clear liquid.'}]).encode())
+
+
+class TestJSONDecoder(unittest.TestCase):
+
+    def test_decoders(self):
+        payloads = read_payloads()
+        default_decoder = get_json_decoder()
+        results = {}
+        try:
+            for name in DECODERS:
+                set_json_decoder(name)
+                results[name] = {api.id(): api.parse_response(payloads[api.id()]) for api in create_apis()}
+        finally:
+            set_json_decoder(default_decoder)
+
+        # Every decoder gets the same definitions
+        for name, result in results.items():
+            self.assertEqual(result, results['json'], name)
+        self.assertEqual({api_id: len(definitions) for api_id, definitions in results['json'].items()},
+                         {'owlbot': 8, 'unofficial_google': 3, 'merriam_webster_collegiate': 3, 'rapid_words': 16})
+        self.assertEqual(results['json']['unofficial_google'][1].word_type, 'verb')
+
+        with self.assertRaises(ValueError):
+            set_json_decoder('unknown')
+
+
 if __name__ == '__main__':
     unittest.main()